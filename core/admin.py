@@ -1,6 +1,7 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Product, ProductImage, Order, Category, OrderStatusHistory
+from .models import User, Product, ProductImage, Order, Category, OrderStatusHistory, StockReservation
+from .services import transition_orders
 
 # 启用多图上传界面 (Block B1)
 class ProductImageInline(admin.TabularInline):
@@ -10,14 +11,18 @@ class ProductImageInline(admin.TabularInline):
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     # A6: 在列表中显示 Brand
-    list_display = ('id', 'name', 'brand', 'price', 'stock_quantity', 'is_active')
-    search_fields = ('name', 'id', 'brand') 
+    list_display = ('id', 'name', 'sku', 'brand', 'price', 'stock_quantity', 'is_active')
+    search_fields = ('name', 'id', 'sku', 'brand')
     list_filter = ('category', 'brand', 'is_active')
     inlines = [ProductImageInline]
+
+    def get_queryset(self, request):
+        # admin_photo 预览直接 JOIN 主图，不再逐行查询
+        return super().get_queryset(request).with_primary_image()
     # A6: 编辑页面包含新字段
     fieldsets = (
         (None, {
-            'fields': ('category', 'name', 'description_html', 'price', 'stock_quantity', 'is_active')
+            'fields': ('category', 'name', 'sku', 'description_html', 'price', 'stock_quantity', 'is_active')
         }),
         ('Advanced Attributes (Block A6)', {
             'fields': ('brand', 'material', 'origin'),
@@ -28,13 +33,36 @@ class OrderStatusInline(admin.TabularInline):
     extra = 0
     readonly_fields = ('changed_at',)
 
+def _bulk_status_action(status):
+    """生成批量修改订单状态的 admin action (遵循 Order.ALLOWED_TRANSITIONS)"""
+    def action(modeladmin, request, queryset):
+        selected = queryset.count()
+        changed = transition_orders(queryset, status, enforce_workflow=True)
+        modeladmin.message_user(request, f"{len(changed)} order(s) marked as {status.label}.", messages.SUCCESS)
+        if selected > len(changed):
+            modeladmin.message_user(
+                request,
+                f"{selected - len(changed)} order(s) skipped: not allowed from their current status.",
+                messages.WARNING,
+            )
+    action.__name__ = f'mark_{status.value.lower()}'
+    action.short_description = f"Mark selected orders as {status.label}"
+    return action
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     # Block B3: 允许按状态过滤
     list_filter = ('status', 'created_at')
     list_display = ('id', 'user', 'total_amount', 'status', 'created_at')
+    list_select_related = ('user',)
     # 在订单详情里显示状态变更历史 (Block B4)
     inlines = [OrderStatusInline]
+    actions = [
+        _bulk_status_action(Order.Status.SHIPPED),
+        _bulk_status_action(Order.Status.HOLD),
+        _bulk_status_action(Order.Status.CANCELLED),
+    ]
 
 # 注册其他模型
 # 使用 UserAdmin 来管理自定义用户，这样后台不仅能管理用户，还能保留修改密码等功能
@@ -49,4 +77,11 @@ class CustomUserAdmin(UserAdmin):
     list_display = UserAdmin.list_display + ('role',)
     list_filter = UserAdmin.list_filter + ('role',)
 
-admin.site.register(Category)
\ No newline at end of file
+admin.site.register(Category)
+
+# 购物车库存预占 (只读查看，过期数据由 release_expired_reservations 清理)
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'product', 'quantity', 'expires_at')
+    list_select_related = ('user', 'product')
+    raw_id_fields = ('user', 'product')
\ No newline at end of file
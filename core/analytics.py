@@ -0,0 +1,365 @@
+"""
+报表与分析 (Reports and Analytics)
+
+DailyProductSales 预聚合表的维护：
+- 新订单 / 订单状态变化时增量更新 (record_sales_changes)
+- 全量重建 (rebuild_daily_sales)，供 rebuild_sales_rollup 命令使用
+- 报表页各个图表面板的数据计算 (ANALYTICS_PANELS)，每个面板只依赖自己的筛选参数
+"""
+import datetime
+import random
+from array import array
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek, TruncYear
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .caching import invalidate_analytics_cache
+from .models import DailyProductSales, Order, OrderItem
+
+# 计入报表的订单状态 (不含待处理、已取消、已退款)
+REPORTED_STATUSES = [
+    status for status in Order.Status.values
+    if status not in (Order.Status.CANCELLED, Order.Status.REFUNDED, Order.Status.PENDING)
+]
+
+
+def _sales_deltas(changes):
+    """
+    changes: [(order_id, old_status, new_status)]，新订单的 old_status 为 None。
+    返回 {(date, product_id, product_name, status): [quantity, revenue, order_count]}
+    """
+    transitions = {order_id: (old_status, new_status) for order_id, old_status, new_status in changes}
+    items = OrderItem.objects.filter(order_id__in=transitions.keys()).values_list(
+        'order_id', 'order__created_at', 'product_id', 'product_name_snapshot', 'quantity', 'unit_price_snapshot'
+    )
+
+    # 同一订单同一商品可能有多行，订单数只算一次
+    per_order = defaultdict(lambda: [0, Decimal('0')])
+    for order_id, created_at, product_id, name, quantity, unit_price in items.iterator(chunk_size=2000):
+        day = timezone.localtime(created_at).date()
+        line = per_order[(order_id, day, product_id, name)]
+        line[0] += quantity
+        line[1] += quantity * unit_price
+
+    deltas = defaultdict(lambda: [0, Decimal('0'), 0])
+    for (order_id, day, product_id, name), (quantity, revenue) in per_order.items():
+        old_status, new_status = transitions[order_id]
+        for status, sign in ((old_status, -1), (new_status, 1)):
+            if status is None:
+                continue
+            delta = deltas[(day, product_id, name, status)]
+            delta[0] += sign * quantity
+            delta[1] += sign * revenue
+            delta[2] += sign
+    return deltas
+
+
+def _apply_deltas(deltas):
+    """
+    把增量写入汇总表：已存在的行加锁后 bulk_update，不存在的 bulk_create。
+    查询数量与涉及的 (日期, 商品) 组合数无关。
+    """
+    if not deltas:
+        return
+    keys = list(deltas)
+    product_ids = {key[1] for key in keys if key[1] is not None}
+    existing = DailyProductSales.objects.select_for_update().filter(
+        Q(product_id__in=product_ids) | Q(product__isnull=True),
+        date__in={key[0] for key in keys},
+        status__in={key[3] for key in keys},
+    )
+    rows = {(row.date, row.product_id, row.product_name_snapshot, row.status): row for row in existing}
+
+    to_update, to_create = [], []
+    for key, (quantity, revenue, order_count) in deltas.items():
+        row = rows.get(key)
+        if row is None:
+            day, product_id, name, status = key
+            to_create.append(DailyProductSales(
+                date=day, product_id=product_id, product_name_snapshot=name, status=status,
+                quantity=quantity, revenue=revenue, order_count=order_count,
+            ))
+        else:
+            row.quantity += quantity
+            row.revenue += revenue
+            row.order_count += order_count
+            to_update.append(row)
+
+    if to_update:
+        DailyProductSales.objects.bulk_update(to_update, ['quantity', 'revenue', 'order_count'])
+        # 搬空的行直接删掉，避免 Pending 等中间状态越积越多
+        DailyProductSales.objects.filter(pk__in=[row.pk for row in to_update], order_count=0).delete()
+    if to_create:
+        try:
+            with transaction.atomic():
+                DailyProductSales.objects.bulk_create(to_create)
+        except IntegrityError:
+            # 并发结算刚好同时创建了同一行：逐行改为 F() 累加
+            for row in to_create:
+                _add_row(row)
+
+
+def _add_row(row):
+    lookup = dict(date=row.date, product_id=row.product_id, product_name_snapshot=row.product_name_snapshot, status=row.status)
+    updated = DailyProductSales.objects.filter(**lookup).update(
+        quantity=F('quantity') + row.quantity,
+        revenue=F('revenue') + row.revenue,
+        order_count=F('order_count') + row.order_count,
+    )
+    if not updated:
+        DailyProductSales.objects.create(**lookup, quantity=row.quantity, revenue=row.revenue, order_count=row.order_count)
+
+
+def record_sales_changes(changes):
+    """
+    新订单或订单状态变化后调用 (须在同一事务中)：
+    changes 为 [(order_id, old_status, new_status)]，新订单的 old_status 传 None。
+    """
+    if changes:
+        _apply_deltas(_sales_deltas(changes))
+        # 事务提交后让已缓存的图表结果失效
+        transaction.on_commit(invalidate_analytics_cache)
+
+
+def rebuild_daily_sales(batch_size=2000):
+    """从 OrderItem 全量重建汇总表，返回写入的行数"""
+    rows = (
+        OrderItem.objects
+        .annotate(date=TruncDate('order__created_at'))
+        .values('date', 'product_id', 'product_name_snapshot', 'order__status')
+        .annotate(
+            total_qty=Sum('quantity'),
+            total_rev=Sum(F('quantity') * F('unit_price_snapshot')),
+            orders=Count('order_id', distinct=True),
+        )
+        .order_by()
+    )
+    total = 0
+    with transaction.atomic():
+        DailyProductSales.objects.all().delete()
+        batch = []
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(DailyProductSales(
+                date=row['date'],
+                product_id=row['product_id'],
+                product_name_snapshot=row['product_name_snapshot'],
+                status=row['order__status'],
+                quantity=row['total_qty'],
+                revenue=row['total_rev'],
+                order_count=row['orders'],
+            ))
+            if len(batch) >= batch_size:
+                DailyProductSales.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            DailyProductSales.objects.bulk_create(batch)
+            total += len(batch)
+        transaction.on_commit(invalidate_analytics_cache)
+    return total
+
+
+# ==============================
+# 图表面板 (Analytics Panels)
+# ==============================
+
+def reported_sales():
+    return DailyProductSales.objects.filter(status__in=REPORTED_STATUSES)
+
+
+def filter_by_date(queryset, start_str, end_str):
+    """按 [start, end] 过滤汇总表，无法解析的日期忽略"""
+    start = parse_date(start_str) if start_str else None
+    end = parse_date(end_str) if end_str else None
+    if start:
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        queryset = queryset.filter(date__lte=end)
+    return queryset
+
+
+def trunc_expression(group_by):
+    """聚合截断粒度 (年/月/周/日)"""
+    if group_by == 'year':
+        return TruncYear('date')
+    if group_by == 'month':
+        return TruncMonth('date')
+    if group_by == 'week':
+        return TruncWeek('date')
+    return F('date')
+
+
+def format_bucket(day, group_by):
+    """根据粒度格式化显示标签"""
+    if group_by == 'year':
+        return day.strftime('%Y')
+    if group_by == 'month':
+        return day.strftime('%Y-%m')
+    if group_by == 'week':
+        return f"{day.strftime('%Y-%m-%d')} (W{day.isocalendar()[1]})"
+    return day.strftime('%Y-%m-%d')
+
+
+def bucket_range(first, last, group_by):
+    """first 到 last (均为已截断的日期) 之间的所有时间桶，包括没有销量的桶"""
+    buckets = []
+    day = first
+    while day <= last:
+        buckets.append(day)
+        if group_by == 'year':
+            day = day.replace(year=day.year + 1)
+        elif group_by == 'month':
+            day = day.replace(year=day.year + day.month // 12, month=day.month % 12 + 1)
+        elif group_by == 'week':
+            day += datetime.timedelta(weeks=1)
+        else:
+            day += datetime.timedelta(days=1)
+    return buckets
+
+
+def _random_color(g=(50, 220), b=(50, 220)):
+    return random.randint(50, 220), random.randint(*g), random.randint(*b)
+
+
+def top_products_panel(params):
+    """销量前 Top3 产品 (不受任何筛选参数影响)"""
+    top_products = reported_sales().values(
+        'product_name_snapshot'
+    ).annotate(
+        total_qty=Sum('quantity'),
+        total_revenue=Sum('revenue')
+    ).order_by('-total_qty')[:3]
+    return {'top_products': list(top_products)}
+
+
+def revenue_panel(params):
+    """销售额折线图"""
+    group_by = params.get('group_by') or 'day'
+    sales = filter_by_date(reported_sales(), params.get('start_date'), params.get('end_date'))
+    revenue_data = sales.annotate(
+        date_group=trunc_expression(group_by)
+    ).values('date_group').annotate(
+        daily_total=Sum('revenue')
+    ).order_by('date_group')
+
+    labels, totals = [], []
+    for item in revenue_data:
+        if item['date_group']:
+            labels.append(format_bucket(item['date_group'], group_by))
+            totals.append(float(item['daily_total']))
+    return {'labels': labels, 'totals': totals}
+
+
+def comparison_panel(params):
+    """特定商品销量与销售额对比"""
+    group_by = params.get('cmp_group_by') or 'day'
+    # 用户选择的指标（revenue, quantity, 或 both）
+    metric = params.get('cmp_metric') or 'both'
+    selected_pids = [pid for pid in params.getlist('selected_products') if pid]
+
+    cmp_labels, cmp_datasets = [], []
+    if not selected_pids:
+        return {'cmp_labels': cmp_labels, 'cmp_datasets': cmp_datasets}
+
+    sales = filter_by_date(reported_sales(), params.get('cmp_start_date'), params.get('cmp_end_date'))
+    cmp_data = sales.filter(product_id__in=selected_pids).annotate(
+        date_group=trunc_expression(group_by)
+    ).values('date_group', 'product_id', 'product_name_snapshot').annotate(
+        daily_qty=Sum('quantity'),
+        daily_rev=Sum('revenue')
+    ).order_by('date_group')
+
+    # 时间桶 -> 下标只计算一次，每个商品预分配定长数组后按下标写入，缺失的桶保持 0
+    rows = [item for item in cmp_data if item['date_group']]
+    if not rows:
+        return {'cmp_labels': cmp_labels, 'cmp_datasets': cmp_datasets}
+    buckets = bucket_range(min(item['date_group'] for item in rows), max(item['date_group'] for item in rows), group_by)
+    index = {day: i for i, day in enumerate(buckets)}
+    cmp_labels = [format_bucket(day, group_by) for day in buckets]
+
+    size = len(buckets)
+    product_series = {}
+    for item in rows:
+        pid = item['product_id']
+        data = product_series.get(pid)
+        if data is None:
+            data = product_series[pid] = {
+                'name': item['product_name_snapshot'],
+                'qty': array('q', [0]) * size,
+                'rev': array('d', [0.0]) * size,
+            }
+        i = index[item['date_group']]
+        # 同一商品改过名时同一个桶会有多行，累加
+        data['qty'][i] += int(item['daily_qty'])
+        data['rev'][i] += float(item['daily_rev'])
+
+    for pid, data in product_series.items():
+        color_base = '{}, {}, {}'.format(*_random_color())
+
+        # 根据用户的选择 (metric) 决定放入哪些线段
+        if metric in ['both', 'revenue']:
+            cmp_datasets.append({
+                'label': f"{data['name']} (Revenue ¥)",
+                'data': data['rev'].tolist(),
+                'borderColor': f'rgba({color_base}, 1)',
+                'backgroundColor': f'rgba({color_base}, 0.1)',
+                'yAxisID': 'y-revenue',
+                'tension': 0.3,
+                'fill': True
+            })
+        if metric in ['both', 'quantity']:
+            cmp_datasets.append({
+                'label': f"{data['name']} (Quantity)",
+                'data': data['qty'].tolist(),
+                'borderColor': f'rgba({color_base}, 0.8)',
+                'borderDash': [5, 5],
+                'yAxisID': 'y-quantity',
+                'tension': 0.3,
+                'fill': False
+            })
+    return {'cmp_labels': cmp_labels, 'cmp_datasets': cmp_datasets}
+
+
+def pie_panel(params):
+    """所有商品销售额占比扇形图"""
+    pie_start_str = params.get('pie_start_date')
+    pie_end_str = params.get('pie_end_date')
+
+    if pie_start_str and pie_end_str:
+        pie_date_range_info = f"From {pie_start_str} to {pie_end_str}"
+    elif pie_start_str:
+        pie_date_range_info = f"Since {pie_start_str}"
+    elif pie_end_str:
+        pie_date_range_info = f"Until {pie_end_str}"
+    else:
+        pie_date_range_info = "All Time Data"
+
+    # 聚合这段时间内的总销售额
+    pie_stats = filter_by_date(reported_sales(), pie_start_str, pie_end_str) \
+        .values('product_name_snapshot') \
+        .annotate(total_rev=Sum('revenue')) \
+        .filter(total_rev__gt=0) \
+        .order_by('-total_rev')
+
+    pie_labels = [item['product_name_snapshot'] for item in pie_stats]
+    return {
+        'pie_labels': pie_labels,
+        'pie_data': [float(item['total_rev']) for item in pie_stats],
+        'pie_colors': ['rgba({}, {}, {}, 0.7)'.format(*_random_color((100, 200), (150, 250))) for _ in pie_labels],
+        'pie_date_range_info': pie_date_range_info,
+    }
+
+
+# 面板名 -> (计算函数, 参与缓存 key 的参数)
+# 修改某个面板的筛选条件只会让该面板重新计算
+ANALYTICS_PANELS = {
+    'top': (top_products_panel, ()),
+    'revenue': (revenue_panel, ('start_date', 'end_date', 'group_by')),
+    'comparison': (comparison_panel, ('cmp_start_date', 'cmp_end_date', 'cmp_group_by', 'cmp_metric', 'selected_products')),
+    'pie': (pie_panel, ('pie_start_date', 'pie_end_date')),
+}
@@ -0,0 +1,314 @@
+"""
+缓存工具 (Caching Helpers)
+
+集中管理缓存 key 和失效逻辑，避免各个 view 里散落硬编码的 key。
+"""
+import hashlib
+import uuid
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+
+# 购物车角标数量缓存 1 小时；购物车变动时会主动失效
+CART_COUNT_TIMEOUT = 60 * 60
+
+
+def _cart_count_key(user_id):
+    return f'cart_item_count:{user_id}'
+
+
+def get_cart_item_count(user_id):
+    """购物车内商品总件数：先读缓存，未命中时用一条聚合 SQL 计算"""
+    key = _cart_count_key(user_id)
+    count = cache.get(key)
+    if count is None:
+        from .models import CartItem
+
+        count = CartItem.objects.filter(cart__user_id=user_id).aggregate(total=Sum('quantity'))['total'] or 0
+        cache.set(key, count, CART_COUNT_TIMEOUT)
+    return count
+
+
+def invalidate_cart_item_count(user_id):
+    cache.delete(_cart_count_key(user_id))
+
+
+# ==============================
+# 报表结果缓存 (Analytics)
+# ==============================
+
+# 影响图表结果的查询参数及其默认值，其它参数 (如 page) 不参与缓存 key
+ANALYTICS_PARAMS = {
+    'start_date': '',
+    'end_date': '',
+    'group_by': 'day',
+    'cmp_start_date': '',
+    'cmp_end_date': '',
+    'cmp_group_by': 'day',
+    'cmp_metric': 'both',
+    'pie_start_date': '',
+    'pie_end_date': '',
+}
+ANALYTICS_VERSION_KEY = 'analytics:version'
+ANALYTICS_HITS_KEY = 'analytics:hits'
+ANALYTICS_MISSES_KEY = 'analytics:misses'
+
+
+def _analytics_timeout():
+    return getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', 300)
+
+
+def normalize_analytics_params(params, names=None):
+    """
+    规范化 GET 参数：补默认值、去掉空值、selected_products 去重排序。
+    names 指定只取哪些参数 (每个图表面板只关心自己的筛选条件)，默认全部。
+    """
+    if names is None:
+        names = [*ANALYTICS_PARAMS, 'selected_products']
+    normalized = []
+    for name in names:
+        if name == 'selected_products':
+            selected = sorted({pid for pid in params.getlist(name) if pid})
+            normalized.append((name, ','.join(selected)))
+        else:
+            normalized.append((name, params.get(name) or ANALYTICS_PARAMS[name]))
+    return normalized
+
+
+def analytics_cache_key(panel, params, names=None):
+    # 版本号变化 (订单变动) 后旧 key 自然失效
+    version = cache.get_or_set(ANALYTICS_VERSION_KEY, uuid.uuid4().hex, None)
+    digest = hashlib.md5(urlencode(normalize_analytics_params(params, names)).encode()).hexdigest()
+    return f'analytics:{version}:{panel}:{digest}'
+
+
+def _incr(key):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # 计数 key 刚好被淘汰
+        cache.set(key, 1, None)
+
+
+def get_analytics_result(panel, params, compute, names=None):
+    """按规范化参数读取缓存，未命中时调用 compute() 计算并缓存 (TTL + 事件失效)"""
+    key = analytics_cache_key(panel, params, names)
+    result = cache.get(key)
+    if result is None:
+        _incr(ANALYTICS_MISSES_KEY)
+        result = compute()
+        cache.set(key, result, _analytics_timeout())
+    else:
+        _incr(ANALYTICS_HITS_KEY)
+    return result
+
+
+def invalidate_analytics_cache():
+    """订单新增或状态变化后调用：换一个版本号，所有已缓存的图表结果一起失效"""
+    cache.set(ANALYTICS_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def analytics_cache_stats():
+    hits = cache.get(ANALYTICS_HITS_KEY, 0)
+    misses = cache.get(ANALYTICS_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits * 100 / total, 1) if total else 0,
+    }
+
+
+def reset_analytics_cache_stats():
+    cache.delete_many([ANALYTICS_HITS_KEY, ANALYTICS_MISSES_KEY])
+
+
+# ==============================
+# 商品目录缓存 (Catalog Facets)
+# ==============================
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def _facet_timeout():
+    return getattr(settings, 'FACET_CACHE_TIMEOUT', 300)
+
+
+def catalog_cache_key(prefix, params, names):
+    """按 names 里的 GET 参数 (多值去重排序) 生成 key；商品目录变化后版本号改变，旧 key 自然失效"""
+    version = cache.get_or_set(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
+    normalized = [(name, ','.join(sorted({value for value in params.getlist(name) if value}))) for name in names]
+    digest = hashlib.md5(urlencode(normalized).encode()).hexdigest()
+    return f'{prefix}:{version}:{digest}'
+
+
+def get_facet_counts(params, names, compute):
+    """分面计数：同样的筛选条件只计算一次，直到 TTL 过期或商品目录变化"""
+    key = catalog_cache_key('facets', params, names)
+    rows = cache.get(key)
+    if rows is None:
+        rows = compute()
+        cache.set(key, rows, _facet_timeout())
+    return rows
+
+
+def invalidate_catalog_cache():
+    """商品、商品属性、分类或评分变化后调用：换一个版本号，所有已缓存的分面计数一起失效"""
+    cache.set(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
+    # 商品目录变化，已缓存的列表页也一定过时了
+    invalidate_page_cache()
+
+
+# ==============================
+# 分类导航缓存 (Category Tree)
+# ==============================
+
+CATEGORY_TREE_KEY = 'catalog:category_tree'
+
+
+def _build_category_tree():
+    from .models import Category
+
+    children = {}
+    for node in Category.objects.order_by('name', 'pk').values('id', 'name', 'parent_id', 'path', 'depth'):
+        children.setdefault(node['parent_id'], []).append(node)
+    tree = []
+    stack = list(reversed(children.get(None, [])))
+    while stack:
+        node = stack.pop()
+        node['label'] = '— ' * node['depth'] + node['name']
+        tree.append(node)
+        stack.extend(reversed(children.get(node['id'], [])))
+    return tree
+
+
+def get_category_tree():
+    """
+    分类导航：父分类后紧跟其子分类 (同级按名称) 的 [{id, name, label, parent_id, path, depth}]。
+    一直缓存到分类新增 / 修改 / 删除为止，列表页不再每次查询 Category 全表
+    """
+    tree = cache.get(CATEGORY_TREE_KEY)
+    if tree is None:
+        tree = _build_category_tree()
+        cache.set(CATEGORY_TREE_KEY, tree, None)
+    return tree
+
+
+def invalidate_category_tree():
+    cache.delete(CATEGORY_TREE_KEY)
+
+
+# ==============================
+# 匿名访问页面缓存 (Anonymous Page Cache)
+# ==============================
+
+# 列表页 (以及分类导航片段) 的全局版本号：商品目录本身变化 (商品、属性、图片、分类) 时更换
+PAGE_VERSION_KEY = 'pages:version'
+# 单个商品的版本号：详情页、商品卡片片段；库存、评论只更换受影响商品的版本号
+PRODUCT_VERSION_KEY = 'pages:product:{}'
+
+
+def _page_timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 60)
+
+
+def page_cache_version():
+    """列表页整页缓存和分类导航片段的版本号"""
+    return cache.get_or_set(PAGE_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate_page_cache():
+    """商品目录本身变化后调用：换一个版本号，已缓存的列表页一起失效"""
+    cache.set(PAGE_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def product_cache_versions(product_ids):
+    """{product_id: 版本号}，一次 get_many；还没有版本号 (或被淘汰) 的商品补一个新的"""
+    keys = {PRODUCT_VERSION_KEY.format(pk): pk for pk in product_ids}
+    found = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys.keys() - found.keys()}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return {keys[key]: version for key, version in found.items()}
+
+
+def product_cache_version(pk):
+    """商品详情页整页缓存的版本号"""
+    return product_cache_versions([pk])[pk]
+
+
+def annotate_cache_versions(products):
+    """给商品设置 cache_version 属性，模板里 {% cache ... product.pk product.cache_version %} 使用"""
+    products = list(products)
+    versions = product_cache_versions([product.pk for product in products])
+    for product in products:
+        product.cache_version = versions[product.pk]
+    return products
+
+
+def invalidate_product_pages(product_ids):
+    """这些商品的详情页和卡片片段失效 (只换它们自己的版本号，其它页面的缓存不受影响)"""
+    product_ids = {pk for pk in product_ids if pk is not None}
+    if product_ids:
+        cache.set_many({PRODUCT_VERSION_KEY.format(pk): uuid.uuid4().hex for pk in product_ids}, None)
+
+
+def page_cache_key(request, version):
+    """路径 + 规范化的查询参数 (按名称排序、多值排序、去掉空值)，参数顺序不同的同一页面共用缓存"""
+    normalized = sorted(
+        (name, value) for name, values in request.GET.lists() for value in values if value
+    )
+    digest = hashlib.md5(f'{request.path}?{urlencode(normalized)}'.encode()).hexdigest()
+    return f'pages:{version}:{digest}'
+
+
+def _is_cacheable_request(request):
+    from django.contrib.messages import get_messages
+
+    # 有待显示的提示消息时页面内容因人而异 (读取数量不会把消息标记为已显示)
+    return request.method == 'GET' and not request.user.is_authenticated and not len(get_messages(request))
+
+
+def _is_cacheable_response(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        # 渲染时用到了 {% csrf_token %}：令牌与访问者的 cookie 绑定，不能给别人
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    )
+
+
+def cache_anonymous_page(version=page_cache_version):
+    """
+    未登录访问者的整页缓存，登录用户 (购物车数量、用户名等因人而异) 每次照常渲染。
+    version(*args, **kwargs) 以 view 的 URL 参数返回版本号，默认为列表页的全局版本号；
+    与 django.views.decorators.cache.cache_page 不同，版本号由 signals 主动更换，而不只是等 TTL 过期
+
+        @cache_anonymous_page(version=product_cache_version)
+        def product_detail(request, pk): ...
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _is_cacheable_request(request):
+                return view(request, *args, **kwargs)
+            key = page_cache_key(request, version(*args, **kwargs))
+            response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if _is_cacheable_response(request, response):
+                    cache.set(key, response, _page_timeout())
+            return response
+        return wrapper
+    return decorator
+
+
+def fragment_cache_context():
+    """模板里 {% cache fragment_timeout 片段名 ... cache_version %} 用到的变量 (分类导航用列表页版本号)"""
+    return {'cache_version': page_cache_version(), 'fragment_timeout': _page_timeout()}
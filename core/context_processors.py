@@ -1,18 +1,18 @@
-from .models import Cart
+from django.utils.functional import SimpleLazyObject
+
+from .caching import get_cart_item_count
 
 def cart_status(request):
     """
     这个函数会在每个页面加载时运行，
     专门负责计算购物车里有多少件商品。
+
+    数量是惰性计算的：只有模板真正用到 cart_item_count 时才读缓存/查库，
+    缓存由 add_to_cart / remove_from_cart / update_cart_quantity / checkout 失效。
     """
-    count = 0
-    if request.user.is_authenticated:
-        # 获取用户的购物车
-        cart = Cart.objects.filter(user=request.user).first()
-        if cart:
-            # 把每一项的数量加起来 (比如买了2个苹果，3个梨，总数是5)
-            for item in cart.cartitem_set.all():
-                count += item.quantity
-    
+    if not request.user.is_authenticated:
+        return {'cart_item_count': 0}
+
+    user_id = request.user.pk
     # 返回给模板，变量名叫 cart_item_count
-    return {'cart_item_count': count}
\ No newline at end of file
+    return {'cart_item_count': SimpleLazyObject(lambda: get_cart_item_count(user_id))}
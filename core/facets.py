@@ -0,0 +1,190 @@
+"""
+商品目录分面筛选 (Faceted Filtering)
+
+品牌 / 材质 / 产地 / 价格区间 / ProductAttribute (名称 + 值) 多选筛选，并显示每个选项的商品数。
+
+- 同一分面内多选为 OR，不同分面之间为 AND：?brand=Nike&brand=Acme&material=Leather
+- 属性参数为 "名称:值"：?attr=Color:Red&attr=Color:Blue
+- 每个分面的计数只应用 *其它* 分面的筛选 (选了 Nike 后品牌列表仍然显示 Acme 有多少件)
+- 所有分面的计数由一条 UNION ALL 分组查询得出，不是每个选项一条 COUNT；
+  结果按筛选参数缓存，商品或属性变化时失效 (见 caching.get_facet_counts)
+"""
+from collections import defaultdict
+
+from django.db.models import Case, CharField, Count, F, Q, Value, When
+from django.db.models.functions import Concat
+
+from .models import ProductAttribute
+
+FACET_FIELDS = (
+    ('brand', 'Brand'),
+    ('material', 'Material'),
+    ('origin', 'Origin'),
+)
+# (参数值, 显示名称, 下限, 上限)，区间为 [下限, 上限)
+PRICE_BANDS = (
+    ('0-50', 'Under ¥50', None, 50),
+    ('50-100', '¥50 – ¥100', 50, 100),
+    ('100-200', '¥100 – ¥200', 100, 200),
+    ('200-500', '¥200 – ¥500', 200, 500),
+    ('500+', '¥500 & above', 500, None),
+)
+PRICE_PARAM = 'price'
+ATTRIBUTE_PARAM = 'attr'
+# 所有分面参数 (缓存 key、清空筛选时使用)
+FACET_PARAMS = (*(field for field, _ in FACET_FIELDS), PRICE_PARAM, ATTRIBUTE_PARAM)
+
+# 每个分面最多显示的选项数 (按商品数排序，已选中的总是显示)
+FACET_OPTION_LIMIT = 10
+# 最多显示的属性名称数
+ATTRIBUTE_FACET_LIMIT = 5
+
+_ATTRIBUTE_PREFIX = 'attr:'
+
+
+def parse_facets(params):
+    """GET 参数 -> {分面: 选中的值}，去重排序；属性为 {'attr': {名称: [值]}}"""
+    selections = {}
+    for field, _ in FACET_FIELDS:
+        values = sorted({value for value in params.getlist(field) if value})
+        if values:
+            selections[field] = values
+    bands = {key for key, *_ in PRICE_BANDS}
+    prices = sorted(bands.intersection(params.getlist(PRICE_PARAM)))
+    if prices:
+        selections[PRICE_PARAM] = prices
+    attributes = defaultdict(set)
+    for pair in params.getlist(ATTRIBUTE_PARAM):
+        name, sep, value = pair.partition(':')
+        if sep and name and value:
+            attributes[name].add(value)
+    if attributes:
+        selections[ATTRIBUTE_PARAM] = {name: sorted(values) for name, values in sorted(attributes.items())}
+    return selections
+
+
+def _price_band_q(key):
+    _, _, low, high = next(band for band in PRICE_BANDS if band[0] == key)
+    condition = Q()
+    if low is not None:
+        condition &= Q(price__gte=low)
+    if high is not None:
+        condition &= Q(price__lt=high)
+    return condition
+
+
+def facet_filter(selections, skip=None):
+    """选中条件对应的 Q；skip 指定不应用的分面 (计算该分面自己的计数时)"""
+    condition = Q()
+    for field, values in selections.items():
+        if field == skip:
+            continue
+        if field == PRICE_PARAM:
+            bands = Q()
+            for key in values:
+                bands |= _price_band_q(key)
+            condition &= bands
+        elif field == ATTRIBUTE_PARAM:
+            for name, attribute_values in values.items():
+                condition &= Q(pk__in=ProductAttribute.objects.filter(
+                    attribute_name=name, attribute_value__in=attribute_values,
+                ).values('product_id'))
+        else:
+            condition &= Q(**{f'{field}__in': values})
+    return condition
+
+
+def apply_facets(queryset, selections):
+    return queryset.filter(facet_filter(selections)) if selections else queryset
+
+
+def _price_band_expression():
+    whens = [When(_price_band_q(key), then=Value(key)) for key, *_ in PRICE_BANDS]
+    return Case(*whens, output_field=CharField())
+
+
+def facet_count_rows(base, selections):
+    """
+    一条 UNION ALL 查询得出所有分面的计数，返回 [(分面, 值, 商品数)]。
+    base 为应用了搜索、分类等非分面条件的商品 queryset (不带排序和注解)。
+    """
+    base = base.order_by()
+    branches = []
+    for field, _ in FACET_FIELDS:
+        branches.append(
+            base.filter(facet_filter(selections, skip=field))
+            .exclude(**{f'{field}__isnull': True}).exclude(**{field: ''})
+            .annotate(facet=Value(field, output_field=CharField()), value=F(field))
+            .values('facet', 'value').annotate(n=Count('pk')).order_by()
+        )
+    branches.append(
+        base.filter(facet_filter(selections, skip=PRICE_PARAM))
+        .annotate(facet=Value(PRICE_PARAM, output_field=CharField()), value=_price_band_expression())
+        .values('facet', 'value').annotate(n=Count('pk')).order_by()
+    )
+    # 属性分面：应用除属性以外的筛选
+    branches.append(
+        ProductAttribute.objects
+        .filter(product__in=base.filter(facet_filter(selections, skip=ATTRIBUTE_PARAM)).values('pk'))
+        .annotate(
+            facet=Concat(Value(_ATTRIBUTE_PREFIX), 'attribute_name', output_field=CharField()),
+            value=F('attribute_value'),
+        )
+        .values('facet', 'value').annotate(n=Count('product_id', distinct=True)).order_by()
+    )
+    query = branches[0].union(*branches[1:], all=True)
+    return [(row['facet'], row['value'], row['n']) for row in query if row['value'] is not None]
+
+
+def _options(counts, selected, labels=None):
+    """[{value, label, count, selected}]：按商品数取前 FACET_OPTION_LIMIT 个，已选中的总是保留"""
+    if labels is not None:
+        # 价格区间按固定顺序显示
+        shown = [value for value in labels if value in counts or value in selected]
+    else:
+        ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        shown = [value for value, _ in ranked[:FACET_OPTION_LIMIT]]
+        shown += [value for value in selected if value not in shown]
+    return [
+        {
+            'value': value,
+            'label': labels.get(value, value) if labels else value,
+            'count': counts.get(value, 0),
+            'selected': value in selected,
+        }
+        for value in shown
+    ]
+
+
+def facet_groups(rows, selections):
+    """把 facet_count_rows 的结果整理成模板使用的分组列表"""
+    counts = defaultdict(dict)
+    for facet, value, n in rows:
+        counts[facet][value] = n
+
+    groups = []
+    for field, label in FACET_FIELDS:
+        options = _options(counts[field], selections.get(field, []))
+        if options:
+            groups.append({'param': field, 'label': label, 'options': options})
+
+    price_labels = {key: label for key, label, *_ in PRICE_BANDS}
+    options = _options(counts[PRICE_PARAM], selections.get(PRICE_PARAM, []), labels=price_labels)
+    if options:
+        groups.append({'param': PRICE_PARAM, 'label': 'Price', 'options': options})
+
+    selected_attributes = selections.get(ATTRIBUTE_PARAM, {})
+    attribute_counts = {
+        facet[len(_ATTRIBUTE_PREFIX):]: values
+        for facet, values in counts.items()
+        if facet.startswith(_ATTRIBUTE_PREFIX)
+    }
+    for name in selected_attributes:
+        attribute_counts.setdefault(name, {})
+    names = sorted(attribute_counts, key=lambda name: (name not in selected_attributes, -sum(attribute_counts[name].values()), name))
+    for name in names[:max(ATTRIBUTE_FACET_LIMIT, len(selected_attributes))]:
+        options = _options(attribute_counts[name], selected_attributes.get(name, []))
+        for option in options:
+            option['value'] = f"{name}:{option['value']}"
+        groups.append({'param': ATTRIBUTE_PARAM, 'label': name, 'options': options})
+    return groups
@@ -42,7 +42,7 @@ class CustomUserCreationForm(UserCreationForm):
 class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
-        fields = ['category', 'name', 'brand', 'material', 'origin', 'video', 'description_html', 'price', 'stock_quantity', 'is_active']
+        fields = ['category', 'name', 'sku', 'brand', 'material', 'origin', 'video', 'description_html', 'price', 'stock_quantity', 'is_active']
         widgets = {
             'description_html': forms.Textarea(attrs={'rows': 4}),
             'category': forms.Select(attrs={'class': 'form-select'}),
@@ -55,6 +55,18 @@ class ProductForm(forms.ModelForm):
             if not isinstance(field.widget, forms.CheckboxInput):
                 field.widget.attrs.update({'class': 'form-control'})
 
+class ProductImportForm(forms.Form):
+    """批量导入商品 (CSV / JSONL)，格式说明见 core/importers.py"""
+    file = forms.FileField(
+        label="Catalog File",
+        help_text="CSV or JSON Lines; existing products are matched by SKU",
+        widget=forms.FileInput(attrs={'class': 'form-control', 'accept': '.csv,.jsonl,.ndjson'}),
+    )
+    dry_run = forms.BooleanField(
+        label="Dry run (validate only, nothing is saved)", required=False, initial=True,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+    )
+
 # === 核心修复 Bug 2: 订单状态工作流拦截 ===
 class OrderStatusForm(forms.ModelForm):
     class Meta:
@@ -68,19 +80,10 @@ class OrderStatusForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         if self.instance and self.instance.pk:
             current_status = self.instance.status
-            allowed_statuses = []
             
-            # 定义状态机工作流 (State Machine)
-            if current_status == Order.Status.PENDING:
-                # 刚下单: 可以变为已发货、挂起、或取消
-                allowed_statuses = [Order.Status.PENDING, Order.Status.SHIPPED, Order.Status.HOLD, Order.Status.CANCELLED]
-            elif current_status == Order.Status.HOLD:
-                # 挂起中: 可以恢复发货，或者取消
-                allowed_statuses = [Order.Status.HOLD, Order.Status.SHIPPED, Order.Status.CANCELLED]
-            else:
-                # 已发货(SHIPPED) 或 已取消(CANCELLED) 或 已退款(REFUNDED):
-                # 属于最终状态 (Terminal States)，不允许再变回其他状态
-                allowed_statuses = [current_status]
+            # 状态机工作流定义在 Order.ALLOWED_TRANSITIONS (批量操作共用)
+            # 最终状态 (Terminal States) 只能保持原状态
+            allowed_statuses = [current_status, *Order.ALLOWED_TRANSITIONS.get(current_status, ())]
             
             # 动态覆盖下拉菜单的选项，防止倒退
             self.fields['status'].choices = [
@@ -0,0 +1,404 @@
+"""
+商品批量导入 (Product Catalog Import)
+
+import_products 命令与 vendor_product_import 页面共用：
+- 读取 CSV 或 JSONL，每行一个商品，按 sku 做 upsert (已存在则更新，否则新建)；
+- 分类按名称路径 "父分类 > 子分类" 匹配，不存在时自动创建；
+- 属性 / 图片引用随商品一起写入，均为整批 bulk_create / bulk_update，每批一个事务；
+- 校验失败的行记录到错误报告中，不影响其他行；dry_run 时完整执行一遍后整体回滚。
+
+CSV 列 (JSONL 同名键)：
+    sku, name, category, price, stock_quantity, brand, material, origin,
+    description_html, is_active, attributes, images
+其中 attributes 写成 "Color=Red;Size=L" (JSONL 可用对象)，
+images 写成 "product_images/a.jpg|product_images/b.jpg" (JSONL 可用数组)，第一张为主图。
+更新时留空 / 缺省的列保持原值。
+"""
+import csv
+import io
+import json
+import posixpath
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+
+from .caching import invalidate_catalog_cache, invalidate_product_pages
+from .models import Category, Product, ProductAttribute, ProductImage
+from .search import index_products
+
+# 每批写入的商品数
+IMPORT_BATCH_SIZE = 1000
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+# 直接对应 Product 字段的列
+PRODUCT_FIELDS = (
+    'name', 'price', 'stock_quantity', 'brand', 'material', 'origin', 'description_html', 'is_active',
+)
+# 新建商品时必须提供的列
+REQUIRED_FOR_CREATE = ('name', 'price', 'category')
+CATEGORY_SEPARATOR = '>'
+
+_TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
+_FALSE_VALUES = {'0', 'false', 'no', 'n', 'off'}
+
+
+class RowError(Exception):
+    """单行数据不合法"""
+
+
+class ImportResult:
+    """导入结果与逐行错误报告"""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.created = 0
+        self.updated = 0
+        # [(行号, sku, 错误信息)]
+        self.errors = []
+
+    @property
+    def processed(self):
+        return self.created + self.updated
+
+    def add_error(self, line, sku, message):
+        self.errors.append((line, sku or '', message))
+
+    def summary(self):
+        prefix = "[dry run] " if self.dry_run else ""
+        return f"{prefix}{self.created} created, {self.updated} updated, {len(self.errors)} error(s)."
+
+
+# ==============================
+# 读取文件
+# ==============================
+
+def detect_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def read_rows(stream, fmt='csv'):
+    """
+    逐行读取，返回 (行号, dict)；stream 可以是二进制文件 (如上传文件)。
+    JSONL 中无法解析的行返回 (行号, RowError)。
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # 表头占第 1 行
+            yield reader.line_num, row
+        return
+
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            yield line_no, RowError(f"Invalid JSON: {e}")
+            continue
+        yield line_no, row
+
+
+# ==============================
+# 单行校验
+# ==============================
+
+def _present(value):
+    return value is not None and not (isinstance(value, str) and not value.strip())
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE_VALUES:
+        return True
+    if text in _FALSE_VALUES:
+        return False
+    raise RowError(f"is_active: invalid boolean '{value}'")
+
+
+def _parse_attributes(value):
+    if isinstance(value, dict):
+        pairs = value.items()
+    elif isinstance(value, list):
+        pairs = [(item.get('name'), item.get('value')) for item in value if isinstance(item, dict)]
+    else:
+        pairs = []
+        for part in str(value).split(';'):
+            if not part.strip():
+                continue
+            if '=' not in part:
+                raise RowError(f"attributes: expected name=value, got '{part.strip()}'")
+            pairs.append(part.split('=', 1))
+
+    attributes = []
+    for name, attr_value in pairs:
+        name, attr_value = str(name or '').strip(), str(attr_value or '').strip()
+        if not name:
+            raise RowError("attributes: empty attribute name")
+        if len(name) > 50 or len(attr_value) > 100:
+            raise RowError(f"attributes: '{name}' is too long")
+        attributes.append((name, attr_value))
+    return attributes
+
+
+def _parse_images(value):
+    paths = value if isinstance(value, list) else str(value).split('|')
+    images = []
+    for path in paths:
+        path = str(path).strip()
+        if not path:
+            continue
+        # 只接受 MEDIA_ROOT 下的相对路径
+        normalized = posixpath.normpath(path)
+        if normalized.startswith(('/', '..')) or '://' in path:
+            raise RowError(f"images: '{path}' must be a path relative to the media directory")
+        images.append(normalized)
+    return images
+
+
+def _category_path(value):
+    names = [name.strip() for name in str(value).split(CATEGORY_SEPARATOR)]
+    if not all(names):
+        raise RowError(f"category: invalid path '{value}'")
+    return tuple(names)
+
+
+def clean_row(raw):
+    """
+    把一行原始数据转换为 {'sku', 'fields', 'category', 'attributes', 'images'}，
+    只包含提供了的列；字段校验复用模型字段自身的 clean() (长度、位数、非负等)。
+    """
+    sku = str(raw.get('sku') or '').strip()
+    if not sku:
+        raise RowError("sku: this column is required")
+    if len(sku) > Product._meta.get_field('sku').max_length:
+        raise RowError("sku: too long")
+
+    fields = {}
+    for name in PRODUCT_FIELDS:
+        value = raw.get(name)
+        if not _present(value):
+            continue
+        if name == 'is_active':
+            fields[name] = _parse_bool(value)
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+        try:
+            fields[name] = Product._meta.get_field(name).clean(value, None)
+        except ValidationError as e:
+            raise RowError(f"{name}: {' '.join(e.messages)}")
+
+    row = {'sku': sku, 'fields': fields, 'category': None, 'attributes': None, 'images': None}
+    if _present(raw.get('category')):
+        row['category'] = _category_path(raw['category'])
+    # 空单元格表示保持原样；JSONL 里显式的 [] / {} 表示清空
+    if _present(raw.get('attributes')):
+        row['attributes'] = _parse_attributes(raw['attributes'])
+    if _present(raw.get('images')):
+        row['images'] = _parse_images(raw['images'])
+    return row
+
+
+# ==============================
+# 批量写入
+# ==============================
+
+class ProductImporter:
+    """
+    用法：
+        result = ProductImporter(dry_run=True).run(read_rows(f, 'csv'))
+    """
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE, dry_run=False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self._categories = None
+
+    def run(self, rows):
+        result = ImportResult(dry_run=self.dry_run)
+        if self.dry_run:
+            # 和正式导入走完全相同的写入路径，最后整体回滚
+            with transaction.atomic():
+                self._run(rows, result)
+                transaction.set_rollback(True)
+        else:
+            self._run(rows, result)
+        return result
+
+    def _run(self, rows, result):
+        batch, seen = [], {}
+        for line, raw in rows:
+            try:
+                if isinstance(raw, RowError):
+                    raise raw
+                row = clean_row(raw)
+                if row['sku'] in seen:
+                    raise RowError(f"sku: duplicate of line {seen[row['sku']]}")
+            except RowError as e:
+                result.add_error(line, raw.get('sku') if isinstance(raw, dict) else '', str(e))
+                continue
+            seen[row['sku']] = line
+            row['line'] = line
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._write(batch, result)
+                batch = []
+        if batch:
+            self._write(batch, result)
+
+    def _write(self, batch, result):
+        try:
+            with transaction.atomic():
+                created, updated, rejected = self._write_batch(batch)
+        except DatabaseError as e:
+            # 事务已回滚，本批新建的分类也不存在了
+            self._categories = None
+            if len(batch) == 1:
+                result.add_error(batch[0]['line'], batch[0]['sku'], str(e))
+                return
+            # 整批失败时逐行重试，定位出错的行
+            for row in batch:
+                self._write([row], result)
+            return
+        result.created += created
+        result.updated += updated
+        for row, message in rejected:
+            result.add_error(row['line'], row['sku'], message)
+
+    # ------------------
+    # 分类
+    # ------------------
+
+    def _load_categories(self):
+        if self._categories is None:
+            self._categories = {
+                (parent_id, name): pk for pk, parent_id, name in Category.objects.values_list('pk', 'parent_id', 'name')
+            }
+        return self._categories
+
+    def _resolve_category(self, path):
+        """按路径逐级查找分类，不存在的创建；返回最末级分类 id"""
+        categories = self._load_categories()
+        parent_id = None
+        for name in path:
+            key = (parent_id, name)
+            if key not in categories:
+                categories[key] = Category.objects.create(name=name, parent_id=parent_id).pk
+            parent_id = categories[key]
+        return parent_id
+
+    # ------------------
+    # 商品 / 属性 / 图片
+    # ------------------
+
+    def _write_batch(self, batch):
+        """写入一批商品，返回 (新建数, 更新数, [(缺少必填列而跳过的行, 错误信息)])"""
+        existing = Product.objects.in_bulk([row['sku'] for row in batch], field_name='sku')
+
+        to_create, to_update, update_fields = [], [], set()
+        accepted, rejected = [], []
+        for row in batch:
+            product = existing.get(row['sku'])
+            if product is None:
+                missing = [name for name in REQUIRED_FOR_CREATE
+                           if (row['category'] is None if name == 'category' else name not in row['fields'])]
+                if missing:
+                    rejected.append((row, f"{', '.join(missing)}: required for new products"))
+                    continue
+            accepted.append(row)
+            category_id = self._resolve_category(row['category']) if row['category'] else None
+            if product is None:
+                product = Product(sku=row['sku'], category_id=category_id, **{'description_html': '', **row['fields']})
+                to_create.append(product)
+            else:
+                for name, value in row['fields'].items():
+                    setattr(product, name, value)
+                update_fields.update(row['fields'])
+                if category_id:
+                    product.category_id = category_id
+                    update_fields.add('category')
+                to_update.append(product)
+
+        if to_create:
+            Product.objects.bulk_create(to_create)
+        if to_update and update_fields:
+            Product.objects.bulk_update(to_update, sorted(update_fields))
+
+        # bulk_create 在部分数据库上不回填主键，统一按 sku 取一次
+        ids = dict(Product.objects.filter(sku__in=[row['sku'] for row in accepted]).values_list('sku', 'pk'))
+        self._write_attributes(accepted, ids)
+        self._write_images(accepted, ids)
+
+        # bulk 操作不触发 signals：手动刷新主图指针、搜索索引、分面计数和页面缓存
+        products = Product.objects.filter(pk__in=ids.values())
+        products.sync_primary_images()
+        index_products(products)
+        transaction.on_commit(invalidate_catalog_cache)
+        product_ids = list(ids.values())
+        transaction.on_commit(lambda: invalidate_product_pages(product_ids))
+        return len(to_create), len(to_update), rejected
+
+    def _write_attributes(self, batch, ids):
+        """提供了 attributes 列的商品：整体替换属性"""
+        rows = [row for row in batch if row['attributes'] is not None]
+        if not rows:
+            return
+        product_ids = [ids[row['sku']] for row in rows]
+        ProductAttribute.objects.filter(product_id__in=product_ids).delete()
+        ProductAttribute.objects.bulk_create([
+            ProductAttribute(product_id=ids[row['sku']], attribute_name=name, attribute_value=value)
+            for row in rows
+            for name, value in row['attributes']
+        ])
+
+    def _write_images(self, batch, ids):
+        """
+        提供了 images 列的商品：图片引用与列表保持一致，第一张为主图。
+        已存在的同路径图片保留 (不重复建行)，只删除列表里没有的；新建的图片提交后生成缩略图。
+        """
+        rows = [row for row in batch if row['images'] is not None]
+        if not rows:
+            return
+        wanted = {ids[row['sku']]: row['images'] for row in rows}
+        current = {}
+        for image in ProductImage.objects.filter(product_id__in=wanted.keys()):
+            current.setdefault(image.product_id, {})[image.image.name] = image
+
+        to_create, to_update, to_delete = [], [], []
+        for product_id, paths in wanted.items():
+            existing = current.get(product_id, {})
+            for position, path in enumerate(paths):
+                is_primary = position == 0
+                image = existing.pop(path, None)
+                if image is None:
+                    to_create.append(ProductImage(product_id=product_id, image=path, is_primary=is_primary))
+                elif image.is_primary != is_primary:
+                    image.is_primary = is_primary
+                    to_update.append(image)
+            to_delete.extend(image.pk for image in existing.values())
+
+        if to_delete:
+            ProductImage.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            ProductImage.objects.bulk_update(to_update, ['is_primary'])
+        if to_create:
+            ProductImage.objects.bulk_create(to_create)
+            # bulk_create 不经过 ProductImage.save()，缩略图在这里安排
+            ProductImage.queue_variants((image.pk, image.image.name) for image in to_create)
+
+
+def write_error_report(errors, stream):
+    """把逐行错误写成 CSV (line, sku, error)"""
+    writer = csv.writer(stream)
+    writer.writerow(['line', 'sku', 'error'])
+    writer.writerows(errors)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core.caching import analytics_cache_stats, invalidate_analytics_cache, reset_analytics_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Show hit/miss counters of the analytics results cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Reset the hit/miss counters.")
+        parser.add_argument('--invalidate', action='store_true', help="Drop all cached analytics results.")
+
+    def handle(self, *args, **options):
+        stats = analytics_cache_stats()
+        self.stdout.write(
+            f"hits={stats['hits']} misses={stats['misses']} hit_rate={stats['hit_rate']}%"
+        )
+        if options['reset']:
+            reset_analytics_cache_stats()
+            self.stdout.write("Counters reset.")
+        if options['invalidate']:
+            invalidate_analytics_cache()
+            self.stdout.write("Cached results invalidated.")
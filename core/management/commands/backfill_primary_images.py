@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Product
+
+
+class Command(BaseCommand):
+    help = "Recompute Product.primary_image in primary-key batches (safe to run on a live catalog)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        scanned = updated = 0
+
+        while True:
+            product_ids = list(
+                Product.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not product_ids:
+                break
+            # 每批一个短事务，不长时间占用锁
+            with transaction.atomic():
+                updated += Product.objects.filter(pk__in=product_ids).sync_primary_images()
+            scanned += len(product_ids)
+            last_id = product_ids[-1]
+            self.stdout.write(f"  ...{scanned} products scanned")
+
+        self.stdout.write(self.style.SUCCESS(f"Done. {updated} of {scanned} products updated."))
@@ -0,0 +1,51 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.exports import EXPORT_DATASETS, EXPORT_FORMATS, ExportError, gzip_stream, iter_export
+
+
+class Command(BaseCommand):
+    help = "Stream orders, order items or status history to CSV / JSON Lines (optionally gzip-compressed)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(EXPORT_DATASETS))
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--start-date', help="YYYY-MM-DD (inclusive)")
+        parser.add_argument('--end-date', help="YYYY-MM-DD (inclusive)")
+        parser.add_argument('--status', help="Only export orders in this status")
+        parser.add_argument('--gzip', action='store_true', help="Compress the output with gzip")
+        parser.add_argument('-o', '--output', help="Output file (default: stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            chunks = iter_export(
+                options['dataset'], options['format'],
+                start_date=options['start_date'],
+                end_date=options['end_date'],
+                status=options['status'],
+            )
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        output = options['output']
+        if options['gzip']:
+            chunks = gzip_stream(chunks)
+
+        if not output:
+            if options['gzip']:
+                write = sys.stdout.buffer.write
+            else:
+                write = lambda chunk: self.stdout.write(chunk, ending='')
+            for chunk in chunks:
+                write(chunk)
+            return
+
+        if options['gzip']:
+            stream = open(output, 'wb')
+        else:
+            stream = open(output, 'w', encoding='utf-8', newline='')
+        with stream:
+            for chunk in chunks:
+                stream.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f"Exported {options['dataset']} to {output}."))
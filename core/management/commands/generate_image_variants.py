@@ -0,0 +1,38 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from core.models import ProductImage
+from core.thumbnails import render_variants
+
+
+class Command(BaseCommand):
+    help = "Generate WebP width variants for existing product images using a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--force', action='store_true', help="Regenerate images that already have variants")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        processed = 0
+
+        # 子进程只负责读写图片文件，不碰数据库；结果在主进程里批量写回
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                batch = list(
+                    ProductImage.objects.filter(pk__gt=last_id).order_by('pk').only('pk', 'image', 'variants')[:batch_size]
+                )
+                if not batch:
+                    break
+                last_id = batch[-1].pk
+                todo = [img for img in batch if img.image and (options['force'] or not img.variants)]
+                for img, widths in zip(todo, pool.map(render_variants, [img.image.name for img in todo])):
+                    img.variants = widths
+                ProductImage.objects.bulk_update(todo, ['variants'])
+                processed += len(todo)
+                self.stdout.write(f"  ...{processed} images processed")
+
+        self.stdout.write(self.style.SUCCESS(f"Done. {processed} images processed."))
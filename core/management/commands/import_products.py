@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importers import IMPORT_BATCH_SIZE, IMPORT_FORMATS, ProductImporter, detect_format, read_rows, write_error_report
+
+
+class Command(BaseCommand):
+    help = "Create or update products from a CSV / JSONL catalog feed, matched by SKU."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help="Default: guessed from the file extension")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help="Validate and roll back without saving")
+        parser.add_argument('--errors', help="Write the per-row error report to this CSV file")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or detect_format(path)
+        importer = ProductImporter(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        try:
+            with open(path, 'rb') as f:
+                result = importer.run(read_rows(f, fmt))
+        except (OSError, UnicodeDecodeError) as e:
+            raise CommandError(str(e))
+
+        if options['errors']:
+            with open(options['errors'], 'w', encoding='utf-8', newline='') as f:
+                write_error_report(result.errors, f)
+        else:
+            for line, sku, message in result.errors[:50]:
+                self.stderr.write(f"line {line} [{sku}]: {message}")
+            if len(result.errors) > 50:
+                self.stderr.write(f"... {len(result.errors) - 50} more (use --errors to save the full report)")
+
+        style = self.style.WARNING if result.errors else self.style.SUCCESS
+        self.stdout.write(style(result.summary()))
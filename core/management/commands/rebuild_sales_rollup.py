@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.analytics import rebuild_daily_sales
+
+
+class Command(BaseCommand):
+    help = "Rebuild the DailyProductSales rollup table from the full order history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        total = rebuild_daily_sales(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt sales rollup: {total} rows."))
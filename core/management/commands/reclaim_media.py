@@ -0,0 +1,116 @@
+import datetime
+import posixpath
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import Product, ProductImage
+from core.storage import is_content_addressed
+from core.thumbnails import is_variant_name, variant_name
+
+MEDIA_DIRS = ('product_images', 'product_videos')
+
+
+def _walk(storage, directory):
+    """递归列出目录下所有文件 (相对 MEDIA_ROOT 的路径)"""
+    if not storage.exists(directory):
+        return
+    subdirs, files = storage.listdir(directory)
+    for name in files:
+        yield posixpath.join(directory, name)
+    for subdir in subdirs:
+        yield from _walk(storage, posixpath.join(directory, subdir))
+
+
+def _still_referenced(name):
+    """
+    删除前按单个文件重新查一次数据库：扫描开始之后才上传的商品图片 / 视频
+    可能复用了 (内容相同的) 这个文件
+    """
+    if is_variant_name(name):
+        # 缩略图：原图 (任意扩展名) 还被引用就保留
+        root = posixpath.splitext(posixpath.splitext(name)[0])[0]
+        return ProductImage.objects.filter(image__startswith=f'{root}.').exists()
+    return ProductImage.objects.filter(image=name).exists() or Product.objects.filter(video=name).exists()
+
+
+def _format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+class Command(BaseCommand):
+    help = (
+        "Report storage used under product_images/ and product_videos/ and find files no longer "
+        "referenced by any Product or ProductImage. Pass --delete to reclaim them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', help="Delete orphaned files")
+        parser.add_argument(
+            '--min-age', type=int, default=60,
+            help="Only treat files older than this many minutes as orphans (skips uploads still in flight)",
+        )
+
+    def handle(self, *args, **options):
+        storage = default_storage
+
+        # 所有仍被引用的文件：原图、原图的缩略图、商品视频
+        referenced = set()
+        references = 0
+        for name, widths in ProductImage.objects.values_list('image', 'variants').iterator(chunk_size=5000):
+            if not name:
+                continue
+            references += 1
+            referenced.add(name)
+            referenced.update(variant_name(name, w) for w in widths or ())
+        for name in Product.objects.exclude(video='').exclude(video__isnull=True).values_list('video', flat=True).iterator(chunk_size=5000):
+            references += 1
+            referenced.add(name)
+
+        cutoff = timezone.now() - datetime.timedelta(minutes=options['min_age'])
+        total_files = total_bytes = orphan_bytes = legacy_files = 0
+        orphans = []
+        for directory in MEDIA_DIRS:
+            for name in _walk(storage, directory):
+                size = storage.size(name)
+                total_files += 1
+                total_bytes += size
+                if not is_content_addressed(name) and name in referenced:
+                    legacy_files += 1
+                if name in referenced or storage.get_modified_time(name) > cutoff:
+                    continue
+                orphans.append(name)
+                orphan_bytes += size
+
+        self.stdout.write(f"Files under {', '.join(MEDIA_DIRS)}: {total_files} ({_format_size(total_bytes)})")
+        self.stdout.write(f"Database references: {references} -> {len(referenced)} distinct files (incl. variants)")
+        self.stdout.write(f"Referenced files stored under their original names (not deduplicated): {legacy_files}")
+        self.stdout.write(f"Orphaned files: {len(orphans)} ({_format_size(orphan_bytes)})")
+        for name in orphans[:20]:
+            self.stdout.write(f"  {name}")
+        if len(orphans) > 20:
+            self.stdout.write(f"  ... {len(orphans) - 20} more")
+
+        if not options['delete']:
+            if orphans:
+                self.stdout.write("Run with --delete to reclaim this space.")
+            return
+
+        deleted = reclaimed = 0
+        for name in orphans:
+            # 扫描期间可能被重新上传 (ContentAddressedStorage 复用文件时会刷新修改时间)，删除前逐个复查
+            if not storage.exists(name) or storage.get_modified_time(name) > cutoff or _still_referenced(name):
+                continue
+            reclaimed += storage.size(name)
+            storage.delete(name)
+            deleted += 1
+        skipped = len(orphans) - deleted
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} files, reclaimed {_format_size(reclaimed)}."
+            + (f" Skipped {skipped} files re-used since the scan." if skipped else "")
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.ratings import recompute_ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute Product review_count / rating_sum / avg_rating from the Review table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', nargs='+', type=int, help="Only recompute these product ids")
+
+    def handle(self, *args, **options):
+        changed = recompute_ratings(options['products'])
+        self.stdout.write(self.style.SUCCESS(f"Recomputed ratings: {changed} products corrected."))
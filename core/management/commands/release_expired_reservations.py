@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.services import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = "Release expired cart stock reservations in batches (run periodically, e.g. from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        released = release_expired_holds(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired reservations."))
@@ -0,0 +1,157 @@
+"""
+媒体文件服务 (Media Serving)
+
+替代只在 DEBUG 下可用的 static() 路由，生产环境同样可用：
+- 支持 Range 请求 (206 Partial Content)，视频拖动进度条时只传需要的片段；
+- ETag / Last-Modified 条件请求 (304)，内容寻址的文件加长期缓存头；
+- 配置 MEDIA_SENDFILE_BACKEND 后只返回 X-Sendfile / X-Accel-Redirect 头，
+  由前端 Web 服务器 (Apache / nginx) 发送文件，不占用 Django worker；
+- 否则用 FileResponse 分块流式发送，不把文件读进内存。
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from .storage import is_content_addressed
+from .thumbnails import is_variant_name
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# 内容寻址的文件 (及其缩略图) 内容永远不变，可以长期缓存
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+DEFAULT_MAX_AGE = 60 * 60
+
+
+class RangeFile:
+    """只读取文件 [start, start + length) 区间的 file-like 对象，供 FileResponse 流式发送"""
+
+    def __init__(self, f, start, length):
+        self.f = f
+        self.f.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def parse_range(header, size):
+    """
+    解析单个字节区间 "bytes=start-end" / "bytes=-suffix"，返回 (start, end) (含 end)。
+    格式不支持 (如多个区间) 时返回 None，表示忽略 Range 返回整个文件；
+    区间超出文件大小时抛出 ValueError (416)。
+    """
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if size == 0:
+        raise ValueError(header)
+    if not first:
+        # 最后 N 个字节
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _if_range_matches(request, etag, mtime):
+    """If-Range 与当前版本一致时才按 Range 返回片段，否则返回整个文件"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    modified = parse_http_date_safe(if_range)
+    return modified is not None and int(mtime) <= modified
+
+
+def _cache_control(path):
+    # 缩略图 name.w240.webp 跟随原图
+    original = posixpath.splitext(posixpath.splitext(path)[0])[0] if is_variant_name(path) else path
+    if is_content_addressed(original):
+        return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return f'public, max-age={DEFAULT_MAX_AGE}'
+
+
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("Invalid path")
+    if not os.path.isfile(full_path):
+        raise Http404("File not found")
+
+    stat = os.stat(full_path)
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = _file_response(request, path, full_path, stat, etag, content_type)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = _cache_control(path)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _file_response(request, path, full_path, stat, etag, content_type):
+    backend = getattr(settings, 'MEDIA_SENDFILE_BACKEND', None)
+    if backend == 'x-sendfile':
+        # Apache mod_xsendfile / lighttpd：Web 服务器自己处理 Range
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+        return response
+    if backend == 'x-accel-redirect':
+        # nginx：MEDIA_ACCEL_REDIRECT_PREFIX 需要配置成 internal location 指向 MEDIA_ROOT
+        prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(path)
+        return response
+
+    size = stat.st_size
+    range_header = request.headers.get('Range')
+    byte_range = None
+    if range_header and request.method in ('GET', 'HEAD') and _if_range_matches(request, etag, stat.st_mtime):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        return FileResponse(open(full_path, 'rb'), content_type=content_type)
+
+    start, end = byte_range
+    length = end - start + 1
+    response = FileResponse(RangeFile(open(full_path, 'rb'), start, length), status=206, content_type=content_type)
+    response['Content-Length'] = str(length)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
@@ -0,0 +1,49 @@
+from django.db import migrations
+from django.utils.html import strip_tags
+
+FTS_TABLE = 'core_product_fts'
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 只在 SQLite 下创建，其它数据库使用 icontains 后端
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "name, description_html, brand, material, origin, "
+        "tokenize='unicode61 remove_diacritics 2')"
+    )
+
+    Product = apps.get_model('core', 'Product')
+    insert_sql = (
+        f'INSERT INTO {FTS_TABLE} (rowid, name, description_html, brand, material, origin) '
+        'VALUES (%s, %s, %s, %s, %s, %s)'
+    )
+    rows = []
+    with schema_editor.connection.cursor() as cursor:
+        for p in Product.objects.order_by('pk').iterator(chunk_size=1000):
+            rows.append((
+                p.pk, p.name or '', strip_tags(p.description_html or ''),
+                p.brand or '', p.material or '', p.origin or '',
+            ))
+            if len(rows) >= 1000:
+                cursor.executemany(insert_sql, rows)
+                rows = []
+        if rows:
+            cursor.executemany(insert_sql, rows)
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_review_order_user_full_name_alter_review_product'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
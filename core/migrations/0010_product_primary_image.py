@@ -0,0 +1,53 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+BATCH_SIZE = 1000
+
+
+def backfill_primary_image(apps, schema_editor):
+    """按主键分批回填主图指针，大表上也不会一次性加载全部商品"""
+    Product = apps.get_model('core', 'Product')
+    ProductImage = apps.get_model('core', 'ProductImage')
+
+    last_id = 0
+    while True:
+        product_ids = list(
+            Product.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE]
+        )
+        if not product_ids:
+            break
+        first_images = dict(
+            ProductImage.objects.filter(product_id__in=product_ids)
+            .annotate(row_number=Window(
+                expression=RowNumber(),
+                partition_by=[F('product_id')],
+                order_by=[F('is_primary').desc(), F('id').asc()],
+            ))
+            .filter(row_number=1)
+            .values_list('product_id', 'id')
+        )
+        Product.objects.bulk_update(
+            [Product(pk=pk, primary_image_id=image_id) for pk, image_id in first_images.items()],
+            ['primary_image'],
+        )
+        last_id = product_ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='primary_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.productimage', verbose_name='Primary Image'),
+        ),
+        migrations.RunPython(backfill_primary_image, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_daily_sales(apps, schema_editor):
+    """用已有订单生成初始汇总数据 (与 rebuild_sales_rollup 命令相同的逻辑)"""
+    OrderItem = apps.get_model('core', 'OrderItem')
+    DailyProductSales = apps.get_model('core', 'DailyProductSales')
+
+    rows = (
+        OrderItem.objects
+        .annotate(date=TruncDate('order__created_at'))
+        .values('date', 'product_id', 'product_name_snapshot', 'order__status')
+        .annotate(
+            total_qty=Sum('quantity'),
+            total_rev=Sum(F('quantity') * F('unit_price_snapshot')),
+            orders=Count('order_id', distinct=True),
+        )
+        .order_by()
+    )
+    batch = []
+    for row in rows.iterator(chunk_size=2000):
+        batch.append(DailyProductSales(
+            date=row['date'],
+            product_id=row['product_id'],
+            product_name_snapshot=row['product_name_snapshot'],
+            status=row['order__status'],
+            quantity=row['total_qty'],
+            revenue=row['total_rev'],
+            order_count=row['orders'],
+        ))
+        if len(batch) >= 2000:
+            DailyProductSales.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        DailyProductSales.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_stockreservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('product_name_snapshot', models.CharField(max_length=200, verbose_name='Product Name Snapshot')),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Shipped', 'Shipped'), ('Cancelled', 'Cancelled'), ('Hold', 'On Hold'), ('Refunded', 'Refunded')], max_length=20, verbose_name='Order Status')),
+                ('quantity', models.IntegerField(default=0, verbose_name='Quantity')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Revenue')),
+                ('order_count', models.IntegerField(default=0, verbose_name='Order Count')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='daily_sales', to='core.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'date'], name='core_dailysales_status_date')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'product', 'product_name_snapshot', 'status'), name='unique_daily_product_sales')],
+            },
+        ),
+        migrations.RunPython(populate_daily_sales, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-17 07:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=list, editable=False, verbose_name='Variant Widths'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.10 on 2026-10-17 07:08
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_productimage_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='video',
+            field=models.FileField(blank=True, help_text='Optional short video (MP4, WebM)', null=True, storage=core.storage.ContentAddressedStorage(), upload_to='product_videos/', verbose_name='Product Video'),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(storage=core.storage.ContentAddressedStorage(), upload_to='product_images/', verbose_name='Image File'),
+        ),
+    ]
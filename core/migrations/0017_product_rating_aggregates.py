@@ -0,0 +1,56 @@
+# Generated by Django 5.2.10 on 2026-10-17 07:13
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_ratings(apps, schema_editor):
+    """一次分组查询汇总已有评论，只更新有评论的商品"""
+    Product = apps.get_model('core', 'Product')
+    Review = apps.get_model('core', 'Review')
+
+    rows = (
+        Review.objects.filter(product__isnull=False)
+        .values('product_id')
+        .annotate(count=Count('id'), total=Sum('rating'))
+        .order_by()
+    )
+    Product.objects.bulk_update(
+        [
+            Product(pk=row['product_id'], review_count=row['count'], rating_sum=row['total'],
+                    avg_rating=row['total'] / row['count'])
+            for row in rows
+        ],
+        ['review_count', 'rating_sum', 'avg_rating'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_relatedproduct'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='avg_rating',
+            field=models.FloatField(default=0, editable=False, verbose_name='Average Rating'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Rating Sum'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Review Count'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-avg_rating', '-review_count'], name='core_product_rating'),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
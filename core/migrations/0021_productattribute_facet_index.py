@@ -0,0 +1,17 @@
+# Generated by Django 5.2.10 on 2026-10-17 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_query_shape_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productattribute',
+            index=models.Index(fields=['attribute_name', 'attribute_value', 'product'], name='core_attribute_facet'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.10 on 2026-10-17 07:38
+
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    """从根分类开始逐层计算路径 (历史模型没有 Category.save 里的维护逻辑)"""
+    Category = apps.get_model('core', 'Category')
+
+    children = {}
+    for pk, parent_id in Category.objects.values_list('pk', 'parent_id'):
+        children.setdefault(parent_id, []).append(pk)
+    changed = []
+    level = [(pk, '') for pk in children.get(None, [])]
+    while level:
+        next_level = []
+        for pk, parent_path in level:
+            path = f'{parent_path}{pk}/'
+            changed.append(Category(pk=pk, path=path, depth=path.count('/') - 1))
+            next_level.extend((child, path) for child in children.get(pk, []))
+        level = next_level
+    Category.objects.bulk_update(changed, ['path', 'depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_productattribute_facet_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Depth'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=255, verbose_name='Path'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='core_category_path'),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
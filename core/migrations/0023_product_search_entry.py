@@ -0,0 +1,27 @@
+# Generated by Django 5.2.10 on 2026-10-17 08:03
+
+import core.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_category_materialized_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchEntry',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='core.product')),
+                ('document', core.models.FTSDocumentField(db_column='core_product_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'core_product_fts',
+                'managed': False,
+            },
+        ),
+    ]
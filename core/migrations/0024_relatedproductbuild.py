@@ -0,0 +1,22 @@
+# Generated by Django 5.2.10 on 2026-10-17 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_product_search_entry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedProductBuild',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(verbose_name='Started At')),
+                ('finished_at', models.DateTimeField(auto_now_add=True, verbose_name='Finished At')),
+                ('product_count', models.PositiveIntegerField(default=0, verbose_name='Products Refreshed')),
+            ],
+        ),
+    ]
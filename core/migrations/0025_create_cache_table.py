@@ -0,0 +1,20 @@
+# Generated by Django 5.2.10 on 2026-10-17 09:12
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    """settings.CACHES 使用 DatabaseCache 时创建缓存表 (已存在或其它后端时什么也不做)"""
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_relatedproductbuild'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,13 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
+from django.db.models.functions import Concat, RowNumber, Substr
+from django.utils import timezone
 from django.utils.html import mark_safe
 
+from .storage import ContentAddressedStorage
+from .thumbnails import schedule_variants, variant_name
+
 # ==========================================
 # 1. User Management
 # ==========================================
@@ -35,50 +41,182 @@ class Address(models.Model):
 # ==========================================
 # 2. Product Catalog
 # ==========================================
+# 分类路径：祖先到自身的 id，每级以 "/" 结尾，例如 "3/17/42/"
+CATEGORY_PATH_SEPARATOR = '/'
+
+
+class CategoryQuerySet(models.QuerySet):
+    def subtree(self, path):
+        """
+        path 对应的分类及其所有子孙分类。
+        用范围条件 path >= "3/17/" AND path < "3/170" 而不是 LIKE "3/17/%"：
+        SQLite 的 LIKE 默认不区分大小写，用不上 path 上的普通索引
+        """
+        upper = path[:-1] + chr(ord(CATEGORY_PATH_SEPARATOR) + 1)
+        return self.filter(path__gte=path, path__lt=upper)
+
+
 class Category(models.Model):
     name = models.CharField("Category Name", max_length=100)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
+    # === 物化路径 (反范式) ===
+    # 保存 / 移动分类时维护 (见 save)，"某分类下的所有商品" 是 path 上的一次范围查询，不需要递归
+    path = models.CharField("Path", max_length=255, default='', editable=False)
+    depth = models.PositiveSmallIntegerField("Depth", default=0, editable=False)
+
+    objects = CategoryQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['path'], name='core_category_path'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def _check_parent(self, current_path, parent_path):
+        if current_path and parent_path.startswith(current_path):
+            raise ValidationError({'parent': "A category cannot be moved under itself or its subcategories."})
+
+    def clean(self):
+        super().clean()
+        if self.pk and self.parent_id:
+            paths = dict(Category.objects.filter(pk__in=[self.pk, self.parent_id]).values_list('pk', 'path'))
+            self._check_parent(paths.get(self.pk, ''), paths.get(self.parent_id, ''))
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            # 以数据库里的路径为准 (内存里的实例可能在祖先移动之前就已加载)
+            old_path = ''
+            if self.pk:
+                old_path = (
+                    Category.objects.select_for_update().filter(pk=self.pk)
+                    .values_list('path', flat=True).first() or ''
+                )
+            parent_path = ''
+            if self.parent_id:
+                parent_path = Category.objects.values_list('path', flat=True).get(pk=self.parent_id)
+                self._check_parent(old_path, parent_path)
+
+            super().save(*args, **kwargs)
+
+            path = f'{parent_path}{self.pk}{CATEGORY_PATH_SEPARATOR}'
+            depth = path.count(CATEGORY_PATH_SEPARATOR) - 1
+            if old_path and old_path != path:
+                # 移动：整棵子树替换路径前缀，一条 UPDATE
+                old_depth = old_path.count(CATEGORY_PATH_SEPARATOR) - 1
+                Category.objects.subtree(old_path).update(
+                    path=Concat(models.Value(path), Substr('path', len(old_path) + 1),
+                                output_field=models.CharField()),
+                    depth=models.F('depth') + (depth - old_depth),
+                )
+            if self.path != path or self.depth != depth:
+                # super().save() 写入的是内存里的值
+                Category.objects.filter(pk=self.pk).update(path=path, depth=depth)
+                self.path, self.depth = path, depth
+
+class ProductQuerySet(models.QuerySet):
+    def with_primary_image(self):
+        """
+        主图通过 Product.primary_image 外键直接 JOIN 出来，
+        列表页、购物车、后台预览都不需要再为每个商品查一次图片
+        """
+        return self.select_related('primary_image')
+
+    def sync_primary_images(self):
+        """
+        重新计算这些商品的主图指针 (被标记为主图的优先，否则取第一张)，
+        一次查询取出每个商品的第一张图，只更新发生变化的行
+        """
+        current = dict(self.values_list('pk', 'primary_image_id'))
+        if not current:
+            return 0
+
+        first_images = dict(
+            ProductImage.objects.filter(product_id__in=current.keys())
+            .annotate(row_number=models.Window(
+                expression=RowNumber(),
+                partition_by=[models.F('product_id')],
+                order_by=[models.F('is_primary').desc(), models.F('id').asc()],
+            ))
+            .filter(row_number=1)
+            .values_list('product_id', 'id')
+        )
+        changed = [
+            Product(pk=pk, primary_image_id=first_images.get(pk))
+            for pk, image_id in current.items()
+            if first_images.get(pk) != image_id
+        ]
+        if changed:
+            Product.objects.bulk_update(changed, ['primary_image'])
+        return len(changed)
+
+
 class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     name = models.CharField("Product Name", max_length=200)
+    # 供应商 / 外部系统的商品编码，批量导入时按它做 upsert (见 core/importers.py)
+    sku = models.CharField("SKU", max_length=64, unique=True, blank=True, null=True)
     brand = models.CharField("Brand", max_length=100, blank=True, null=True)
     material = models.CharField("Material", max_length=100, blank=True, null=True)
     origin = models.CharField("Origin", max_length=100, blank=True, null=True)
     
-    video = models.FileField("Product Video", upload_to='product_videos/', blank=True, null=True, help_text="Optional short video (MP4, WebM)")
+    video = models.FileField("Product Video", upload_to='product_videos/', storage=ContentAddressedStorage(), blank=True, null=True, help_text="Optional short video (MP4, WebM)")
     description_html = models.TextField("Description (HTML)", help_text="Supports HTML formatting")
     price = models.DecimalField("Price", max_digits=10, decimal_places=2)
     stock_quantity = models.PositiveIntegerField("Stock", default=0)
     is_active = models.BooleanField("Active (On Shelf)", default=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # === 核心修复: 主图指针 (反范式) ===
+    # 由 ProductImage 的 save/delete 和 views._handle_primary_image 维护，
+    # 读取时配合 with_primary_image() 不产生额外查询
+    primary_image = models.ForeignKey(
+        'ProductImage', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='+', editable=False, verbose_name="Primary Image"
+    )
+
+    # === 评分汇总 (反范式) ===
+    # 由评论的新增 / 编辑 / 删除在同一事务中增量维护 (见 core/ratings.py)，
+    # 详情页和按评分排序不需要再聚合 Review
+    review_count = models.PositiveIntegerField("Review Count", default=0, editable=False)
+    rating_sum = models.PositiveIntegerField("Rating Sum", default=0, editable=False)
+    avg_rating = models.FloatField("Average Rating", default=0, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # 目录按评分排序
+            models.Index(fields=['-avg_rating', '-review_count'], name='core_product_rating'),
+            # 列表的游标分页：前台只看在售商品，后台看全部
+            # Django 把 is_active=True 编译成 WHERE "is_active" (不是 = 1)，
+            # 放在组合索引里用不上，改用只包含在售商品的部分索引
+            models.Index(fields=['-created_at', '-id'], name='core_product_active_recent',
+                         condition=models.Q(is_active=True)),
+            models.Index(fields=['-created_at', '-id'], name='core_product_recent'),
+            # 前台按分类筛选
+            models.Index(fields=['category', '-created_at', '-id'], name='core_product_category_recent',
+                         condition=models.Q(is_active=True)),
+        ]
+
     def __str__(self):
         return self.name
 
-    # === 核心修复: 强制获取主图的逻辑 ===
-    @property
-    def primary_image(self):
-        """优先获取被标记为主图的图片，如果没有，则返回第一张"""
-        img = self.images.filter(is_primary=True).first()
-        if img:
-            return img
-        return self.images.first()
-
     def admin_photo(self):
         img = self.primary_image
         if img:
-            return mark_safe(f'<img src="{img.image.url}" width="50" height="50" style="object-fit:cover; border-radius: 4px;" />')
+            return mark_safe(f'<img src="{img.variant_url(100)}" width="50" height="50" loading="lazy" style="object-fit:cover; border-radius: 4px;" />')
         return "No Image"
     admin_photo.short_description = 'Preview'
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField("Image File", upload_to='product_images/')
+    # 按内容哈希命名，重复上传的同一张图只存一份 (见 core/storage.py)
+    image = models.ImageField("Image File", upload_to='product_images/', storage=ContentAddressedStorage())
     is_primary = models.BooleanField("Is Primary", default=False)
+    # 已生成的 WebP 缩略图宽度，如 [120, 240, 480] (见 core/thumbnails.py)
+    variants = models.JSONField("Variant Widths", default=list, blank=True, editable=False)
 
     class Meta:
         # === 核心修复 1: 强制排序 ===
@@ -89,9 +227,66 @@ class ProductImage(models.Model):
     def __str__(self):
         return f"Image for {self.product.name}"
 
+    # 从数据库读出时的文件名，用来判断 save() 时是否换了图片
+    _loaded_image = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'image' in field_names:
+            instance._loaded_image = values[field_names.index('image')]
+        return instance
+
+    def save(self, *args, **kwargs):
+        image_changed = bool(self.image) and self.image.name != self._loaded_image
+        if image_changed:
+            # 旧图的缩略图不再适用，提交后重新生成
+            self.variants = []
+        super().save(*args, **kwargs)
+        self._loaded_image = self.image.name
+        if image_changed:
+            reused = ProductImage.queue_variants([(self.pk, self.image.name)])
+            if self.pk in reused:
+                self.variants = reused[self.pk]
+
+    @classmethod
+    def queue_variants(cls, images):
+        """
+        新保存的图片 [(pk, 文件名)] 安排生成缩略图 (save() 和 bulk_create 之后的导入共用)：
+        同一文件 (内容相同的重复上传 / 导入) 已经生成过缩略图时直接复用，一条查询查出；
+        其余在事务提交后交给 schedule_variants。返回 {pk: 复用的宽度列表}
+        """
+        images = list(images)
+        if not images:
+            return {}
+        # 新图片的 variants 都是 []，不会被当成可复用的
+        shared = dict(
+            cls.objects.filter(image__in={name for _, name in images}).exclude(variants=[])
+            .values_list('image', 'variants')
+        )
+        reused = {pk: shared[name] for pk, name in images if name in shared}
+        if reused:
+            cls.objects.bulk_update([cls(pk=pk, variants=widths) for pk, widths in reused.items()], ['variants'])
+        for pk, name in images:
+            if pk not in reused:
+                transaction.on_commit(lambda pk=pk, name=name: schedule_variants(pk, name))
+        return reused
+
+    def variant_url(self, width):
+        """不小于 width 的最小缩略图地址，没有合适的缩略图时返回原图"""
+        for w in sorted(self.variants or ()):
+            if w >= width:
+                return self.image.storage.url(variant_name(self.image.name, w))
+        return self.image.url
+
+    @property
+    def srcset(self):
+        storage = self.image.storage
+        return ', '.join(f'{storage.url(variant_name(self.image.name, w))} {w}w' for w in sorted(self.variants or ()))
+
     def preview(self):
         if self.image:
-            return mark_safe(f'<img src="{self.image.url}" width="100" />')
+            return mark_safe(f'<img src="{self.variant_url(100)}" width="100" loading="lazy" />')
         return ""
 
 class ProductAttribute(models.Model):
@@ -99,6 +294,81 @@ class ProductAttribute(models.Model):
     attribute_name = models.CharField("Attribute Name", max_length=50)
     attribute_value = models.CharField("Attribute Value", max_length=100)
 
+    class Meta:
+        indexes = [
+            # 目录按属性分面筛选：attribute_name = ? AND attribute_value IN (...) -> product_id
+            models.Index(fields=['attribute_name', 'attribute_value', 'product'], name='core_attribute_facet'),
+        ]
+
+class FTSMatch(models.Lookup):
+    """FTS5 全文匹配：document__match='"lamp"*' -> "core_product_fts"."core_product_fts" MATCH %s"""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class FTSDocumentField(models.TextField):
+    """FTS5 表与表同名的隐藏列，只用来写 MATCH 条件"""
+
+
+FTSDocumentField.register_lookup(FTSMatch)
+
+
+class ProductSearchEntry(models.Model):
+    """
+    FTS5 虚拟表 core_product_fts (migration 0009 创建，只在 SQLite 下存在，由 core/search.py 维护)。
+    映射成非托管模型只为了让检索以 JOIN 的方式进入 Product 的查询：
+    MATCH 只执行一次，表别名 (子查询里的 U0 等) 由 ORM 处理
+    """
+    product = models.OneToOneField(Product, on_delete=models.DO_NOTHING, primary_key=True,
+                                   db_column='rowid', related_name='search_entry')
+    document = FTSDocumentField(db_column='core_product_fts')
+    # bm25 排序分，越小越相关
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'core_product_fts'
+
+
+class RelatedProduct(models.Model):
+    """
+    预先计算的相关商品 (离线生成，见 core/recommendations.py)
+    score = 属性相似度 + 共同购买次数加权，详情页按 score 取前几个
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_links')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField("Score")
+    co_purchases = models.PositiveIntegerField("Co-purchase Orders", default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'related'], name='unique_related_product'),
+        ]
+        indexes = [
+            models.Index(fields=['product', '-score'], name='core_related_product_score'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} ({self.score:.2f})"
+
+
+class RelatedProductBuild(models.Model):
+    """
+    build_related_products 的增量水位：默认 (增量) 和 --all 运行结束后记录本次的开始时间，
+    下次增量运行重算此后新上架 / 下过单的商品。--products 的部分重算不记录
+    """
+    started_at = models.DateTimeField("Started At")
+    finished_at = models.DateTimeField("Finished At", auto_now_add=True)
+    product_count = models.PositiveIntegerField("Products Refreshed", default=0)
+
+    def __str__(self):
+        return f"{self.started_at:%Y-%m-%d %H:%M} ({self.product_count} products)"
+
 # ==========================================
 # 3. Shopping Cart
 # ==========================================
@@ -111,6 +381,40 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+class StockReservationQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(expires_at__gt=timezone.now())
+
+    def expired(self):
+        return self.filter(expires_at__lte=timezone.now())
+
+
+class StockReservation(models.Model):
+    """
+    购物车库存预占 (带过期时间)
+    加入购物车时占用库存，过期后由 release_expired_reservations 命令批量释放；
+    可售数量 = stock_quantity - 其他用户未过期的预占
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField("Quantity")
+    expires_at = models.DateTimeField("Expires At", db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = StockReservationQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_stock_reservation_per_user'),
+        ]
+        indexes = [
+            # 计算某商品的有效预占总量: WHERE product_id = ? AND expires_at > now
+            models.Index(fields=['product', 'expires_at'], name='core_reserv_product_expiry'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} held by {self.user_id}"
+
 # ==========================================
 # 4. Order System
 # ==========================================
@@ -128,24 +432,48 @@ class Order(models.Model):
     status = models.CharField("Order Status", max_length=20, choices=Status.choices, default=Status.PENDING)
     created_at = models.DateTimeField("Order Date", auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # 后台订单列表的游标分页 (全部 / 按状态筛选)
+            models.Index(fields=['-created_at', '-id'], name='core_order_recent'),
+            models.Index(fields=['status', '-created_at', '-id'], name='core_order_status_recent'),
+            # 顾客的订单历史
+            models.Index(fields=['user', '-created_at'], name='core_order_user_recent'),
+        ]
+
+    # 进入这些状态时需要把库存加回来
+    RESTOCK_STATUSES = (Status.CANCELLED, Status.REFUNDED)
+
+    # 状态机工作流 (State Machine)：当前状态 -> 允许变成的状态
+    # 已发货 / 已取消 / 已退款 属于最终状态 (Terminal States)，不允许再变回其他状态
+    ALLOWED_TRANSITIONS = {
+        # 刚下单: 可以变为已发货、挂起、或取消
+        Status.PENDING: (Status.SHIPPED, Status.HOLD, Status.CANCELLED),
+        # 挂起中: 可以恢复发货，或者取消
+        Status.HOLD: (Status.SHIPPED, Status.CANCELLED),
+    }
+
+    @classmethod
+    def statuses_allowing(cls, new_status):
+        """哪些当前状态可以变成 new_status (批量操作时用于 SQL 过滤)"""
+        return [status for status, targets in cls.ALLOWED_TRANSITIONS.items() if new_status in targets]
+
     def save(self, *args, **kwargs):
-        if self.pk:
-            old_order = Order.objects.get(pk=self.pk)
-            if old_order.status != self.status:
-                OrderStatusHistory.objects.create(
-                    order=self,
-                    status=self.status,
-                    comments=f"Status changed from {old_order.status} to {self.status}"
+        from .services import record_status_changes
+
+        with transaction.atomic():
+            previous_status = None
+            if not self._state.adding:
+                # 在事务里加锁重新读取当前状态，不用实例加载时的旧值：
+                # 实例打开期间订单可能已经被 transition_orders 改过 (例如已取消并回补库存)，
+                # 用旧值比较会再记一次状态变化、重复回补库存
+                previous_status = (
+                    Order.objects.select_for_update().filter(pk=self.pk).values_list('status', flat=True).first()
                 )
-                # === 核心逻辑修复：处理订单取消/退款时的库存返还 ===
-                # 如果状态变成了“已取消”或“已退款”，且原来不是这个状态，就把库存加回来
-                terminal_restock_statuses = [self.Status.CANCELLED, self.Status.REFUNDED]
-                if self.status in terminal_restock_statuses and old_order.status not in terminal_restock_statuses:
-                    for item in self.items.all():
-                        if item.product:
-                            item.product.stock_quantity += item.quantity
-                            item.product.save()
-        super().save(*args, **kwargs)
+            super().save(*args, **kwargs)
+            if previous_status is not None and previous_status != self.status:
+                # 写状态历史；变成“已取消”或“已退款”时批量返还库存
+                record_status_changes([(self.pk, previous_status, self.status)])
 
     @property
     def can_cancel(self):
@@ -161,6 +489,12 @@ class OrderItem(models.Model):
     quantity = models.PositiveIntegerField("Quantity", default=1)
     unit_price_snapshot = models.DecimalField("Unit Price Snapshot", max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            # 某商品出现在哪些订单里：评论资格检查、共同购买统计 (core/recommendations.py)
+            models.Index(fields=['product', 'order'], name='core_orderitem_product_order'),
+        ]
+
     @property
     def subtotal(self):
         return self.unit_price_snapshot * self.quantity
@@ -173,6 +507,39 @@ class OrderStatusHistory(models.Model):
     
     class Meta:
         ordering = ['-changed_at']
+        indexes = [
+            # 订单详情页的状态历史
+            models.Index(fields=['order', '-changed_at'], name='core_orderhistory_order_recent'),
+        ]
+
+class DailyProductSales(models.Model):
+    """
+    报表预聚合表：按 (日期, 商品, 订单状态) 汇总销量和销售额
+    结算时写入 Pending，订单状态变化时在状态之间搬移，
+    图表只需按日期范围聚合这张表，不再扫描全部订单。
+    全量重建: python manage.py rebuild_sales_rollup
+    """
+    date = models.DateField("Date")
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='daily_sales')
+    product_name_snapshot = models.CharField("Product Name Snapshot", max_length=200)
+    status = models.CharField("Order Status", max_length=20, choices=Order.Status.choices)
+    quantity = models.IntegerField("Quantity", default=0)
+    revenue = models.DecimalField("Revenue", max_digits=14, decimal_places=2, default=0)
+    order_count = models.IntegerField("Order Count", default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'product', 'product_name_snapshot', 'status'],
+                name='unique_daily_product_sales',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'date'], name='core_dailysales_status_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.product_name_snapshot} [{self.status}]"
 
 # ==========================================
 # 5. User Generated Content (Reviews)
@@ -189,5 +556,11 @@ class Review(models.Model):
     comment = models.TextField("Comment", blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # 商品详情页评论的游标分页：WHERE product_id = ? AND (created_at, id) < (...) ORDER BY created_at DESC, id DESC
+            models.Index(fields=['product', '-created_at', '-id'], name='core_review_product_recent'),
+        ]
+
     def __str__(self):
         return f"Review for Order #{self.order.id} by {self.user.username}"
\ No newline at end of file
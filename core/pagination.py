@@ -0,0 +1,166 @@
+"""
+游标分页 (Keyset Pagination)
+
+Paginator 的 OFFSET 分页越往后越慢 (数据库要先数出前面所有行再丢掉)，而且每页都要 COUNT(*)。
+游标分页记住上一页最后一行的排序键，下一页用 WHERE (created_at, id) < (...) 直接从索引定位：
+每一页的代价只与页大小有关，与翻到第几页、总共有多少行无关。
+
+    page = keyset_paginate(product.reviews.all(), ('-created_at', '-id'), cursor, page_size=10)
+    page.items / page.has_next / page.next_cursor / page.has_previous / page.previous_cursor
+
+游标对调用方是不透明的字符串，同时记录了翻页方向 (下一页 / 上一页)。
+需要显示总数时传 count_limit：最多数到 count_limit 行 (有上限的 COUNT)，超过时显示 "1000+"。
+
+要求：ordering 的最后一个字段必须唯一 (通常是 id)，且各字段不为 NULL；
+排序字段最好有对应的组合索引。
+"""
+import base64
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """游标格式不正确或与排序方式不匹配"""
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder 会把时间截断到毫秒，游标需要精确到微秒才能和数据库里的值比较
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values, backwards=False):
+    """排序键的值 (+ 翻页方向) -> URL 安全的字符串"""
+    payload = {'k': list(values)}
+    if backwards:
+        payload['b'] = 1
+    data = json.dumps(payload, cls=_CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, ordering):
+    """encode_cursor 的逆操作，返回 (values, backwards)；与 ordering 不匹配时抛出 InvalidCursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = payload['k']
+        backwards = bool(payload.get('b'))
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        raise InvalidCursor(cursor) from e
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor(cursor)
+    return values, backwards
+
+
+def _reverse(ordering):
+    return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+
+def _after(ordering, values):
+    """
+    排在游标之后的行：
+    (a, b, c) 之后 = a 之后 OR (a 相同 AND b 之后) OR (a、b 相同 AND c 之后)
+    再加上冗余的 "a 之后或相同"，数据库可以直接在索引上定位起点，而不是从头扫描
+    """
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    first = ordering[0]
+    bound = Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": values[0]})
+    return bound & condition
+
+
+def approximate_count(queryset, limit):
+    """
+    有上限的计数：SELECT COUNT(*) FROM (... LIMIT limit + 1)，最多扫描 limit + 1 行。
+    返回 (count, exact)，超过上限时 count == limit 且 exact 为 False。
+    """
+    count = queryset.order_by()[:limit + 1].count()
+    if count > limit:
+        return limit, False
+    return count, True
+
+
+class KeysetPage:
+    """一页结果"""
+
+    def __init__(self, items, ordering, has_next, has_previous, count=None, count_exact=True):
+        self.items = items
+        self.ordering = ordering
+        self.has_next = has_next
+        self.has_previous = has_previous
+        # approximate_count 的结果 (没有要求计数时为 None)
+        self.count = count
+        self.count_exact = count_exact
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def _key(self, item):
+        return [getattr(item, field.lstrip('-')) for field in self.ordering]
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self.items:
+            return None
+        return encode_cursor(self._key(self.items[-1]))
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous or not self.items:
+            return None
+        return encode_cursor(self._key(self.items[0]), backwards=True)
+
+
+def keyset_paginate(queryset, ordering, cursor=None, page_size=20, count_limit=None):
+    """
+    按 ordering 取 cursor 之后 (上一页游标则为之前) 的 page_size 行。
+    多取一行判断这个方向上是否还有更多，不需要 COUNT(*)。
+    """
+    ordering = tuple(ordering)
+    count, count_exact = approximate_count(queryset, count_limit) if count_limit else (None, True)
+
+    backwards = False
+    page_qs = queryset.order_by(*ordering)
+    if cursor:
+        try:
+            values, backwards = decode_cursor(cursor, ordering)
+            if backwards:
+                # 上一页：反向排序取游标之前的行，再翻转回来
+                page_qs = queryset.order_by(*_reverse(ordering)).filter(_after(_reverse(ordering), values))
+            else:
+                page_qs = page_qs.filter(_after(ordering, values))
+        except (ValueError, TypeError, ValidationError) as e:
+            # 游标里的值与字段类型不符 (被篡改)
+            raise InvalidCursor(cursor) from e
+
+    items = list(page_qs[:page_size + 1])
+    more = len(items) > page_size
+    items = items[:page_size]
+    if backwards:
+        items.reverse()
+        # 从后一页翻回来的，后面一定还有
+        return KeysetPage(items, ordering, has_next=True, has_previous=more,
+                          count=count, count_exact=count_exact)
+    return KeysetPage(items, ordering, has_next=more, has_previous=bool(cursor),
+                      count=count, count_exact=count_exact)
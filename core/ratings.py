@@ -0,0 +1,92 @@
+"""
+商品评分汇总 (Rating Aggregates)
+
+Product.review_count / rating_sum / avg_rating 是 Review 的反范式汇总，
+商品详情页和目录按评分排序 / 筛选时不需要再对 Review 做聚合。
+
+- 评论的新增 / 编辑 / 删除 (views Block T) 在同一事务中调用 record_rating_changes，
+  用 F() 表达式在数据库里做增量更新，并发提交也不会丢失
+- 汇总与 Review 不一致时 (例如直接改了数据库) 用 `python manage.py recompute_ratings` 全量重算
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+from django.db.models.functions import Cast
+
+from .caching import invalidate_catalog_cache, invalidate_product_pages
+from .models import Product, Review
+
+
+def _average():
+    return Case(
+        When(review_count__gt=0, then=Cast('rating_sum', FloatField()) / F('review_count')),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+
+
+def rating_deltas(reviews, sign=1):
+    """[(product_id, rating)] -> {product_id: (评论数变化, 评分总和变化)}；sign=-1 表示删除"""
+    deltas = defaultdict(lambda: [0, 0])
+    for product_id, rating in reviews:
+        if product_id is None:
+            continue
+        deltas[product_id][0] += sign
+        deltas[product_id][1] += sign * rating
+    return {product_id: tuple(delta) for product_id, delta in deltas.items()}
+
+
+def record_rating_changes(deltas):
+    """
+    评论变化后调用 (须在同一事务中)：
+    deltas 为 {product_id: (评论数变化, 评分总和变化)}，见 rating_deltas()。
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta != (0, 0)}
+    if not deltas:
+        return
+    for product_id, (count, total) in deltas.items():
+        Product.objects.filter(pk=product_id).update(
+            review_count=F('review_count') + count,
+            rating_sum=F('rating_sum') + total,
+        )
+    # 平均分依赖上面更新后的值，统一再算一次
+    Product.objects.filter(pk__in=deltas.keys()).update(avg_rating=_average())
+    _invalidate_rating_caches(list(deltas))
+
+
+def _invalidate_rating_caches(product_ids):
+    # 列表页显示评分、按评分排序 / 筛选，分面计数也受影响；详情页和卡片显示评分
+    transaction.on_commit(invalidate_catalog_cache)
+    transaction.on_commit(lambda: invalidate_product_pages(product_ids))
+
+
+def recompute_ratings(product_ids=None):
+    """从 Review 重新计算评分汇总，返回发生变化的商品数"""
+    products = Product.objects.all()
+    reviews = Review.objects.filter(product__isnull=False)
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+        reviews = reviews.filter(product_id__in=product_ids)
+    current = {
+        pk: (count, total, avg)
+        for pk, count, total, avg in products.values_list('pk', 'review_count', 'rating_sum', 'avg_rating')
+    }
+    actual = {
+        row['product_id']: (row['count'], row['total'])
+        for row in (
+            reviews.values('product_id')
+            .annotate(count=Count('id'), total=Sum('rating'))
+            .order_by()
+        )
+    }
+    changed = []
+    for pk, stored in current.items():
+        count, total = actual.get(pk, (0, 0))
+        expected = (count, total, total / count if count else 0.0)
+        if stored != expected:
+            changed.append(Product(pk=pk, review_count=count, rating_sum=total, avg_rating=expected[2]))
+    if changed:
+        Product.objects.bulk_update(changed, ['review_count', 'rating_sum', 'avg_rating'], batch_size=500)
+        _invalidate_rating_caches([product.pk for product in changed])
+    return len(changed)
@@ -0,0 +1,160 @@
+"""
+相关商品推荐 (Related Products)
+
+离线计算每个商品的相关商品，写入 RelatedProduct 表；详情页只需一次按索引的查询。
+score 由两部分组成：
+- 属性相似度：同品牌 / 同分类 / 同产地 / 同材质，以及相同的 ProductAttribute (名称 + 值)
+- 共同购买：两个商品出现在同一张有效订单中的次数
+
+刷新：`python manage.py build_related_products`
+默认只重算上次 (默认或 --all) 运行之后新上架的商品，以及之后下过单的商品 (共同购买次数有变化)；
+修改了商品属性、或希望老商品的列表里出现新商品时，用 --products / --all 重算。
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Max, Q, Value, When
+
+from .models import Order, OrderItem, Product, ProductAttribute, RelatedProduct, RelatedProductBuild
+
+# 每个商品保存的相关商品数量
+RELATED_LIMIT = 12
+# 每个商品参与打分的属性相似候选数量上限
+ATTRIBUTE_CANDIDATES = 50
+
+ATTRIBUTE_WEIGHTS = {
+    'brand': 3,
+    'category': 2,
+    'origin': 1,
+    'material': 1,
+}
+# 每个相同的 ProductAttribute (名称 + 值)
+SHARED_ATTRIBUTE_WEIGHT = 0.5
+# 每张共同购买的订单
+CO_PURCHASE_WEIGHT = 2.0
+
+# 不计入共同购买的订单状态
+EXCLUDED_ORDER_STATUSES = (Order.Status.CANCELLED, Order.Status.REFUNDED)
+
+
+def _attribute_candidates(product):
+    """与 product 字段相同的商品及其属性得分 (数据库里打分排序，只取前 ATTRIBUTE_CANDIDATES 个)"""
+    conditions = Q()
+    score = Value(0)
+    for field, weight in ATTRIBUTE_WEIGHTS.items():
+        value = getattr(product, f'{field}_id' if field == 'category' else field)
+        if value in (None, ''):
+            continue
+        conditions |= Q(**{field: value})
+        score = score + Case(When(**{field: value}, then=Value(weight)), default=Value(0), output_field=IntegerField())
+    if not conditions:
+        return {}
+    rows = (
+        Product.objects.filter(conditions, is_active=True)
+        .exclude(pk=product.pk)
+        .annotate(similarity=score)
+        .order_by('-similarity', '-id')
+        .values_list('pk', 'similarity')[:ATTRIBUTE_CANDIDATES]
+    )
+    return {pk: float(similarity) for pk, similarity in rows}
+
+
+def _shared_attributes(product_ids, candidate_ids):
+    """{product_id: {(属性名, 属性值)}}，名称和值不区分大小写"""
+    attributes = defaultdict(set)
+    rows = ProductAttribute.objects.filter(
+        product_id__in=set(product_ids) | set(candidate_ids)
+    ).values_list('product_id', 'attribute_name', 'attribute_value')
+    for product_id, name, value in rows:
+        attributes[product_id].add((name.lower(), value.lower()))
+    return attributes
+
+
+def _co_purchases(product_ids):
+    """{product_id: {other_product_id: 订单数}}，一次分组查询"""
+    rows = (
+        OrderItem.objects
+        .filter(product_id__in=product_ids, order__items__product__is_active=True)
+        .exclude(order__status__in=EXCLUDED_ORDER_STATUSES)
+        .values('product_id', 'order__items__product_id')
+        .annotate(orders=Count('order_id', distinct=True))
+        .order_by()
+    )
+    pairs = defaultdict(dict)
+    for row in rows:
+        other = row['order__items__product_id']
+        if other != row['product_id']:
+            pairs[row['product_id']][other] = row['orders']
+    return pairs
+
+
+def build_related(product_ids):
+    """重新计算这些商品的相关商品，返回写入的行数"""
+    products = list(Product.objects.filter(pk__in=product_ids))
+    if not products:
+        return 0
+
+    similarity = {product.pk: _attribute_candidates(product) for product in products}
+    co_purchases = _co_purchases([product.pk for product in products])
+    candidate_ids = set()
+    for product in products:
+        candidate_ids.update(similarity[product.pk], co_purchases.get(product.pk, {}))
+    attributes = _shared_attributes(similarity.keys(), candidate_ids)
+
+    links = []
+    for product in products:
+        scores = defaultdict(float, similarity[product.pk])
+        bought_together = co_purchases.get(product.pk, {})
+        own_attributes = attributes.get(product.pk, set())
+        for candidate in set(scores) | set(bought_together):
+            shared = len(own_attributes & attributes.get(candidate, set()))
+            scores[candidate] += SHARED_ATTRIBUTE_WEIGHT * shared + CO_PURCHASE_WEIGHT * bought_together.get(candidate, 0)
+        best = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))[:RELATED_LIMIT]
+        links.extend(
+            RelatedProduct(product_id=product.pk, related_id=candidate, score=score,
+                           co_purchases=bought_together.get(candidate, 0))
+            for candidate, score in best
+            if score > 0
+        )
+
+    with transaction.atomic():
+        RelatedProduct.objects.filter(product_id__in=[product.pk for product in products]).delete()
+        RelatedProduct.objects.bulk_create(links)
+    return len(links)
+
+
+def last_build_started():
+    """上一次默认 / --all 运行的开始时间 (从未运行过时为 None)"""
+    return RelatedProductBuild.objects.aggregate(last=Max('started_at'))['last']
+
+
+def record_build(started_at, product_count):
+    """默认 / --all 运行完成后推进增量水位；用开始时间，运行期间新增的订单下次还会被重算"""
+    RelatedProductBuild.objects.create(started_at=started_at, product_count=product_count)
+
+
+def stale_product_ids():
+    """
+    增量刷新需要重算的商品：
+    上一次默认 / --all 运行开始之后新上架的商品，以及之后有新订单的商品 (共同购买关系变化，两边都要重算)。
+    不能用 RelatedProduct.updated_at 做水位：--products 的部分重算也会刷新它，会跳过中间的变化
+    """
+    since = last_build_started()
+    if since is None:
+        return set(Product.objects.values_list('pk', flat=True))
+    stale = set(Product.objects.filter(created_at__gt=since).values_list('pk', flat=True))
+    stale.update(
+        OrderItem.objects.filter(order__created_at__gt=since, product__isnull=False)
+        .values_list('product_id', flat=True).distinct()
+    )
+    return stale
+
+
+def related_products_for(product, limit=3):
+    """详情页：按 (product, -score) 索引取前 limit 个在售的相关商品，连主图一次查出"""
+    links = (
+        RelatedProduct.objects.filter(product=product, related__is_active=True)
+        .select_related('related__primary_image')
+        .order_by('-score')[:limit]
+    )
+    return [link.related for link in links]
@@ -0,0 +1,148 @@
+"""
+商品全文检索 (Product Search)
+
+product_list / vendor_product_list 共用同一套索引：
+- SQLite 下使用 FTS5 虚拟表 core_product_fts，rowid 与 Product.id 一一对应，按 bm25 排序；
+- 其他数据库退回到原来的 icontains 多字段匹配（没有排序分）。
+
+索引通过 signals 跟随 Product 的 save / delete 同步，
+批量写入（bulk_create / update）之后请调用 index_products()，
+全量重建使用 `python manage.py rebuild_search_index`。
+"""
+import abc
+import re
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils.html import strip_tags
+
+FTS_TABLE = 'core_product_fts'
+
+# 参与检索的字段（与原先 product_list 的五个 icontains 字段保持一致）
+SEARCH_FIELDS = ('name', 'description_html', 'brand', 'material', 'origin')
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _document(product):
+    """把商品转换成索引文档，描述里的 HTML 标签先去掉"""
+    return (
+        product.name or '',
+        strip_tags(product.description_html or ''),
+        product.brand or '',
+        product.material or '',
+        product.origin or '',
+    )
+
+
+class BaseSearchBackend(abc.ABC):
+    """检索后端接口：search() 返回过滤并排序后的 queryset"""
+
+    ranked = False
+
+    @abc.abstractmethod
+    def search(self, queryset, query):
+        """queryset 中与 query 匹配的商品"""
+
+    def index_products(self, products):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self, batch_size=1000):
+        return 0
+
+
+class LikeSearchBackend(BaseSearchBackend):
+    """不支持 FTS 的数据库：保持原来的 icontains 行为"""
+
+    def search(self, queryset, query):
+        q_objects = Q()
+        for field in SEARCH_FIELDS:
+            q_objects |= Q(**{f'{field}__icontains': query})
+        return queryset.filter(q_objects)
+
+
+class SqliteFTSBackend(BaseSearchBackend):
+    ranked = True
+
+    @staticmethod
+    def match_expression(query):
+        """
+        把用户输入转成安全的 FTS5 表达式：
+        每个词加引号避免语法错误，并加 * 做前缀匹配，多个词之间为 AND
+        """
+        tokens = _TOKEN_RE.findall(query.lower())
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def search(self, queryset, query):
+        match = self.match_expression(query)
+        if not match:
+            return queryset.none()
+
+        # FTS 表经 Product.search_entry JOIN 进来：MATCH 只执行一次，排序分取命中行的 rank。
+        # 不要写成每行一个 "SELECT bm25(...) WHERE ... MATCH" 的相关子查询，那样每个候选行都要重新 MATCH 一次
+        return (
+            queryset.filter(search_entry__document__match=match)
+            .annotate(search_rank=F('search_entry__rank'))
+            .order_by('search_rank', '-id')
+        )
+
+    def index_products(self, products):
+        rows = [(p.pk, *_document(p)) for p in products]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, {", ".join(SEARCH_FIELDS)}) VALUES (%s, %s, %s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+    def rebuild(self, batch_size=1000):
+        from .models import Product
+
+        total = 0
+        last_id = 0
+        # 在同一个事务里清空并重建，重建过程中搜索结果不会变空
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            while True:
+                batch = list(
+                    Product.objects.filter(pk__gt=last_id).order_by('pk').only('pk', *SEARCH_FIELDS)[:batch_size]
+                )
+                if not batch:
+                    break
+                self.index_products(batch)
+                total += len(batch)
+                last_id = batch[-1].pk
+        return total
+
+
+def get_search_backend():
+    if connection.vendor == 'sqlite':
+        return SqliteFTSBackend()
+    return LikeSearchBackend()
+
+
+def search_products(queryset, query):
+    return get_search_backend().search(queryset, query)
+
+
+def search_is_ranked():
+    """search_products 的结果是否带 search_rank 注解 (可以按相关度排序 / 分页)"""
+    return get_search_backend().ranked
+
+
+def index_products(products):
+    get_search_backend().index_products(products)
+
+
+def remove_products(product_ids):
+    get_search_backend().remove_products(product_ids)
@@ -0,0 +1,190 @@
+"""
+业务服务层 (Services)
+
+库存扣减等需要在事务中、用集合化 SQL 完成的操作放在这里，
+views / admin / management commands 共用。
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Sum, Value, When
+from django.utils import timezone
+
+from .caching import invalidate_product_pages
+from .models import Order, OrderItem, OrderStatusHistory, Product, StockReservation
+
+# 单条 CASE UPDATE 里最多放多少个商品
+RESTOCK_BATCH_SIZE = 500
+
+
+class InsufficientStock(Exception):
+    """某个商品的库存不足以满足本次扣减"""
+
+    def __init__(self, product_id, requested):
+        self.product_id = product_id
+        self.requested = requested
+        super().__init__(f"Insufficient stock for product #{product_id} (requested {requested})")
+
+
+def decrement_stock(quantities, reserved=None):
+    """
+    按 {product_id: quantity} 扣减库存，必须在 transaction.atomic() 中调用。
+
+    每个商品一条条件 UPDATE (stock_quantity >= qty + 他人预占)，由数据库保证不会超卖；
+    任意一行扣减失败就抛出 InsufficientStock，由外层事务整体回滚。
+    按 product_id 顺序执行，并发结算时加锁顺序一致，避免死锁。
+    """
+    reserved = reserved or {}
+    for product_id, quantity in sorted(quantities.items()):
+        updated = Product.objects.filter(
+            pk=product_id, stock_quantity__gte=quantity + reserved.get(product_id, 0)
+        ).update(stock_quantity=F('stock_quantity') - quantity)
+        if not updated:
+            raise InsufficientStock(product_id, quantity)
+    # 商品详情页显示可售数量：只失效这些商品的详情页和卡片
+    product_ids = list(quantities)
+    transaction.on_commit(lambda: invalidate_product_pages(product_ids))
+
+
+# ==============================
+# 库存预占 (Stock Reservations)
+# ==============================
+
+def reservation_ttl():
+    return datetime.timedelta(minutes=getattr(settings, 'STOCK_RESERVATION_MINUTES', 15))
+
+
+def held_quantities(product_ids, exclude_user=None):
+    """{product_id: 未过期的预占总量}，一条 GROUP BY 查询，走 (product, expires_at) 索引"""
+    holds = StockReservation.objects.active().filter(product_id__in=product_ids)
+    if exclude_user is not None:
+        holds = holds.exclude(user=exclude_user)
+    return dict(holds.values_list('product_id').annotate(total=Sum('quantity')).order_by())
+
+
+def available_to_sell(product, user=None):
+    """可售数量：库存减去其他用户的有效预占 (自己的预占不算)"""
+    held = held_quantities([product.pk], exclude_user=user).get(product.pk, 0)
+    return max(product.stock_quantity - held, 0)
+
+
+def hold_stock(user, product, quantity):
+    """
+    为用户的购物车行占用 quantity 件库存 (覆盖之前的预占并刷新过期时间)。
+    可售数量不足时抛出 InsufficientStock。
+    检查和写入在同一事务中，并锁住商品行 (只锁这一次预占)：同一商品的并发预占排队执行，
+    不会两边都通过检查、合起来占用超过库存。
+    预占频繁且很快过期，不失效页面缓存：匿名页面上的可售数量最多旧 PAGE_CACHE_TIMEOUT 秒，
+    结算时仍以 decrement_stock 的条件 UPDATE 为准。
+    """
+    with transaction.atomic():
+        # 锁定后重新读取库存，不用调用方手里可能过时的 stock_quantity
+        locked = Product.objects.select_for_update().only('stock_quantity').get(pk=product.pk)
+        if quantity > available_to_sell(locked, user):
+            raise InsufficientStock(product.pk, quantity)
+        reservation, _ = StockReservation.objects.update_or_create(
+            user=user,
+            product=locked,
+            defaults={'quantity': quantity, 'expires_at': timezone.now() + reservation_ttl()},
+        )
+    return reservation
+
+
+def release_holds(user, product_ids=None):
+    holds = StockReservation.objects.filter(user=user)
+    if product_ids is not None:
+        holds = holds.filter(product_id__in=product_ids)
+    return holds.delete()[0]
+
+
+def release_expired_holds(batch_size=1000):
+    """分批删除已过期的预占，每批一个短事务，返回释放的条数"""
+    released = 0
+    while True:
+        batch = list(StockReservation.objects.expired().values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return released
+        with transaction.atomic():
+            # 再判断一次过期，期间被刷新的预占不会被误删
+            released += StockReservation.objects.expired().filter(pk__in=batch).delete()[0]
+
+
+# ==============================
+# 订单状态流转 (Order Status Transitions)
+# ==============================
+
+def restock_orders(order_ids):
+    """
+    把这些订单的商品数量加回库存。
+    先按商品汇总数量，再用 stock_quantity = stock_quantity + CASE ... 集合化更新，
+    每 RESTOCK_BATCH_SIZE 个商品一条 UPDATE，与订单数量无关。
+    """
+    totals = list(
+        OrderItem.objects.filter(order_id__in=order_ids, product__isnull=False)
+        .values_list('product_id')
+        .annotate(total=Sum('quantity'))
+        .order_by('product_id')
+    )
+    for start in range(0, len(totals), RESTOCK_BATCH_SIZE):
+        batch = totals[start:start + RESTOCK_BATCH_SIZE]
+        Product.objects.filter(pk__in=[product_id for product_id, _ in batch]).update(
+            stock_quantity=F('stock_quantity') + Case(
+                *[When(pk=product_id, then=Value(total)) for product_id, total in batch],
+                default=Value(0),
+                output_field=PositiveIntegerField(),
+            )
+        )
+    if totals:
+        product_ids = [product_id for product_id, _ in totals]
+        transaction.on_commit(lambda: invalidate_product_pages(product_ids))
+
+
+def record_status_changes(changes):
+    """
+    状态已经写入订单之后调用，必须在事务中：
+    changes 为 [(order_id, old_status, new_status), ...]，
+    批量写入 OrderStatusHistory，并为新进入取消/退款状态的订单返还库存。
+    """
+    if not changes:
+        return
+    from .analytics import record_sales_changes
+
+    OrderStatusHistory.objects.bulk_create([
+        OrderStatusHistory(
+            order_id=order_id,
+            status=new_status,
+            comments=f"Status changed from {old_status} to {new_status}",
+        )
+        for order_id, old_status, new_status in changes
+    ])
+    restock_ids = [
+        order_id for order_id, old_status, new_status in changes
+        if new_status in Order.RESTOCK_STATUSES and old_status not in Order.RESTOCK_STATUSES
+    ]
+    if restock_ids:
+        restock_orders(restock_ids)
+    # 报表预聚合表：把这些订单的销量从旧状态搬到新状态
+    record_sales_changes(changes)
+
+
+def transition_orders(orders, new_status, enforce_workflow=False):
+    """
+    批量修改订单状态 (orders 可以是 Order queryset 或订单 id 列表)，
+    例如一次取消/退款多张订单。
+    enforce_workflow=True 时按 Order.ALLOWED_TRANSITIONS 过滤 (与 OrderStatusForm 相同的状态机)，
+    不允许流转的订单保持不变。
+    查询数量固定：读取当前状态、一条 update()、bulk_create 历史、按商品批量回补库存。
+    返回实际发生变化的订单 id 列表。
+    """
+    with transaction.atomic():
+        candidates = Order.objects.select_for_update().filter(pk__in=orders).exclude(status=new_status)
+        if enforce_workflow:
+            candidates = candidates.filter(status__in=Order.statuses_allowing(new_status))
+        current = list(candidates.values_list('pk', 'status'))
+        if not current:
+            return []
+        changed_ids = [order_id for order_id, _ in current]
+        Order.objects.filter(pk__in=changed_ids).update(status=new_status)
+        record_status_changes([(order_id, old_status, new_status) for order_id, old_status in current])
+    return changed_ids
@@ -0,0 +1,90 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import search
+from .caching import (
+    invalidate_catalog_cache, invalidate_category_tree, invalidate_page_cache, invalidate_product_pages,
+)
+from .models import Category, Product, ProductAttribute, ProductImage, Review
+
+
+# ==============================
+# 搜索索引同步 (Product Search)
+# ==============================
+@receiver(post_save, sender=Product)
+def index_product_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+
+
+# ==============================
+# 主图指针同步 (Product.primary_image)
+# ==============================
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def sync_product_primary_image(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    Product.objects.filter(pk=instance.product_id).sync_primary_images()
+
+
+# ==============================
+# 分面计数缓存失效 (Catalog Facets)
+# ==============================
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductAttribute)
+@receiver(post_delete, sender=ProductAttribute)
+def invalidate_catalog_on_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    transaction.on_commit(invalidate_catalog_cache)
+    # 该商品的详情页和卡片片段
+    product_id = instance.pk if sender is Product else instance.product_id
+    transaction.on_commit(lambda: invalidate_product_pages([product_id]))
+
+
+# ==============================
+# 分类导航缓存失效 (Category Tree)
+# ==============================
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_tree_on_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    transaction.on_commit(invalidate_category_tree)
+    # 移动分类会改变子树包含的商品，分面计数也要失效
+    transaction.on_commit(invalidate_catalog_cache)
+
+
+# ==============================
+# 匿名页面缓存失效 (Anonymous Page Cache)
+# ==============================
+# 商品 / 属性 / 分类的变化经 invalidate_catalog_cache 一并失效列表页；
+# 库存经 update() 修改不会触发信号，由 services 里的库存操作自行失效对应商品
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_pages_on_image_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    product_id = instance.product_id
+    transaction.on_commit(lambda: invalidate_product_pages([product_id]))
+    # 列表页上的主图
+    transaction.on_commit(invalidate_page_cache)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_pages_on_review_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # 评论只显示在该商品的详情页上
+    product_id = instance.product_id
+    transaction.on_commit(lambda: invalidate_product_pages([product_id]))
@@ -0,0 +1,54 @@
+"""
+内容寻址存储 (Content-Addressed Storage)
+
+商品图片和视频按文件内容的 SHA-256 命名：
+    product_images/mug.jpg -> product_images/3f/3fa2...c9.jpg
+同一张图被多个商品重复上传时只保存一份，多条 ProductImage 指向同一个文件。
+因为文件可能被共享，删除商品 / 图片时不删除文件；
+不再被引用的文件由 `python manage.py reclaim_media --delete` 统一回收。
+"""
+import hashlib
+import os
+import posixpath
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def content_hash(content):
+    """分块读取计算 SHA-256，不把整个文件读进内存"""
+    digest = hashlib.sha256()
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        directory, filename = posixpath.split(name)
+        ext = posixpath.splitext(filename)[1].lower()
+        digest = content_hash(content)
+        # 按前两位分子目录，避免单个目录文件过多
+        name = posixpath.join(directory, digest[:2], digest + ext)
+        if self.exists(name):
+            # 内容相同的文件已经存在：直接复用。
+            # 同时刷新修改时间，reclaim_media 按修改时间判断 "刚上传"，不会把它当成孤儿删掉
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                # 刚好被 reclaim_media 删除：重新写一份
+                pass
+        return super().save(name, content, max_length=max_length)
+
+
+def is_content_addressed(name):
+    """是否为 ContentAddressedStorage 生成的文件名 (旧的按原文件名保存的文件返回 False)"""
+    directory, filename = posixpath.split(name)
+    digest = posixpath.splitext(filename)[0]
+    return len(digest) == 64 and posixpath.basename(directory) == digest[:2]
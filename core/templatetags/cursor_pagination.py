@@ -0,0 +1,22 @@
+"""
+游标分页模板标签 (见 core/pagination.py)：
+
+    {% load cursor_pagination %}
+    <a href="{% cursor_url page.next_cursor %}">Next</a>
+
+保留当前 URL 的其他查询参数 (搜索词、筛选、排序)，只替换 cursor；旧的 page 参数会被去掉。
+"""
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def cursor_url(context, cursor):
+    params = context['request'].GET.copy()
+    params.pop('page', None)
+    if cursor:
+        params['cursor'] = cursor
+    else:
+        params.pop('cursor', None)
+    return '?' + params.urlencode()
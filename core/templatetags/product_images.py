@@ -0,0 +1,38 @@
+"""
+商品图片模板标签：
+
+    {% load product_images %}
+    {% product_img product.primary_image width=240 sizes="(max-width: 768px) 100vw, 240px" class="card-img-top" alt=product.name %}
+
+输出带 srcset / sizes / loading="lazy" 的 <img>，src 为不小于 width 的最小缩略图 (旧浏览器兜底)。
+缩略图尚未生成时退回原图。首屏大图可传 eager=True 取消懒加载。
+"""
+from django import template
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_img(image, width=None, sizes=None, eager=False, **attrs):
+    """image 为 ProductImage"""
+    if not image or not image.image:
+        return ''
+    src = image.variant_url(width) if width else image.image.url
+    srcset = image.srcset
+    if srcset:
+        attrs['srcset'] = srcset
+        attrs['sizes'] = sizes or (f'{width}px' if width else '100vw')
+    attrs['loading'] = 'eager' if eager else 'lazy'
+    attrs['decoding'] = 'async'
+    return format_html(
+        '<img src="{}"{}>',
+        src,
+        format_html_join('', ' {}="{}"', attrs.items()),
+    )
+
+
+@register.filter
+def variant_url(image, width):
+    """{{ img|variant_url:120 }}：需要自己写 <img> 属性时只取缩略图地址"""
+    return image.variant_url(int(width))
@@ -1,3 +1,1049 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.http import QueryDict
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .management.commands import reclaim_media
+from .models import (
+    Cart, CartItem, Category, DailyProductSales, Order, OrderItem, OrderStatusHistory, Product, ProductImage, Review,
+    StockReservation, User,
+)
+from . import search
+from .analytics import revenue_panel
+from .caching import get_cart_item_count, get_category_tree
+from .facets import apply_facets, facet_count_rows, parse_facets
+from .context_processors import cart_status
+from .exports import ExportError, iter_export
+from .importers import ProductImporter, read_rows
+from .pagination import InvalidCursor, _after, encode_cursor, keyset_paginate
+from .recommendations import stale_product_ids
+from .services import InsufficientStock, available_to_sell, decrement_stock, hold_stock, transition_orders
+from .storage import ContentAddressedStorage
+from .thumbnails import schedule_variants, variant_name
+from .views import LATEST_ORDERING, REVIEW_ORDERING, REVIEWS_PER_PAGE
+
+
+# 统计查询数的测试改用进程内缓存：settings 里的 DatabaseCache 读写缓存表也会计入查询数
+locmem_cache = override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite specific")
+class QueryPlanTests(TestCase):
+    """
+    views 里的热点查询要走 Meta.indexes 里的组合索引：
+    不能全表扫描，也不能为 ORDER BY 额外建临时 B-tree 排序
+    """
+
+    def setUp(self):
+        # 游标分页第二页的条件 (created_at, id) < (...)
+        self.cursor = _after(LATEST_ORDERING, [timezone.now() - datetime.timedelta(days=1), 100])
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(f'INDEX {index_name}', plan, plan)
+        self.assertNotIn('TEMP B-TREE', plan, plan)
+
+    def test_product_list(self):
+        products = Product.objects.filter(is_active=True).order_by(*LATEST_ORDERING)
+        self.assertUsesIndex(products[:7], 'core_product_active_recent')
+        self.assertUsesIndex(products.filter(self.cursor)[:7], 'core_product_active_recent')
+
+    def test_product_list_by_category(self):
+        products = Product.objects.filter(is_active=True, category_id=1).order_by(*LATEST_ORDERING)
+        self.assertUsesIndex(products[:7], 'core_product_category_recent')
+        self.assertUsesIndex(products.filter(self.cursor)[:7], 'core_product_category_recent')
+
+    def test_category_subtree(self):
+        products = Product.objects.filter(is_active=True, category__in=Category.objects.subtree('3/17/'))
+        self.assertUsesIndex(products, 'core_category_path')
+
+    def test_product_rating_sort(self):
+        products = Product.objects.order_by('-avg_rating', '-review_count')
+        self.assertUsesIndex(products[:7], 'core_product_rating')
+
+    def test_vendor_product_list(self):
+        products = Product.objects.order_by(*LATEST_ORDERING).filter(self.cursor)
+        self.assertUsesIndex(products[:11], 'core_product_recent')
+
+    def test_vendor_order_list(self):
+        orders = Order.objects.order_by(*LATEST_ORDERING)
+        self.assertUsesIndex(orders.filter(self.cursor)[:11], 'core_order_recent')
+        self.assertUsesIndex(
+            orders.filter(status=Order.Status.PENDING).filter(self.cursor)[:11], 'core_order_status_recent'
+        )
+
+    def test_customer_order_list(self):
+        self.assertUsesIndex(Order.objects.filter(user_id=1).order_by('-created_at'), 'core_order_user_recent')
+
+    def test_order_items_by_product(self):
+        self.assertUsesIndex(
+            OrderItem.objects.filter(product_id=1).values('order_id'), 'core_orderitem_product_order'
+        )
+
+    def test_order_status_history(self):
+        self.assertUsesIndex(OrderStatusHistory.objects.filter(order_id=1), 'core_orderhistory_order_recent')
+
+    def test_product_reviews(self):
+        reviews = Review.objects.filter(product_id=1).order_by(*REVIEW_ORDERING)
+        self.assertUsesIndex(reviews[:11], 'core_review_product_recent')
+        self.assertUsesIndex(reviews.filter(self.cursor)[:11], 'core_review_product_recent')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "FTS5 search backend is SQLite specific")
+class SearchTests(TestCase):
+    """常见词命中大量商品时，MATCH 只执行一次 (JOIN FTS 表)，不能每个候选行再 MATCH 一次"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Lighting')
+        Product.objects.bulk_create([
+            Product(category=category, name=f'Desk lamp {i}', description_html='<p>Warm lamp</p>',
+                    brand='Acme', price=10 + i, stock_quantity=5)
+            for i in range(20)
+        ])
+        search.SqliteFTSBackend().rebuild()
+
+    def test_common_term_joins_match_once(self):
+        products = search.search_products(Product.objects.filter(is_active=True), 'lamp')
+        plan = products.explain()
+        self.assertNotIn('CORRELATED', plan, plan)
+        self.assertIn('VIRTUAL TABLE INDEX', plan, plan)
+
+    def test_keyset_pages_by_rank(self):
+        products = search.search_products(Product.objects.filter(is_active=True), 'lamp')
+        # 一页一条查询 (第一页另加一条限量计数)，与命中的行数无关
+        with self.assertNumQueries(2):
+            page = keyset_paginate(products, ('search_rank', '-id'), page_size=6, count_limit=10)
+        with self.assertNumQueries(1):
+            second = keyset_paginate(products, ('search_rank', '-id'), cursor=page.next_cursor, page_size=6)
+        self.assertEqual(len(page), 6)
+        self.assertEqual(len(second), 6)
+        self.assertFalse(page.count_exact)
+        self.assertTrue(set(p.pk for p in page).isdisjoint(p.pk for p in second))
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "FTS5 search backend is SQLite specific")
+class VendorProductSearchTests(TestCase):
+    """后台商品搜索：文本走全文索引，数字同时按 ID 部分匹配 (与原来的 id__icontains 一致)"""
+
+    def test_numeric_query_matches_id_substring(self):
+        category = Category.objects.create(name='Lighting')
+        for pk in (123, 512, 700):
+            Product.objects.create(pk=pk, category=category, name=f'Lamp {pk}', description_html='', price=1)
+        search.SqliteFTSBackend().rebuild()
+        self.client.force_login(User.objects.create_user('vendor', password='x', role=User.Role.ADMIN))
+        response = self.client.get(reverse('core:vendor_product_list'), {'q': '#12'})
+        self.assertEqual({product.pk for product in response.context['products']}, {123, 512})
+
+
+class ReclaimMediaTests(TestCase):
+    """去重复用的文件不能被正在运行的 reclaim_media --delete 当成孤儿删掉"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.product = Product.objects.create(
+            category=Category.objects.create(name='Mugs'), name='Mug', description_html='', price=5, stock_quantity=1,
+        )
+
+    def _save_old_file(self, storage):
+        name = storage.save('product_images/mug.jpg', ContentFile(b'mug', name='mug.jpg'))
+        old = time.time() - 7200
+        os.utime(storage.path(name), (old, old))
+        return name
+
+    def test_dedup_hit_refreshes_modified_time(self):
+        storage = ContentAddressedStorage(location=self.media_root)
+        name = self._save_old_file(storage)
+        self.assertEqual(storage.save('product_images/copy.jpg', ContentFile(b'mug', name='copy.jpg')), name)
+        self.assertGreater(os.path.getmtime(storage.path(name)), time.time() - 60)
+
+    def test_file_reused_during_scan_is_not_deleted(self):
+        name = self._save_old_file(default_storage)
+        walk = reclaim_media._walk
+
+        def walk_then_upload(storage, directory):
+            yield from walk(storage, directory)
+            # 扫描结束、删除开始之前，有人上传了内容相同的图片
+            if directory == 'product_images':
+                ProductImage.objects.create(product=self.product, image=name)
+
+        out = io.StringIO()
+        with mock.patch.object(reclaim_media, '_walk', walk_then_upload):
+            call_command('reclaim_media', '--delete', stdout=out)
+        self.assertTrue(default_storage.exists(name))
+        self.assertIn('Deleted 0 files', out.getvalue())
+        self.assertIn('Skipped 1 files', out.getvalue())
+
+        ProductImage.objects.filter(image=name).delete()
+        out = io.StringIO()
+        call_command('reclaim_media', '--delete', stdout=out)
+        self.assertFalse(default_storage.exists(name))
+        self.assertIn('Deleted 1 files', out.getvalue())
+
+
+@override_settings(IMAGE_VARIANTS_ASYNC=False)
+class ImportImageVariantsTests(TestCase):
+    """导入用 bulk_create 建图片行，不经过 ProductImage.save()，也要生成 (或复用) 缩略图"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        buffer = io.BytesIO()
+        Image.new('RGB', (300, 200), 'red').save(buffer, 'JPEG')
+        default_storage.save('product_images/lamp.jpg', ContentFile(buffer.getvalue()))
+
+    def test_imported_images_get_variants(self):
+        category = Category.objects.create(name='Lighting')
+        other = Product.objects.create(category=category, name='Old lamp', description_html='', price=1)
+        ProductImage.objects.bulk_create([ProductImage(product=other, image='product_images/shared.jpg', variants=[120])])
+        rows = io.StringIO(
+            'sku,name,category,price,images\n'
+            'L-1,Lamp,Lighting,10,product_images/lamp.jpg\n'
+            'L-2,Shared lamp,Lighting,12,product_images/shared.jpg\n'
+        )
+        with mock.patch('core.models.schedule_variants', wraps=schedule_variants) as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                result = ProductImporter().run(read_rows(rows, 'csv'))
+        self.assertEqual(result.created, 2)
+        images = {image.product.sku: image for image in ProductImage.objects.select_related('product').exclude(product=other)}
+        self.assertEqual(images['L-1'].variants, [120, 240])
+        self.assertTrue(default_storage.exists(variant_name('product_images/lamp.jpg', 240)))
+        # 同一文件已有缩略图：直接复用，不再安排生成
+        self.assertEqual(images['L-2'].variants, [120])
+        schedule.assert_called_once_with(images['L-1'].pk, 'product_images/lamp.jpg')
+
+
+class RelatedProductsBuildTests(TestCase):
+    """增量水位只由默认 / --all 运行推进，--products 的部分重算不能让增量运行跳过中间的变化"""
+
+    def _product(self, name):
+        return Product.objects.create(category=self.category, name=name, description_html='', brand='Acme',
+                                      price=5, stock_quantity=1)
+
+    def test_partial_run_does_not_advance_watermark(self):
+        self.category = Category.objects.create(name='Mugs')
+        first = self._product('Mug')
+        self.assertEqual(stale_product_ids(), {first.pk})
+        call_command('build_related_products', stdout=io.StringIO())
+        self.assertEqual(stale_product_ids(), set())
+
+        added = self._product('Cup')
+        call_command('build_related_products', '--products', str(first.pk), stdout=io.StringIO())
+        self.assertEqual(stale_product_ids(), {added.pk})
+
+        call_command('build_related_products', stdout=io.StringIO())
+        self.assertEqual(stale_product_ids(), set())
+
+
+class StockTestCase(TestCase):
+    """库存 / 订单相关测试共用的数据：两个商品、两个顾客"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Mugs')
+        cls.mug = Product.objects.create(category=category, name='Mug', description_html='', price=10, stock_quantity=5)
+        cls.cup = Product.objects.create(category=category, name='Cup', description_html='', price=4, stock_quantity=1)
+        cls.buyer = User.objects.create_user('buyer', password='x')
+        cls.other = User.objects.create_user('other', password='x')
+
+    def fill_cart(self, user, **quantities):
+        cart, _ = Cart.objects.get_or_create(user=user)
+        for attr, quantity in quantities.items():
+            CartItem.objects.create(cart=cart, product=getattr(self, attr), quantity=quantity)
+        return cart
+
+    def checkout(self, user):
+        self.client.force_login(user)
+        return self.client.post(reverse('core:checkout'))
+
+    def assertStock(self, product, expected):
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, expected)
+
+    def place_order(self, **quantities):
+        order = Order.objects.create(user=self.buyer, total_amount=0, shipping_address_snapshot='-')
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=getattr(self, attr), product_name_snapshot=attr,
+                      unit_price_snapshot=1, quantity=quantity)
+            for attr, quantity in quantities.items()
+        ])
+        return order
+
+
+class CheckoutTests(StockTestCase):
+    """结算：条件 UPDATE 扣库存，不会超卖；任意一行不足时整体回滚"""
+
+    def test_checkout_decrements_stock(self):
+        self.fill_cart(self.buyer, mug=2, cup=1)
+        response = self.checkout(self.buyer)
+        order = Order.objects.get(user=self.buyer)
+        self.assertRedirects(response, reverse('core:order_detail', args=[order.pk]), fetch_redirect_response=False)
+        self.assertEqual(order.total_amount, 24)
+        self.assertStock(self.mug, 3)
+        self.assertStock(self.cup, 0)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.buyer).exists())
+
+    def test_oversell_is_rejected(self):
+        self.fill_cart(self.buyer, cup=2)
+        response = self.checkout(self.buyer)
+        self.assertRedirects(response, reverse('core:cart_detail'), fetch_redirect_response=False)
+        self.assertStock(self.cup, 1)
+        self.assertFalse(Order.objects.exists())
+
+    def test_insufficient_stock_rolls_back_everything(self):
+        # 先扣 mug (id 较小) 成功，再扣 cup 失败：mug 的扣减、订单、订单行都要回滚，购物车保留
+        self.fill_cart(self.buyer, mug=2, cup=3)
+        self.checkout(self.buyer)
+        self.assertStock(self.mug, 5)
+        self.assertStock(self.cup, 1)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(CartItem.objects.filter(cart__user=self.buyer).count(), 2)
+
+
+class StockReservationTests(StockTestCase):
+    """其他用户的有效预占要从可售数量里扣掉：加入购物车和结算都不能超卖"""
+
+    def test_hold_counts_against_other_users(self):
+        hold_stock(self.other, self.mug, 4)
+        self.assertEqual(available_to_sell(self.mug, self.buyer), 1)
+        # 自己的预占不算
+        self.assertEqual(available_to_sell(self.mug, self.other), 5)
+        with self.assertRaises(InsufficientStock):
+            hold_stock(self.buyer, self.mug, 2)
+        hold_stock(self.buyer, self.mug, 1)
+
+    def test_hold_locks_product_row(self):
+        # SQLite 不输出 FOR UPDATE，这里确认预占前锁住了商品行 (并发预占同一商品时排队)
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=lambda qs: qs) as lock:
+            hold_stock(self.buyer, self.mug, 2)
+        # (update_or_create 自己还会锁预占行)
+        self.assertIn(Product, [call.args[0].model for call in lock.call_args_list])
+
+    def test_hold_uses_current_stock(self):
+        stale = Product.objects.get(pk=self.mug.pk)
+        Product.objects.filter(pk=self.mug.pk).update(stock_quantity=1)
+        with self.assertRaises(InsufficientStock):
+            hold_stock(self.buyer, stale, 2)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_checkout_respects_other_users_hold(self):
+        hold_stock(self.other, self.mug, 4)
+        self.fill_cart(self.buyer, mug=2)
+        response = self.checkout(self.buyer)
+        self.assertRedirects(response, reverse('core:cart_detail'), fetch_redirect_response=False)
+        self.assertStock(self.mug, 5)
+        self.assertFalse(Order.objects.exists())
+
+    def test_expired_hold_is_ignored(self):
+        hold_stock(self.other, self.mug, 4)
+        self.mug.reservations.update(expires_at=timezone.now() - datetime.timedelta(minutes=1))
+        self.fill_cart(self.buyer, mug=2)
+        self.checkout(self.buyer)
+        self.assertStock(self.mug, 3)
+
+
+class TransitionOrdersTests(StockTestCase):
+    """批量状态流转：已取消 -> 已退款 只回补一次库存；查询数量与订单数、商品数无关"""
+
+    def test_restock_happens_once(self):
+        order = self.place_order(mug=2, cup=1)
+        self.assertEqual(transition_orders([order.pk], Order.Status.CANCELLED), [order.pk])
+        self.assertStock(self.mug, 7)
+        self.assertStock(self.cup, 2)
+        transition_orders([order.pk], Order.Status.REFUNDED)
+        self.assertStock(self.mug, 7)
+        self.assertStock(self.cup, 2)
+        # 状态已经是目标状态：不变化、不回补
+        self.assertEqual(transition_orders([order.pk], Order.Status.REFUNDED), [])
+        self.assertStock(self.mug, 7)
+        self.assertEqual(
+            list(OrderStatusHistory.objects.filter(order=order).order_by('id').values_list('status', flat=True)),
+            [Order.Status.CANCELLED, Order.Status.REFUNDED],
+        )
+
+    def test_single_order_save_restocks_once(self):
+        order = self.place_order(mug=2)
+        order.status = Order.Status.CANCELLED
+        order.save()
+        order.status = Order.Status.REFUNDED
+        order.save()
+        self.assertStock(self.mug, 7)
+
+    def test_stale_instance_save_does_not_restock_again(self):
+        order = self.place_order(mug=2)
+        stale = Order.objects.get(pk=order.pk)
+        # 实例打开期间，订单已被批量取消并回补库存
+        transition_orders([order.pk], Order.Status.CANCELLED)
+        stale.status = Order.Status.CANCELLED
+        stale.save()
+        self.assertStock(self.mug, 7)
+        self.assertEqual(OrderStatusHistory.objects.filter(order=order).count(), 1)
+
+    def assertTransitionQueries(self, orders):
+        # 读取状态、UPDATE 订单、写历史、汇总并回补库存、写报表预聚合表 (+ 事务 / savepoint)，与订单数无关
+        with self.assertNumQueries(12):
+            changed = transition_orders([order.pk for order in orders], Order.Status.CANCELLED)
+        self.assertEqual(len(changed), len(orders))
+
+    def test_query_count_single_order(self):
+        self.assertTransitionQueries([self.place_order(mug=1)])
+
+    def test_query_count_many_orders(self):
+        self.assertTransitionQueries([self.place_order(mug=1, cup=1) for _ in range(20)])
+        self.assertStock(self.mug, 25)
+
+
+class VendorOrderBulkStatusTests(StockTestCase):
+    """批量修改订单状态：套用状态机，不允许的订单跳过；next 只允许跳回本站"""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('vendor', password='x', role=User.Role.ADMIN))
+
+    def post(self, orders, status, **extra):
+        return self.client.post(reverse('core:vendor_order_bulk_status'), {
+            'order_ids': [order.pk for order in orders], 'status': status, **extra,
+        })
+
+    def test_disallowed_transitions_are_skipped(self):
+        pending, held, shipped = self.place_order(mug=1), self.place_order(mug=1), self.place_order(mug=1)
+        Order.objects.filter(pk=held.pk).update(status=Order.Status.HOLD)
+        Order.objects.filter(pk=shipped.pk).update(status=Order.Status.SHIPPED)
+        response = self.post([pending, held, shipped], Order.Status.CANCELLED)
+        self.assertRedirects(response, reverse('core:vendor_order_list'), fetch_redirect_response=False)
+        statuses = dict(Order.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[pending.pk], Order.Status.CANCELLED)
+        self.assertEqual(statuses[held.pk], Order.Status.CANCELLED)
+        self.assertEqual(statuses[shipped.pk], Order.Status.SHIPPED)
+        # 两个取消的订单各回补一件
+        self.assertStock(self.mug, 7)
+        messages = [str(m) for m in get_messages(response.wsgi_request)]
+        self.assertIn('2 order(s) updated to Cancelled.', messages)
+        self.assertTrue(any(m.startswith('1 order(s) skipped') for m in messages))
+
+    def test_next_redirects_within_site_only(self):
+        order = self.place_order(mug=1)
+        response = self.post([order], Order.Status.HOLD, next='/vendor/orders/?status=Hold')
+        self.assertRedirects(response, '/vendor/orders/?status=Hold', fetch_redirect_response=False)
+        for next_url in ('//evil.example/', 'https://evil.example/', '/\\evil.example/'):
+            response = self.post([order], Order.Status.SHIPPED, next=next_url)
+            self.assertRedirects(response, reverse('core:vendor_order_list'), fetch_redirect_response=False)
+
+
+class PageCacheTests(StockTestCase):
+    """匿名整页缓存：按商品版本号失效，预占不失效"""
+
+    def setUp(self):
+        cache.clear()
+
+    def assertCached(self, url):
+        # 命中整页缓存时只读缓存表 (settings.CACHES 为 DatabaseCache)，不查业务表
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual([q['sql'] for q in queries if 'django_cache' not in q['sql']], [])
+        return response
+
+    def test_hold_does_not_invalidate(self):
+        url = reverse('core:product_detail', args=[self.mug.pk])
+        self.assertContains(self.client.get(url), 'In Stock (5)')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            hold_stock(self.other, self.mug, 2)
+        self.assertEqual(callbacks, [])
+        self.assertContains(self.assertCached(url), 'In Stock (5)')
+
+    def test_stock_change_invalidates_only_that_product(self):
+        mug_url = reverse('core:product_detail', args=[self.mug.pk])
+        cup_url = reverse('core:product_detail', args=[self.cup.pk])
+        list_url = reverse('core:product_list')
+        for url in (mug_url, cup_url, list_url):
+            self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                decrement_stock({self.mug.pk: 2})
+        self.assertContains(self.client.get(mug_url), 'In Stock (3)')
+        self.assertCached(cup_url)
+        self.assertCached(list_url)
+
+    def test_review_change_invalidates_list_page(self):
+        list_url = reverse('core:product_list')
+        self.assertContains(self.client.get(list_url), 'No reviews yet')
+        order = self.place_order(mug=1)
+        Order.objects.filter(pk=order.pk).update(status=Order.Status.SHIPPED)
+        reviewer = Client()
+        reviewer.force_login(self.buyer)
+        with self.captureOnCommitCallbacks(execute=True):
+            reviewer.post(reverse('core:add_order_review', args=[order.pk]), {'rating': 4, 'comment': 'Nice'})
+        self.assertContains(self.client.get(list_url), '4.0 (1)')
+        # 按评分筛选的列表页也要跟着变
+        mug_url = reverse('core:product_detail', args=[self.mug.pk])
+        self.assertContains(self.client.get(list_url, {'min_rating': 3}), mug_url)
+        review = Review.objects.get(order=order)
+        with self.captureOnCommitCallbacks(execute=True):
+            reviewer.post(reverse('core:edit_order_review', args=[review.pk]), {'rating': 2, 'comment': 'Meh'})
+        self.assertContains(self.client.get(list_url), '2.0 (1)')
+        self.assertNotContains(self.client.get(list_url, {'min_rating': 3}), mug_url)
+
+
+@locmem_cache
+class PrimaryImageTests(TestCase):
+    """商品网格的主图随商品一起 JOIN 出来，查询数与商品数无关"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Mugs')
+        cls.add_products(3)
+
+    @classmethod
+    def add_products(cls, count):
+        for i in range(count):
+            product = Product.objects.create(category=cls.category, name=f'Mug {i}', description_html='', price=5)
+            ProductImage.objects.create(product=product, image=f'product_images/mug{i}.jpg')
+            ProductImage.objects.create(product=product, image=f'product_images/mug{i}b.jpg', is_primary=True)
+
+    def test_with_primary_image_is_one_query(self):
+        with self.assertNumQueries(1):
+            covers = {product.name: product.primary_image.image.name for product in Product.objects.with_primary_image()}
+        self.assertEqual(covers['Mug 0'], 'product_images/mug0b.jpg')
+
+    def list_page_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('core:product_list'))
+        self.assertContains(response, 'mug0b')
+        return len(queries)
+
+    def test_product_list_queries_do_not_grow_with_products(self):
+        queries = self.list_page_queries()
+        self.add_products(3)
+        self.assertEqual(self.list_page_queries(), queries)
+
+
+class PrimaryImagePointerTests(TestCase):
+    """Product.primary_image 随图片的新增 / 删除 / 改主图保持最新，backfill 命令可以分批补齐"""
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            category=Category.objects.create(name='Mugs'), name='Mug', description_html='', price=5,
+        )
+
+    def assertPrimary(self, image):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image, image)
+
+    def test_pointer_follows_image_changes(self):
+        first = ProductImage.objects.create(product=self.product, image='product_images/a.jpg')
+        self.assertPrimary(first)
+        second = ProductImage.objects.create(product=self.product, image='product_images/b.jpg', is_primary=True)
+        self.assertPrimary(second)
+        second.delete()
+        self.assertPrimary(first)
+        first.delete()
+        self.assertPrimary(None)
+
+    def test_backfill_command(self):
+        products = [self.product] + [
+            Product.objects.create(category=self.product.category, name=f'Cup {i}', description_html='', price=5)
+            for i in range(4)
+        ]
+        images = [ProductImage.objects.create(product=product, image=f'product_images/{product.pk}.jpg')
+                  for product in products]
+        Product.objects.update(primary_image=None)
+        out = io.StringIO()
+        call_command('backfill_primary_images', batch_size=2, stdout=out)
+        self.assertIn('Done. 5 of 5 products updated.', out.getvalue())
+        self.assertEqual(
+            dict(Product.objects.values_list('pk', 'primary_image')),
+            {image.product_id: image.pk for image in images},
+        )
+
+
+@locmem_cache
+class CartBadgeTests(StockTestCase):
+    """购物车角标：一条聚合查询 + 按用户缓存，惰性计算，购物车变动时失效"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_count_is_one_aggregate_then_cached(self):
+        self.fill_cart(self.buyer, mug=2, cup=1)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_cart_item_count(self.buyer.pk), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cart_item_count(self.buyer.pk), 3)
+
+    def test_count_is_lazy(self):
+        request = RequestFactory().get('/')
+        request.user = self.buyer
+        with self.assertNumQueries(0):
+            count = cart_status(request)['cart_item_count']
+        with self.assertNumQueries(1):
+            self.assertEqual(count, 0)
+
+    def test_cart_changes_invalidate_count(self):
+        self.client.force_login(self.buyer)
+        self.assertEqual(get_cart_item_count(self.buyer.pk), 0)
+        self.client.post(reverse('core:add_to_cart', args=[self.mug.pk]), {'quantity': 2})
+        self.assertEqual(get_cart_item_count(self.buyer.pk), 2)
+        item = CartItem.objects.get(cart__user=self.buyer)
+        self.client.post(reverse('core:update_cart_quantity', args=[item.pk]), '{"quantity": 3}',
+                         content_type='application/json')
+        self.assertEqual(get_cart_item_count(self.buyer.pk), 3)
+        self.client.post(reverse('core:remove_from_cart', args=[item.pk]))
+        self.assertEqual(get_cart_item_count(self.buyer.pk), 0)
+        self.client.post(reverse('core:add_to_cart', args=[self.cup.pk]), {'quantity': 1})
+        self.assertEqual(get_cart_item_count(self.buyer.pk), 1)
+        self.checkout(self.buyer)
+        self.assertEqual(get_cart_item_count(self.buyer.pk), 0)
+
+
+class SalesRollupTests(StockTestCase):
+    """DailyProductSales 随结算和状态变化增量维护，与全量重建结果一致；图表只读汇总表"""
+
+    def rollup(self):
+        return sorted(DailyProductSales.objects.values_list(
+            'date', 'product_id', 'status', 'quantity', 'revenue', 'order_count',
+        ))
+
+    def test_incremental_rollup_matches_rebuild(self):
+        self.fill_cart(self.buyer, mug=2, cup=1)
+        self.checkout(self.buyer)
+        self.fill_cart(self.other, mug=1)
+        self.checkout(self.other)
+        first, second = Order.objects.order_by('pk')
+        today = timezone.localdate()
+        self.assertIn((today, self.mug.pk, Order.Status.PENDING, 3, 30, 2), self.rollup())
+
+        transition_orders([first.pk], Order.Status.SHIPPED)
+        transition_orders([second.pk], Order.Status.CANCELLED)
+        rows = self.rollup()
+        # Pending 行搬空后删除
+        self.assertEqual(rows, sorted([
+            (today, self.mug.pk, Order.Status.SHIPPED, 2, 20, 1),
+            (today, self.mug.pk, Order.Status.CANCELLED, 1, 10, 1),
+            (today, self.cup.pk, Order.Status.SHIPPED, 1, 4, 1),
+        ]))
+        call_command('rebuild_sales_rollup', stdout=io.StringIO())
+        self.assertEqual(self.rollup(), rows)
+
+    def test_revenue_panel_reads_rollup_only(self):
+        self.fill_cart(self.buyer, mug=2)
+        self.checkout(self.buyer)
+        transition_orders(Order.objects.all(), Order.Status.SHIPPED)
+        with CaptureQueriesContext(connection) as queries:
+            panel = revenue_panel(QueryDict('group_by=month'))
+        self.assertEqual(panel['totals'], [20.0])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('core_orderitem', queries[0]['sql'])
+
+
+class OrderExportTests(StockTestCase):
+    """订单导出：逐行流式输出 CSV / JSONL，可选 gzip；按日期、状态过滤"""
+
+    def setUp(self):
+        self.shipped = self.place_order(mug=2)
+        self.pending = self.place_order(cup=1)
+        transition_orders([self.shipped.pk], Order.Status.SHIPPED)
+        self.client.force_login(User.objects.create_user('vendor', password='x', role=User.Role.ADMIN))
+
+    def export(self, **params):
+        response = self.client.get(reverse('core:vendor_order_export'), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv_with_status_filter(self):
+        rows = list(csv.reader(io.StringIO(self.export(dataset='orders', status='Shipped').decode())))
+        self.assertEqual(rows[0][:4], ['id', 'user_id', 'user__username', 'status'])
+        self.assertEqual([row[0] for row in rows[1:]], [str(self.shipped.pk)])
+
+    def test_jsonl_items_with_date_filter(self):
+        today = timezone.localdate()
+        lines = self.export(dataset='items', format='jsonl', start_date=today.isoformat()).decode().splitlines()
+        self.assertEqual(sorted(json.loads(line)['product_id'] for line in lines), [self.mug.pk, self.cup.pk])
+        tomorrow = (today + datetime.timedelta(days=1)).isoformat()
+        self.assertEqual(self.export(dataset='items', format='jsonl', start_date=tomorrow), b'')
+
+    def test_gzip_matches_plain_output(self):
+        plain = self.export(dataset='history')
+        self.assertEqual(gzip.decompress(self.export(dataset='history', gzip='1')), plain)
+
+    def test_rows_are_read_lazily(self):
+        with self.assertNumQueries(0):
+            chunks = iter_export('orders', 'csv')
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(chunks)), 3)
+        with self.assertRaises(ExportError):
+            iter_export('orders', 'csv', status='Lost')
+
+    def test_command_writes_gzip_file(self):
+        path = os.path.join(tempfile.mkdtemp(), 'orders.csv.gz')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        call_command('export_orders', 'orders', '--gzip', '-o', path, stderr=io.StringIO())
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            self.assertEqual(len(list(csv.reader(f))), 3)
+
+
+class ProductImportTests(TestCase):
+    """批量导入：按 sku upsert、分类路径自动建立、逐行错误报告；dry run 整体回滚"""
+
+    FEED = (
+        'sku,name,category,price,stock_quantity,attributes\n'
+        'A-1,Lamp,Home > Lighting,10,3,Color=Red;Size=L\n'
+        'A-2,Chair,Home,25,1,\n'
+        'A-3,Broken,Home,not-a-price,1,\n'
+        'A-4,,,,2,\n'
+    )
+
+    def run_import(self, feed, **kwargs):
+        return ProductImporter(**kwargs).run(read_rows(io.StringIO(feed), 'csv'))
+
+    def test_creates_products_and_reports_bad_rows(self):
+        result = self.run_import(self.FEED)
+        self.assertEqual((result.created, result.updated), (2, 0))
+        self.assertEqual([(line, sku) for line, sku, _ in result.errors], [(4, 'A-3'), (5, 'A-4')])
+        self.assertIn('price', result.errors[0][2])
+        lamp = Product.objects.get(sku='A-1')
+        self.assertEqual(lamp.category.name, 'Lighting')
+        self.assertEqual(lamp.category.parent.name, 'Home')
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(sorted(lamp.attributes.values_list('attribute_name', 'attribute_value')),
+                         [('Color', 'Red'), ('Size', 'L')])
+
+    def test_upsert_by_sku_keeps_blank_columns(self):
+        self.run_import(self.FEED)
+        result = self.run_import('sku,price,attributes\nA-1,12,Color=Blue\n')
+        self.assertEqual((result.created, result.updated, result.errors), (0, 1, []))
+        lamp = Product.objects.get(sku='A-1')
+        self.assertEqual((lamp.name, lamp.price, lamp.stock_quantity), ('Lamp', 12, 3))
+        self.assertEqual(list(lamp.attributes.values_list('attribute_name', 'attribute_value')), [('Color', 'Blue')])
+
+    def test_dry_run_rolls_back(self):
+        result = self.run_import(self.FEED, dry_run=True)
+        self.assertEqual(result.created, 2)
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(Category.objects.exists())
+
+    def test_batch_queries_do_not_grow_with_rows(self):
+        Category.objects.create(name='Home')
+
+        def feed(count, start):
+            return 'sku,name,category,price\n' + ''.join(f'S-{i},Item {i},Home,5\n' for i in range(start, start + count))
+
+        with CaptureQueriesContext(connection) as small:
+            self.run_import(feed(2, 0))
+        with CaptureQueriesContext(connection) as large:
+            self.run_import(feed(20, 100))
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(Product.objects.count(), 22)
+
+
+class RatingAggregateTests(StockTestCase):
+    """评分汇总随评论的新增 / 编辑 / 删除在同一事务中更新；recompute_ratings 修正偏差"""
+
+    def setUp(self):
+        self.order = self.shipped_order(self.buyer, self.mug)
+        self.client.force_login(self.buyer)
+
+    def shipped_order(self, user, product):
+        # Review.order 是一对一：每个订单只有一条评论，这里每个订单只放一个商品
+        order = Order.objects.create(user=user, total_amount=0, shipping_address_snapshot='-', status=Order.Status.SHIPPED)
+        OrderItem.objects.create(order=order, product=product, product_name_snapshot=product.name,
+                                 unit_price_snapshot=1, quantity=1)
+        return order
+
+    def assertRating(self, product, review_count, rating_sum, avg_rating):
+        product.refresh_from_db()
+        self.assertEqual((product.review_count, product.rating_sum, product.avg_rating),
+                         (review_count, rating_sum, avg_rating))
+
+    def review(self, name, *args, **data):
+        self.client.post(reverse(f'core:{name}', args=args), data)
+
+    def test_add_edit_delete_review(self):
+        self.review('add_order_review', self.order.pk, rating=4, comment='Good')
+        self.assertRating(self.mug, 1, 4, 4.0)
+        self.assertRating(self.cup, 0, 0, 0.0)
+
+        # 另一位顾客的评论
+        other_order = self.shipped_order(self.other, self.mug)
+        self.client.force_login(self.other)
+        self.review('add_order_review', other_order.pk, rating=1, comment='Bad')
+        self.assertRating(self.mug, 2, 5, 2.5)
+
+        self.client.force_login(self.buyer)
+        review = Review.objects.get(order=self.order)
+        self.review('edit_order_review', review.pk, rating=2, comment='Meh')
+        self.assertRating(self.mug, 2, 3, 1.5)
+
+        self.review('delete_order_review', review.pk)
+        self.assertRating(self.mug, 1, 1, 1.0)
+
+    def test_recompute_corrects_drift(self):
+        self.review('add_order_review', self.order.pk, rating=5, comment='Great')
+        Product.objects.update(review_count=7, rating_sum=1, avg_rating=0.1)
+        out = io.StringIO()
+        call_command('recompute_ratings', stdout=out)
+        self.assertIn('2 products corrected', out.getvalue())
+        self.assertRating(self.cup, 0, 0, 0.0)
+        self.assertRating(self.mug, 1, 5, 5.0)
+
+    def test_catalog_sorts_by_stored_rating(self):
+        Product.objects.filter(pk=self.cup.pk).update(review_count=1, rating_sum=5, avg_rating=5.0)
+        Product.objects.filter(pk=self.mug.pk).update(review_count=1, rating_sum=3, avg_rating=3.0)
+        self.client.logout()
+        response = self.client.get(reverse('core:product_list'), {'sort': 'rating'})
+        self.assertEqual([product.pk for product in response.context['products']], [self.cup.pk, self.mug.pk])
+
+
+@locmem_cache
+class ProductReviewPaginationTests(TestCase):
+    """详情页评论按 (created_at, id) 游标分页，"加载更多" 接口返回下一页；查询数与评论数无关"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            category=Category.objects.create(name='Mugs'), name='Mug', description_html='', price=5,
+        )
+        cls.user = User.objects.create_user('reviewer', password='x')
+        cls.add_reviews(15)
+
+    @classmethod
+    def add_reviews(cls, count):
+        start = cls.product.reviews.count()
+        Review.objects.bulk_create([
+            Review(product=cls.product, user=cls.user, rating=5, comment=f'Review number {i}')
+            for i in range(start, start + count)
+        ])
+
+    def detail(self):
+        cache.clear()
+        return self.client.get(reverse('core:product_detail', args=[self.product.pk]))
+
+    def load_more(self, cursor):
+        return self.client.get(reverse('core:product_reviews', args=[self.product.pk]), {'cursor': cursor})
+
+    def test_first_page_then_load_more(self):
+        reviews = self.detail().context['reviews']
+        self.assertEqual(len(reviews), REVIEWS_PER_PAGE)
+        self.assertTrue(reviews.has_next)
+        data = self.load_more(reviews.next_cursor).json()
+        self.assertEqual(data['count'], 5)
+        self.assertIsNone(data['next_cursor'])
+        shown = {review.comment for review in reviews}
+        self.assertEqual(sum(comment in data['html'] for comment in shown), 0)
+        self.assertEqual(len(shown) + data['count'], 15)
+
+    def test_invalid_cursor_is_400(self):
+        response = self.load_more('not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Invalid cursor.'})
+
+    def test_detail_queries_do_not_grow_with_reviews(self):
+        with CaptureQueriesContext(connection) as few:
+            self.detail()
+        self.add_reviews(40)
+        with CaptureQueriesContext(connection) as many:
+            self.detail()
+        self.assertEqual(len(many), len(few))
+
+
+@locmem_cache
+class KeysetPaginationTests(TestCase):
+    """游标分页：前后翻页结果一致，created_at 相同的行按 id 区分；无效游标返回 400"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Mugs')
+        Product.objects.bulk_create([
+            Product(category=category, name=f'Mug {i}', description_html='', price=5) for i in range(7)
+        ])
+        # 一半商品的上架时间相同，只能靠 id 区分先后
+        Product.objects.filter(pk__in=Product.objects.order_by('pk').values('pk')[:4]).update(
+            created_at=timezone.now() - datetime.timedelta(days=1),
+        )
+        cls.expected = list(Product.objects.order_by(*LATEST_ORDERING).values_list('pk', flat=True))
+
+    def pages(self, page_size=3):
+        pages, cursor = [], None
+        while True:
+            page = keyset_paginate(Product.objects.all(), LATEST_ORDERING, cursor=cursor, page_size=page_size)
+            pages.append(page)
+            if not page.has_next:
+                return pages
+            cursor = page.next_cursor
+
+    def test_forward_then_backward(self):
+        pages = self.pages()
+        self.assertEqual([product.pk for page in pages for product in page], self.expected)
+        self.assertFalse(pages[0].has_previous)
+        # 从最后一页一路翻回第一页
+        page = pages[-1]
+        for previous in reversed(pages[:-1]):
+            page = keyset_paginate(Product.objects.all(), LATEST_ORDERING, cursor=page.previous_cursor, page_size=3)
+            self.assertEqual([product.pk for product in page], [product.pk for product in previous])
+        self.assertFalse(page.has_previous)
+
+    def test_approximate_count(self):
+        page = keyset_paginate(Product.objects.all(), LATEST_ORDERING, page_size=3, count_limit=5)
+        self.assertEqual((page.count, page.count_exact), (5, False))
+        page = keyset_paginate(Product.objects.all(), LATEST_ORDERING, page_size=3, count_limit=10)
+        self.assertEqual((page.count, page.count_exact), (7, True))
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', encode_cursor([1]), encode_cursor(['not-a-date', 1])):
+            with self.assertRaises(InvalidCursor):
+                keyset_paginate(Product.objects.all(), LATEST_ORDERING, cursor=cursor)
+        self.assertEqual(self.client.get(reverse('core:product_list'), {'cursor': 'garbage'}).status_code, 400)
+        self.client.force_login(User.objects.create_user('vendor', password='x', role=User.Role.ADMIN))
+        for name in ('core:vendor_product_list', 'core:vendor_order_list'):
+            self.assertEqual(self.client.get(reverse(name), {'cursor': 'garbage'}).status_code, 400)
+
+    def test_product_list_follows_cursor(self):
+        first = self.client.get(reverse('core:product_list')).context['products']
+        second = self.client.get(reverse('core:product_list'), {'cursor': first.next_cursor}).context['products']
+        self.assertEqual([product.pk for product in [*first, *second]], self.expected)
+
+
+@locmem_cache
+class FacetTests(TestCase):
+    """分面筛选：同一分面内 OR、分面之间 AND；所有计数一条 UNION ALL 查询，结果缓存到目录变化为止"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shoes')
+        specs = [
+            ('Nike', 'Leather', 40, 'Red'),
+            ('Nike', 'Canvas', 80, 'Blue'),
+            ('Acme', 'Leather', 120, 'Red'),
+            ('Acme', 'Canvas', 30, None),
+        ]
+        for i, (brand, material, price, color) in enumerate(specs):
+            product = Product.objects.create(category=category, name=f'Shoe {i}', description_html='',
+                                             brand=brand, material=material, price=price)
+            if color:
+                product.attributes.create(attribute_name='Color', attribute_value=color)
+
+    def counts(self, query):
+        params = QueryDict(query)
+        return {(facet, value): n for facet, value, n in facet_count_rows(Product.objects.all(), parse_facets(params))}
+
+    def filtered(self, query):
+        return set(apply_facets(Product.objects.all(), parse_facets(QueryDict(query))).values_list('name', flat=True))
+
+    def test_filters(self):
+        self.assertEqual(self.filtered('brand=Nike&brand=Acme&material=Leather'), {'Shoe 0', 'Shoe 2'})
+        self.assertEqual(self.filtered('attr=Color:Red&price=0-50'), {'Shoe 0'})
+        self.assertEqual(self.filtered('attr=Color:Red&attr=Color:Blue&brand=Nike'), {'Shoe 0', 'Shoe 1'})
+
+    def test_counts_in_one_query_ignoring_own_facet(self):
+        with self.assertNumQueries(1):
+            counts = self.counts('brand=Nike')
+        # 品牌自己的计数不受品牌筛选影响，其它分面只数 Nike
+        self.assertEqual(counts[('brand', 'Acme')], 2)
+        self.assertEqual(counts[('material', 'Leather')], 1)
+        self.assertEqual(counts[('price', '0-50')], 1)
+        self.assertEqual(counts[('attr:Color', 'Blue')], 1)
+
+    def test_counts_cached_until_catalog_changes(self):
+        def facet_queries(**params):
+            # sort 不影响计数，换一个 sort 绕过整页缓存，只看分面计数是否重新查询
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('core:product_list'), {'brand': 'Nike', **params})
+            return sum('UNION ALL' in q['sql'] for q in queries)
+
+        self.assertEqual(facet_queries(), 1)
+        self.assertEqual(facet_queries(sort='price_asc'), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(name='Shoe 3').save()
+        self.assertEqual(facet_queries(sort='price_desc'), 1)
+
+
+@locmem_cache
+class CategoryTreeTests(TestCase):
+    """分类物化路径：移动时整棵子树一起改写，不能移到自己的子树下；按分类筛选包含子孙分类的商品"""
+
+    def setUp(self):
+        cache.clear()
+        self.home = Category.objects.create(name='Home')
+        self.lighting = Category.objects.create(name='Lighting', parent=self.home)
+        self.lamps = Category.objects.create(name='Lamps', parent=self.lighting)
+        self.garden = Category.objects.create(name='Garden')
+
+    def paths(self):
+        return dict(Category.objects.values_list('name', 'path'))
+
+    def test_paths_and_subtree(self):
+        h, li, la = self.home.pk, self.lighting.pk, self.lamps.pk
+        self.assertEqual(self.paths()['Lamps'], f'{h}/{li}/{la}/')
+        self.assertEqual(self.lamps.depth, 2)
+        self.assertEqual(set(Category.objects.subtree(self.lighting.path)), {self.lighting, self.lamps})
+
+    def test_subtree_does_not_match_longer_ids(self):
+        short = Category.objects.create(pk=17, name='Short')
+        Category.objects.create(pk=170, name='Long')
+        child = Category.objects.create(name='Child', parent=short)
+        self.assertEqual(set(Category.objects.subtree(short.path)), {short, child})
+
+    def test_move_rewrites_whole_subtree(self):
+        bulbs = Category.objects.create(name='Bulbs', parent=self.lamps)
+        self.lighting.parent = self.garden
+        # 加锁读旧路径、读新父路径、UPDATE 自身、一条 UPDATE 改写子树、UPDATE 自身路径 (+ savepoint)，与子树大小无关
+        with self.assertNumQueries(7):
+            self.lighting.save()
+        g, li, la = self.garden.pk, self.lighting.pk, self.lamps.pk
+        self.assertEqual(self.paths()['Lamps'], f'{g}/{li}/{la}/')
+        self.assertEqual(self.paths()['Bulbs'], f'{g}/{li}/{la}/{bulbs.pk}/')
+        self.assertEqual(Category.objects.get(pk=bulbs.pk).depth, 3)
+
+    def test_cycle_is_rejected(self):
+        self.home.parent = self.lamps
+        with self.assertRaises(ValidationError):
+            self.home.full_clean()
+        with self.assertRaises(ValidationError):
+            self.home.save()
+        self.assertEqual(self.paths()['Home'], f'{self.home.pk}/')
+
+    def test_product_list_filters_by_subtree(self):
+        for name, category in (('Desk lamp', self.lamps), ('Spotlight', self.lighting), ('Rake', self.garden)):
+            Product.objects.create(category=category, name=name, description_html='', price=5)
+        response = self.client.get(reverse('core:product_list'), {'category': self.home.pk})
+        self.assertEqual({product.name for product in response.context['products']}, {'Desk lamp', 'Spotlight'})
+
+    def test_tree_cached_until_categories_change(self):
+        self.assertEqual(
+            [(node['name'], node['depth']) for node in get_category_tree()],
+            [('Garden', 0), ('Home', 0), ('Lighting', 1), ('Lamps', 2)],
+        )
+        with self.assertNumQueries(0):
+            get_category_tree()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Tools', parent=self.garden)
+        self.assertIn('Tools', [node['name'] for node in get_category_tree()])
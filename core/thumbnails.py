@@ -0,0 +1,108 @@
+"""
+商品图片缩略图 (Responsive Image Variants)
+
+ProductImage 上传后按固定宽度生成 WebP 缩略图，与原图放在同一目录：
+    product_images/mug.jpg -> product_images/mug.w240.webp, product_images/mug.w480.webp ...
+已生成的宽度记录在 ProductImage.variants，模板通过 {% product_img %} 输出 srcset / loading="lazy"，
+不需要逐个访问存储判断文件是否存在。
+
+- 上传 (ProductImage.save) 或批量导入 (core/importers.py) 后在事务提交时交给后台线程池生成，不阻塞请求；
+  settings.IMAGE_VARIANTS_ASYNC = False 时在当前线程同步生成 (测试 / 调试用)
+- 存量图片使用 `python manage.py generate_image_variants` (进程池) 补齐
+"""
+import io
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# 生成的宽度 (px)：后台 50px / 购物车 60px 预览用 120 (2x)，列表卡片 220px 用 240 / 480，详情页用 960
+VARIANT_WIDTHS = (120, 240, 480, 960)
+VARIANT_FORMAT = 'WEBP'
+VARIANT_QUALITY = 80
+
+_executor = None
+
+
+def variant_name(name, width):
+    root, _ext = posixpath.splitext(name)
+    return f'{root}.w{width}.webp'
+
+
+def is_variant_name(name):
+    """是否为 variant_name() 生成的文件名 (孤儿文件清理时需要区分)"""
+    root, ext = posixpath.splitext(name)
+    suffix = posixpath.splitext(root)[1]
+    return ext == '.webp' and suffix.startswith('.w') and suffix[2:].isdigit()
+
+
+def render_variants(name, storage=None):
+    """
+    读取原图并写出各个宽度的 WebP，返回实际生成的宽度列表。
+    不小于原图宽度的尺寸不生成 (不放大)；原图损坏或不存在时返回 []。
+    """
+    storage = storage or default_storage
+    try:
+        with storage.open(name, 'rb') as f:
+            original = Image.open(f)
+            original.load()
+    except (OSError, UnidentifiedImageError, ValueError):
+        logger.warning("Cannot read image %s, skipping variants", name)
+        return []
+
+    # 手机照片常带 EXIF 方向信息，先转正
+    original = ImageOps.exif_transpose(original)
+    if original.mode not in ('RGB', 'RGBA'):
+        has_alpha = 'A' in original.getbands() or 'transparency' in original.info
+        original = original.convert('RGBA' if has_alpha else 'RGB')
+
+    widths = []
+    for width in VARIANT_WIDTHS:
+        if width >= original.width:
+            break
+        height = max(1, round(original.height * width / original.width))
+        resized = original.resize((width, height), Image.LANCZOS)
+        buffer = io.BytesIO()
+        resized.save(buffer, VARIANT_FORMAT, quality=VARIANT_QUALITY, method=4)
+        target = variant_name(name, width)
+        if storage.exists(target):
+            storage.delete(target)
+        storage.save(target, ContentFile(buffer.getvalue()))
+        widths.append(width)
+    return widths
+
+
+def build_variants(image_id, name):
+    """生成缩略图并写回 ProductImage.variants (原图已被替换时不覆盖)"""
+    from .models import ProductImage
+
+    try:
+        widths = render_variants(name)
+        ProductImage.objects.filter(pk=image_id, image=name).update(variants=widths)
+    finally:
+        # 后台线程里用完数据库连接要关闭
+        if getattr(settings, 'IMAGE_VARIANTS_ASYNC', True):
+            connection.close()
+    return widths
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-variants')
+    return _executor
+
+
+def schedule_variants(image_id, name):
+    """图片保存并提交后调用：后台生成缩略图"""
+    if getattr(settings, 'IMAGE_VARIANTS_ASYNC', True):
+        _get_executor().submit(build_variants, image_id, name)
+    else:
+        build_variants(image_id, name)
@@ -12,6 +12,7 @@ urlpatterns = [
     # ==============================
     path('', views.product_list, name='product_list'),
     path('product/<int:pk>/', views.product_detail, name='product_detail'),
+    path('product/<int:pk>/reviews/', views.product_reviews, name='product_reviews'),
 
     # ==============================
     # 2. 用户认证 (Block A1-A2)
@@ -44,10 +45,13 @@ urlpatterns = [
     # 5. 商家门户 (Vendor Portal)
     # ==============================
     path('vendor/orders/', views.vendor_order_list, name='vendor_order_list'),
+    path('vendor/orders/bulk-status/', views.vendor_order_bulk_status, name='vendor_order_bulk_status'),
+    path('vendor/orders/export/', views.vendor_order_export, name='vendor_order_export'),
     path('vendor/orders/<int:pk>/', views.vendor_order_detail, name='vendor_order_detail'),
    
     path('vendor/products/', views.vendor_product_list, name='vendor_product_list'),
     path('vendor/products/add/', views.vendor_product_add, name='vendor_product_add'),
+    path('vendor/products/import/', views.vendor_product_import, name='vendor_product_import'),
     path('vendor/products/edit/<int:pk>/', views.vendor_product_edit, name='vendor_product_edit'),
     path('vendor/products/delete/<int:pk>/', views.vendor_product_delete, name='vendor_product_delete'),
     
@@ -55,6 +59,7 @@ urlpatterns = [
     # 6. 图表及分析 (Analytics)
     # ==============================
     path('analytics/', views.analytics_dashboard, name='analytics'),
+    path('analytics/data/<str:panel>/', views.analytics_panel_data, name='analytics_panel_data'),
 
     # ==============================
     # Block T: 订单评论 URL
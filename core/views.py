@@ -2,48 +2,96 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.db import transaction
-from django.core.paginator import Paginator
-from django.http import JsonResponse
-from django.db.models import Q, Sum, F
-from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear
-from django.utils.dateparse import parse_date
+from django.core.exceptions import BadRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.db.models import Q
 from django.forms import inlineformset_factory
 from .forms import ProductForm, ProductImageFormSet
 from django.contrib import messages
 
 import datetime
 import json
-import random
 
 from .models import Product, Category, Cart, CartItem, Order, OrderItem, Review
-from .forms import CustomUserCreationForm, ProductForm, OrderStatusForm, ProductImageFormSet
+from .search import search_is_ranked, search_products
+from .caching import (
+    invalidate_cart_item_count, get_analytics_result, analytics_cache_stats, get_category_tree, get_facet_counts,
+    annotate_cache_versions, cache_anonymous_page, fragment_cache_context, product_cache_version,
+)
+from .analytics import ANALYTICS_PANELS, record_sales_changes
+from .facets import FACET_PARAMS, apply_facets, facet_count_rows, facet_groups, parse_facets
+from .exports import ExportError, export_filename, gzip_stream, iter_export
+from .importers import ProductImporter, detect_format, read_rows
+from .pagination import InvalidCursor, keyset_paginate
+from .ratings import rating_deltas, record_rating_changes
+from .recommendations import related_products_for
+from .services import (
+    InsufficientStock, available_to_sell, decrement_stock, held_quantities, hold_stock, release_holds,
+    transition_orders,
+)
+from .forms import CustomUserCreationForm, ProductForm, OrderStatusForm, ProductImageFormSet, ProductImportForm
 
 # ==============================
 # 1. 商品浏览 (Block A & C)
 # ==============================
 
+# ==============================
+# 列表分页：游标分页 (core/pagination.py)，不使用 OFFSET / COUNT(*)
+# ==============================
+
+# 默认按上架 / 下单时间倒序，id 保证排序唯一
+LATEST_ORDERING = ('-created_at', '-id')
+# 全文搜索按相关度 (bm25 越小越相关)
+SEARCH_ORDERING = ('search_rank', '-id')
+# 列表上显示的数量最多数到这么多行，超过显示 "1000+"
+LIST_COUNT_LIMIT = 1000
+
+
+def _keyset_page(request, queryset, ordering, page_size):
+    """按 ?cursor= 取一页；游标无效时返回 400"""
+    try:
+        return keyset_paginate(
+            queryset, ordering, cursor=request.GET.get('cursor'),
+            page_size=page_size, count_limit=LIST_COUNT_LIMIT,
+        )
+    except InvalidCursor:
+        raise BadRequest("Invalid cursor.")
+
+
+# 影响商品目录结果 (及分面计数) 的查询参数；sort / cursor 不影响计数
+CATALOG_FILTER_PARAMS = ('q', 'category', 'min_price', 'max_price', 'min_rating', *FACET_PARAMS)
+
+# 商品目录的排序方式 (默认最新上架；有搜索词时按相关度)
+PRODUCT_SORTS = {
+    'rating': ('-avg_rating', '-review_count', '-id'),
+    'reviews': ('-review_count', '-avg_rating', '-id'),
+    'price_asc': ('price', 'id'),
+    'price_desc': ('-price', '-id'),
+}
+
+
+@cache_anonymous_page()
 def product_list(request):
     query = request.GET.get('q')
     category_id = request.GET.get('category')
     min_price = request.GET.get('min_price')
     max_price = request.GET.get('max_price')
+    min_rating = request.GET.get('min_rating')
+    sort = request.GET.get('sort')
     
     # Start with the base queryset
-    products_list = Product.objects.filter(is_active=True).order_by('-created_at')
-
-    # Apply Search
-    if query:
-        products_list = products_list.filter(
-            Q(name__icontains=query) | 
-            Q(description_html__icontains=query) |
-            Q(brand__icontains=query) |
-            Q(material__icontains=query) |
-            Q(origin__icontains=query) 
-        )
+    products_list = Product.objects.filter(is_active=True)
     
-    # Apply Category Filter
+    # Apply Category Filter：包含所有子分类 (按物化路径的一次范围查询)
+    categories = get_category_tree()
     if category_id and category_id != "All Categories":
-        products_list = products_list.filter(category_id=category_id)
+        category = next((node for node in categories if str(node['id']) == category_id), None)
+        if category is None:
+            products_list = products_list.none()
+        else:
+            products_list = products_list.filter(category__in=Category.objects.subtree(category['path']))
 
     # Apply Price Filters
     if min_price:
@@ -51,31 +99,75 @@ def product_list(request):
     if max_price:
         products_list = products_list.filter(price__lte=max_price)
 
-    paginator = Paginator(products_list, 6) 
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # 按评分筛选 / 排序：使用商品上的评分汇总，不需要聚合 Review
+    if min_rating:
+        try:
+            products_list = products_list.filter(avg_rating__gte=float(min_rating))
+        except ValueError:
+            min_rating = None
+
+    # Apply Search (全文索引，按相关度排序)
+    facet_base = products_list
+    if query:
+        products_list = search_products(products_list, query)
+        # 分面计数不需要相关度注解，只按命中的商品过滤
+        facet_base = facet_base.filter(pk__in=products_list.values('pk'))
+
+    # 分面筛选 (品牌 / 材质 / 产地 / 价格区间 / 属性)，计数一条查询得出并缓存
+    facets = parse_facets(request.GET)
+    facet_rows = get_facet_counts(
+        request.GET, CATALOG_FILTER_PARAMS, lambda: facet_count_rows(facet_base, facets)
+    )
+    products_list = apply_facets(products_list, facets).with_primary_image()
+
+    if sort in PRODUCT_SORTS:
+        ordering = PRODUCT_SORTS[sort]
+    elif query and search_is_ranked():
+        ordering = SEARCH_ORDERING
+    else:
+        ordering = LATEST_ORDERING
+
+    page_obj = _keyset_page(request, products_list, ordering, page_size=6)
+    # 商品卡片片段按各自商品的版本号缓存
+    annotate_cache_versions(page_obj)
 
     context = {
         'products': page_obj,
-        'categories': Category.objects.all(),
+        'categories': categories,
         # Pass values back to template to keep inputs filled
         'selected_category': category_id,
         'min_p': min_price,
-        'max_p': max_price
+        'max_p': max_price,
+        'min_rating': min_rating,
+        'sort': sort,
+        'facet_groups': facet_groups(facet_rows, facets),
+        'facet_params': FACET_PARAMS,
+        **fragment_cache_context(),
     }
     return render(request, 'core/product_list.html', context)
 
 
+# 商品详情页评论：每页条数与排序 (与 Review 上的 core_review_product_recent 索引对应)
+REVIEWS_PER_PAGE = 10
+REVIEW_ORDERING = ('-created_at', '-id')
+
+
+# 只随本商品的版本号失效；相关商品卡片按各自版本号缓存，但整页缓存期间 (PAGE_CACHE_TIMEOUT) 可能略旧
+@cache_anonymous_page(version=product_cache_version)
 def product_detail(request, pk):
     product = get_object_or_404(Product, pk=pk, is_active=True)
 
-    related_products = Product.objects.filter(
-            Q(brand=product.brand) | 
-            Q(category=product.category) | 
-            Q(origin=product.origin) | 
-            Q(material=product.material),
-            is_active=True
-        ).exclude(pk=pk).distinct()[:3]
+    # 预先计算的相关商品 (build_related_products 命令生成)，还没有计算过时退回按属性匹配
+    related_products = related_products_for(product, limit=3)
+    if not related_products:
+        related_products = Product.objects.filter(
+                Q(brand=product.brand) | 
+                Q(category=product.category) | 
+                Q(origin=product.origin) | 
+                Q(material=product.material),
+                is_active=True
+            ).exclude(pk=pk).distinct().with_primary_image()[:3]
+    related_products = annotate_cache_versions(related_products)
 
     # ==============================
     # Block T: 檢查用戶是否可以評論
@@ -97,31 +189,49 @@ def product_detail(request, pk):
         # 商品详情页不显示评论表单，所以 can_review 设为 False
         user_eligibility['can_review'] = False
     
-    # 获取该商品的所有评论，按创建时间倒序排序（最新的在前）
-    reviews = product.reviews.all().order_by('-created_at')
+    # 评论按创建时间倒序分页 (游标分页，只取第一页；更多评论由 product_reviews 接口加载)
+    reviews = keyset_paginate(
+        product.reviews.select_related('user'), REVIEW_ORDERING, page_size=REVIEWS_PER_PAGE
+    )
     
-    # ===== 计算平均评分 =====
-    total_reviews_count = reviews.count()
-    avg_rating_display = 0
-    avg_rating_int = 0
-    
-    if total_reviews_count > 0:
-        total_rating = sum(review.rating for review in reviews)
-        avg_rating_display = round(total_rating / total_reviews_count, 1)
-        avg_rating_int = round(avg_rating_display)
+    # ===== 平均评分：直接读取商品上的评分汇总 (core/ratings.py) =====
+    total_reviews_count = product.review_count
+    avg_rating_display = round(product.avg_rating, 1) if total_reviews_count else 0
+    avg_rating_int = round(avg_rating_display)
     
     context = {
         'product': product,
+        # 可售数量 = 库存 - 其他用户的有效预占
+        'available_quantity': available_to_sell(product, request.user if request.user.is_authenticated else None),
         'related_products': related_products,
         'user_eligibility': user_eligibility,
         'reviews': reviews,
         'total_reviews_count': total_reviews_count,
         'avg_rating_display': avg_rating_display,
         'avg_rating_int': avg_rating_int,
+        **fragment_cache_context(),
     }
 
     return render(request, 'core/product_detail.html', context)
 
+
+def product_reviews(request, pk):
+    """商品详情页 "加载更多评论"：按游标返回下一页评论的 HTML 片段"""
+    product = get_object_or_404(Product, pk=pk, is_active=True)
+    try:
+        page = keyset_paginate(
+            product.reviews.select_related('user'), REVIEW_ORDERING,
+            cursor=request.GET.get('cursor'), page_size=REVIEWS_PER_PAGE,
+        )
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor.'}, status=400)
+
+    html = ''.join(
+        render_to_string('core/partials/review_card.html', {'review': review}, request=request)
+        for review in page
+    )
+    return JsonResponse({'html': html, 'count': len(page), 'next_cursor': page.next_cursor})
+
 # ==============================
 # 2. 用户注册 (Block A1)
 # ==============================
@@ -145,7 +255,10 @@ def register(request):
 def add_to_cart(request, product_id):
     product = get_object_or_404(Product, id=product_id)
     cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_item, item_created = CartItem.objects.get_or_create(cart=cart, product=product)
+    cart_item = CartItem.objects.filter(cart=cart, product=product).first()
+    item_created = cart_item is None
+    if item_created:
+        cart_item = CartItem(cart=cart, product=product)
     
     if request.method == 'POST':
         quantity = int(request.POST.get('quantity', 1))
@@ -156,16 +269,25 @@ def add_to_cart(request, product_id):
     else:
         if not item_created:
             cart_item.quantity += 1
+
+    # [库存预占] 按购物车里的总数量占用库存，超过可售数量则不加入
+    try:
+        hold_stock(request.user, product, cart_item.quantity)
+    except InsufficientStock:
+        available = available_to_sell(product, request.user)
+        messages.error(request, f"Sorry, only {available} of \"{product.name}\" available right now.")
+        return redirect('core:product_detail', pk=product.pk)
             
     cart_item.save()
     cart.save()
+    invalidate_cart_item_count(request.user.pk)
     
     return redirect('core:cart_detail')
 
 @login_required(login_url='core:login')
 def cart_detail(request):
     cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_items = cart.cartitem_set.all()
+    cart_items = cart.cartitem_set.select_related('product__primary_image')
     
     total_price = 0
     for item in cart_items:
@@ -182,6 +304,8 @@ def cart_detail(request):
 def remove_from_cart(request, item_id):
     cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
     cart_item.delete()
+    release_holds(request.user, [cart_item.product_id])
+    invalidate_cart_item_count(request.user.pk)
     return redirect('core:cart_detail')
 
 @login_required(login_url='core:login')
@@ -193,11 +317,15 @@ def update_cart_quantity(request, item_id):
             cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
             
             if quantity > 0:
-                if quantity > cart_item.product.stock_quantity:
+                # 刷新预占；超过可售数量 (库存 - 他人预占) 时拒绝
+                try:
+                    hold_stock(request.user, cart_item.product, quantity)
+                except InsufficientStock:
                      return JsonResponse({'success': False, 'error': 'Exceeds stock limit'})
                 
                 cart_item.quantity = quantity
                 cart_item.save()
+                invalidate_cart_item_count(request.user.pk)
             else:
                 return JsonResponse({'success': False, 'error': 'Quantity must be at least 1'})
 
@@ -224,49 +352,71 @@ def update_cart_quantity(request, item_id):
 def checkout(request):
     """
     Block A11: 结算流程，带库存扣除逻辑
+    库存在事务内用条件 UPDATE 扣减，并发结算也不会超卖
     """
     cart, _ = Cart.objects.get_or_create(user=request.user)
-    cart_items = cart.cartitem_set.all()
     
-    if not cart_items.exists():
+    if not cart.cartitem_set.exists():
         return redirect('core:product_list')
 
-    total_amount = 0
-    
-    # [库存检查] 结算前检查库存是否充足
-    for item in cart_items:
-        if item.product.stock_quantity < item.quantity:
-            # 可以在这里加入错误提示 flash message
-            return redirect('core:cart_detail')
-        total_amount += item.product.price * item.quantity
+    try:
+        with transaction.atomic():
+            cart_items = list(cart.cartitem_set.order_by('product_id'))
+            product_ids = sorted({item.product_id for item in cart_items})
+            # [行锁] 按 id 顺序锁住相关商品 (SQLite 不支持，会自动忽略)
+            products = Product.objects.select_for_update().in_bulk(product_ids)
 
-    with transaction.atomic():
-        address_snapshot = "用户默认收货地址"
-        if request.user.addresses.exists():
-            addr = request.user.addresses.first()
-            address_snapshot = f"{addr.recipient_name}, {addr.address_line1}, {addr.city}"
+            quantities = {}
+            for item in cart_items:
+                quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
 
-        order = Order.objects.create(
-            user=request.user,
-            total_amount=total_amount,
-            shipping_address_snapshot=address_snapshot,
-            status=Order.Status.PENDING
-        )
+            # [扣除库存] 需同时满足其他用户的有效预占；
+            # 任意一行库存不足都会抛出 InsufficientStock 并整体回滚
+            reserved = held_quantities(product_ids, exclude_user=request.user)
+            decrement_stock(quantities, reserved)
 
-        for item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                product_name_snapshot=item.product.name,
-                unit_price_snapshot=item.product.price,
-                quantity=item.quantity
+            address_snapshot = "用户默认收货地址"
+            addr = request.user.addresses.first()
+            if addr:
+                address_snapshot = f"{addr.recipient_name}, {addr.address_line1}, {addr.city}"
+
+            total_amount = sum(products[item.product_id].price * item.quantity for item in cart_items)
+            order = Order.objects.create(
+                user=request.user,
+                total_amount=total_amount,
+                shipping_address_snapshot=address_snapshot,
+                status=Order.Status.PENDING
             )
-            # [扣除库存] 下单成功后实时更新库存
-            item.product.stock_quantity -= item.quantity
-            item.product.save(update_fields=['stock_quantity'])
-        
-        cart_items.delete()
 
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product_id=item.product_id,
+                    product_name_snapshot=products[item.product_id].name,
+                    unit_price_snapshot=products[item.product_id].price,
+                    quantity=item.quantity
+                )
+                for item in cart_items
+            ])
+            # 报表预聚合表：新订单计入 Pending
+            record_sales_changes([(order.id, None, order.status)])
+            
+            cart.cartitem_set.all().delete()
+            # 库存已真正扣减，释放自己的预占
+            release_holds(request.user, product_ids)
+    except InsufficientStock as exc:
+        product = Product.objects.filter(pk=exc.product_id).only('name', 'stock_quantity').first()
+        if product:
+            messages.error(
+                request,
+                f"Sorry, only {available_to_sell(product, request.user)} of \"{product.name}\" left in stock. "
+                f"Please adjust your cart and try again."
+            )
+        else:
+            messages.error(request, "Some items in your cart are no longer available.")
+        return redirect('core:cart_detail')
+
+    invalidate_cart_item_count(request.user.pk)
     return redirect('core:order_detail', pk=order.id)
 
 @login_required(login_url='core:login')
@@ -318,17 +468,14 @@ def vendor_dashboard(request):
 @user_passes_test(is_admin)
 def vendor_product_list(request):
     query = request.GET.get('q')
-    products_list = Product.objects.all().order_by('-created_at')
+    products_list = Product.objects.select_related('category').with_primary_image()
     
     if query:
         # === 核心修复 Bug 1: 清理并判断输入是否是数字 ===
         clean_query = query.replace('#', '').strip()
         
-        # 组装基础文本查询条件
-        q_objects = Q(name__icontains=clean_query) | \
-                    Q(brand__icontains=clean_query) | \
-                    Q(material__icontains=clean_query) | \
-                    Q(origin__icontains=clean_query)
+        # 文本条件走全文索引 (与前台 product_list 共用)
+        q_objects = Q(pk__in=search_products(Product.objects.all(), clean_query).values('pk'))
         
         # 只有在输入全是数字时，才进行 ID 匹配，避免 ValueError
         if clean_query.isdigit():
@@ -336,9 +483,7 @@ def vendor_product_list(request):
             
         products_list = products_list.filter(q_objects)
     
-    paginator = Paginator(products_list, 10) 
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = _keyset_page(request, products_list, LATEST_ORDERING, page_size=10)
     
     return render(request, 'vendor/product_list.html', {
         'products': page_obj,  
@@ -360,6 +505,9 @@ def _handle_primary_image(product):
         first_image.is_primary = True
         first_image.save()
 
+    # update() 不会触发 signals，这里同步一下商品上的主图指针
+    Product.objects.filter(pk=product.pk).sync_primary_images()
+
 @login_required
 @user_passes_test(is_admin)
 def vendor_product_add(request):
@@ -422,23 +570,114 @@ def vendor_product_delete(request, pk):
         product.delete()
     return redirect('core:vendor_product_list')
 
+# 页面上最多显示的错误行数 (完整报告请用 import_products --errors)
+IMPORT_ERRORS_SHOWN = 200
+
+@login_required
+@user_passes_test(is_admin)
+def vendor_product_import(request):
+    """批量导入商品：上传 CSV / JSONL，按 SKU 新建或更新，可先 dry run 校验"""
+    result = None
+    if request.method == 'POST':
+        form = ProductImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                result = ProductImporter(dry_run=form.cleaned_data['dry_run']).run(
+                    read_rows(upload.file, detect_format(upload.name))
+                )
+            except UnicodeDecodeError:
+                form.add_error('file', "The file must be UTF-8 encoded.")
+            else:
+                level = messages.WARNING if result.errors else messages.SUCCESS
+                messages.add_message(request, level, result.summary())
+    else:
+        form = ProductImportForm()
+
+    return render(request, 'vendor/product_import.html', {
+        'form': form,
+        'result': result,
+        'errors': result.errors[:IMPORT_ERRORS_SHOWN] if result else [],
+    })
+
 @login_required
 @user_passes_test(is_admin)
 def vendor_order_list(request):
-    orders = Order.objects.all().order_by('-created_at')
+    orders = Order.objects.select_related('user')
     status = request.GET.get('status')
     if status:
         orders = orders.filter(status=status)
         
-    paginator = Paginator(orders, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = _keyset_page(request, orders, LATEST_ORDERING, page_size=10)
     
     return render(request, 'vendor/order_list.html', {
         'orders': page_obj,
-        'status_choices': Order.Status.choices
+        'status_choices': Order.Status.choices,
+        # 批量操作可选的目标状态 (状态机里出现过的目标状态)
+        'bulk_status_choices': [
+            (code, label) for code, label in Order.Status.choices if Order.statuses_allowing(code)
+        ],
     })
 
+@login_required
+@user_passes_test(is_admin)
+def vendor_order_bulk_status(request):
+    """
+    批量修改订单状态：对勾选的订单套用与 OrderStatusForm 相同的状态机，
+    不允许流转的订单会被跳过
+    """
+    if request.method != 'POST':
+        return redirect('core:vendor_order_list')
+
+    new_status = request.POST.get('status')
+    order_ids = [int(pk) for pk in request.POST.getlist('order_ids') if pk.isdigit()]
+
+    if new_status not in Order.Status.values:
+        messages.error(request, "Please choose a valid status.")
+    elif not order_ids:
+        messages.error(request, "Please select at least one order.")
+    else:
+        changed = transition_orders(order_ids, new_status, enforce_workflow=True)
+        skipped = len(set(order_ids)) - len(changed)
+        messages.success(request, f"{len(changed)} order(s) updated to {Order.Status(new_status).label}.")
+        if skipped:
+            messages.warning(request, f"{skipped} order(s) skipped: this change is not allowed from their current status.")
+
+    # 只允许跳回本站 (拒绝 //evil.example/ 这类协议相对地址)
+    next_url = request.POST.get('next')
+    if url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}, require_https=request.is_secure()):
+        return redirect(next_url)
+    return redirect('core:vendor_order_list')
+
+@login_required
+@user_passes_test(is_admin)
+def vendor_order_export(request):
+    """
+    流式导出订单数据 (orders / items / history)，支持日期、状态过滤和 gzip 压缩
+    例: ?dataset=items&format=jsonl&start_date=2025-01-01&status=Shipped&gzip=1
+    """
+    dataset = request.GET.get('dataset', 'orders')
+    fmt = request.GET.get('format', 'csv')
+    compress = request.GET.get('gzip') == '1'
+    try:
+        chunks = iter_export(
+            dataset, fmt,
+            start_date=request.GET.get('start_date'),
+            end_date=request.GET.get('end_date'),
+            status=request.GET.get('status'),
+        )
+    except ExportError as e:
+        messages.error(request, f"Export failed: {e}")
+        return redirect('core:vendor_order_list')
+
+    content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    if compress:
+        response = StreamingHttpResponse(gzip_stream(chunks), content_type='application/gzip')
+    else:
+        response = StreamingHttpResponse(chunks, content_type=f'{content_type}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(dataset, fmt, compress)}"'
+    return response
+
 @login_required
 @user_passes_test(is_admin)
 def vendor_order_detail(request, pk):
@@ -458,245 +697,56 @@ def vendor_order_detail(request, pk):
 # 6. 图表与分析 (Reports and Analytics)
 # ==============================
 
+def _analytics_panel(panel, params):
+    """读取单个图表面板的数据：缓存 key 只包含该面板自己的筛选参数"""
+    compute, names = ANALYTICS_PANELS[panel]
+    return get_analytics_result(panel, params, lambda: compute(params), names)
+
+
 @login_required(login_url='core:login')
 def analytics_dashboard(request):
     """
-    报告与分析：显示销量Top3及收入折线图
+    报告与分析：显示销量Top3，三个图表由浏览器分别请求 analytics_panel_data 并行加载
+    相同筛选条件的计算结果会被缓存，订单变化时自动失效 (见 core/caching.py)
     """
     # 限制仅管理员或商家可以访问图表
     if request.user.role != 'Admin':
         return redirect('core:product_list')
 
-    # ------------------
-    # 1. 销量前Top3产品
-    # ------------------
-    # 只统计未取消且非待处理的订单 (已完成/发货等)
-    valid_orders = Order.objects.exclude(status__in=[Order.Status.CANCELLED, Order.Status.REFUNDED, Order.Status.PENDING])
-    
-    top_products = OrderItem.objects.filter(order__in=valid_orders).values(
-        'product_name_snapshot'
-    ).annotate(
-        total_qty=Sum('quantity'),
-        total_revenue=Sum(F('quantity') * F('unit_price_snapshot'))
-    ).order_by('-total_qty')[:3]
-
-    # ------------------
-    # 2. 销售额折线图
-    # ------------------
-    start_date_str = request.GET.get('start_date')
-    end_date_str = request.GET.get('end_date')
-    group_by = request.GET.get('group_by', 'day') 
-
-    filtered_orders = valid_orders
-
-    # 日期范围过滤
-    if start_date_str:
-        start_date = parse_date(start_date_str)
-        if start_date:
-            filtered_orders = filtered_orders.filter(created_at__date__gte=start_date)
-    if end_date_str:
-        end_date = parse_date(end_date_str)
-        if end_date:
-            filtered_orders = filtered_orders.filter(created_at__date__lte=end_date)
-
-    # 聚合截断粒度 (年/月/日)
-    if group_by == 'year':
-        trunc_func = TruncYear('created_at')
-    elif group_by == 'month':
-        trunc_func = TruncMonth('created_at')
-    elif group_by == 'week':
-        trunc_func = TruncWeek('created_at')
-    else:
-        trunc_func = TruncDay('created_at')
-
-    revenue_data = filtered_orders.annotate(
-        date_group=trunc_func
-    ).values('date_group').annotate(
-        daily_total=Sum('total_amount')
-    ).order_by('date_group')
-
-# ==========================================
-    # 模块 2：特定商品销量与销售额对比 (Comparison Chart) - 升级版
-    # ==========================================
-    all_products = Product.objects.all().values('id', 'name')
-    
-    cmp_start_str = request.GET.get('cmp_start_date')
-    cmp_end_str = request.GET.get('cmp_end_date')
-    cmp_group_by = request.GET.get('cmp_group_by', 'day')
-    # 新增：接收用户选择的指标（revenue, quantity, 或 both）
-    cmp_metric = request.GET.get('cmp_metric', 'both') 
-    selected_pids = request.GET.getlist('selected_products')
-
-    cmp_orders = valid_orders
-
-    if cmp_start_str:
-        cmp_start = parse_date(cmp_start_str)
-        if cmp_start: cmp_orders = cmp_orders.filter(created_at__date__gte=cmp_start)
-    if cmp_end_str:
-        cmp_end = parse_date(cmp_end_str)
-        if cmp_end: cmp_orders = cmp_orders.filter(created_at__date__lte=cmp_end)
-
-    if cmp_group_by == 'year':
-        cmp_trunc = TruncYear('order__created_at')
-    elif cmp_group_by == 'month':
-        cmp_trunc = TruncMonth('order__created_at')
-    elif cmp_group_by == 'week':
-        cmp_trunc = TruncWeek('order__created_at')
-    else:
-        cmp_trunc = TruncDay('order__created_at')
-
-    cmp_datasets = []
-    cmp_labels = []
-    
-    if selected_pids:
-        cmp_items = OrderItem.objects.filter(order__in=cmp_orders, product_id__in=selected_pids)
-        cmp_data = cmp_items.annotate(
-            date_group=cmp_trunc
-        ).values('date_group', 'product_id', 'product_name_snapshot').annotate(
-            daily_qty=Sum('quantity'),
-            daily_rev=Sum(F('quantity') * F('unit_price_snapshot'))
-        ).order_by('date_group')
-
-        unique_dates = sorted(list(set(item['date_group'] for item in cmp_data if item['date_group'])))
-        if cmp_group_by == 'year':
-            cmp_labels = [d.strftime('%Y') for d in unique_dates]
-        elif cmp_group_by == 'month':
-            cmp_labels = [d.strftime('%Y-%m') for d in unique_dates]
-        elif cmp_group_by == 'week':
-            cmp_labels = [f"{d.strftime('%Y-%m-%d')} (W{d.isocalendar()[1]})" for d in unique_dates]
-        else:
-            cmp_labels = [d.strftime('%Y-%m-%d') for d in unique_dates]
-
-        product_series = {}
-        for item in cmp_data:
-            pid = str(item['product_id'])
-            pname = item['product_name_snapshot']
-            if pid not in product_series:
-                product_series[pid] = {'name': pname, 'qty': {}, 'rev': {}}
-            
-            d_str = item['date_group'].strftime('%Y') if cmp_group_by=='year' \
-                else (item['date_group'].strftime('%Y-%m') if cmp_group_by=='month' \
-                    else (f"{item['date_group'].strftime('%Y-%m-%d')} (W{item['date_group'].isocalendar()[1]})" if cmp_group_by=='week' \
-                        else item['date_group'].strftime('%Y-%m-%d')
-                        )
-                    )
-            product_series[pid]['qty'][d_str] = int(item['daily_qty'])
-            product_series[pid]['rev'][d_str] = float(item['daily_rev'])
-
-        for pid, data in product_series.items():
-            r, g, b = random.randint(50, 220), random.randint(50, 220), random.randint(50, 220)
-            color_base = f"{r}, {g}, {b}"
-            
-            # 根据用户的选择 (cmp_metric) 决定放入哪些线段
-            if cmp_metric in ['both', 'revenue']:
-                rev_array = [data['rev'].get(label, 0) for label in cmp_labels]
-                cmp_datasets.append({
-                    'label': f"{data['name']} (Revenue ¥)",
-                    'data': rev_array,
-                    'borderColor': f'rgba({color_base}, 1)',
-                    'backgroundColor': f'rgba({color_base}, 0.1)',
-                    'yAxisID': 'y-revenue',
-                    'tension': 0.3,
-                    'fill': True
-                })
-                
-            if cmp_metric in ['both', 'quantity']:
-                qty_array = [data['qty'].get(label, 0) for label in cmp_labels]
-                cmp_datasets.append({
-                    'label': f"{data['name']} (Quantity)",
-                    'data': qty_array,
-                    'borderColor': f'rgba({color_base}, 0.8)',
-                    'borderDash': [5, 5],
-                    'yAxisID': 'y-quantity',
-                    'tension': 0.3,
-                    'fill': False
-                })
-
-    # ==========================================
-    # 模块 3：所有商品销售额占比扇形图 (Pie Chart)
-    # ==========================================
-    pie_start_str = request.GET.get('pie_start_date')
-    pie_end_str = request.GET.get('pie_end_date')
-    
-    pie_orders = valid_orders
-    
-    if pie_start_str:
-        pie_start = parse_date(pie_start_str)
-        if pie_start: pie_orders = pie_orders.filter(created_at__date__gte=pie_start)
-    if pie_end_str:
-        pie_end = parse_date(pie_end_str)
-        if pie_end: pie_orders = pie_orders.filter(created_at__date__lte=pie_end)
-
-    if pie_start_str and pie_end_str:
-        pie_date_range_info = f"From {pie_start_str} to {pie_end_str}"
-    elif pie_start_str:
-        pie_date_range_info = f"Since {pie_start_str}"
-    elif pie_end_str:
-        pie_date_range_info = f"Until {pie_end_str}"
-    else:
-        pie_date_range_info = "All Time Data"
-
-    # 聚合这段时间内的总销售额
-    pie_stats = OrderItem.objects.filter(order__in=pie_orders) \
-        .values('product_name_snapshot') \
-        .annotate(total_rev=Sum(F('quantity') * F('unit_price_snapshot'))) \
-        .filter(total_rev__gt=0) \
-        .order_by('-total_rev')
-
-    pie_labels = [item['product_name_snapshot'] for item in pie_stats]
-    pie_data = [float(item['total_rev']) for item in pie_stats]
-    pie_colors = [f"rgba({random.randint(50,220)}, {random.randint(100,200)}, {random.randint(150,250)}, 0.7)" for _ in pie_labels]
-
-    
-
-    # 准备传给 Chart.js 的数据格式
-    labels = []
-    totals = []
-    for item in revenue_data:
-        if item['date_group']:
-            # 根据粒度格式化显示标签
-            if group_by == 'year':
-                labels.append(item['date_group'].strftime('%Y'))
-            elif group_by == 'month':
-                labels.append(item['date_group'].strftime('%Y-%m'))
-            elif group_by == 'week':
-                labels.append(f"{item['date_group'].strftime('%Y-%m-%d')} (W{item['date_group'].isocalendar()[1]})")
-            else:
-                labels.append(item['date_group'].strftime('%Y-%m-%d'))
-            totals.append(float(item['daily_total']))
-
-    # ==========================================
-    # 更新 Context
-    # ==========================================
+    params = request.GET
     context = {
-        # 原有的 context 变量保持不变...
-        'top_products': top_products,
-        'labels': labels,
-        'totals': totals,
-        'start_date': start_date_str,
-        'end_date': end_date_str,
-        'group_by': group_by,
-        
-        # 追加的新变量
-        'all_products': all_products,
-        'selected_pids': selected_pids,
-        'cmp_start_date': cmp_start_str,
-        'cmp_end_date': cmp_end_str,
-        'cmp_group_by': cmp_group_by,
-        'cmp_labels': json.dumps(cmp_labels),
-        'cmp_datasets': json.dumps(cmp_datasets),
-        'cmp_metric': cmp_metric,
+        'top_products': _analytics_panel('top', params)['top_products'],
+        'start_date': params.get('start_date'),
+        'end_date': params.get('end_date'),
+        'group_by': params.get('group_by', 'day'),
+
+        'all_products': Product.objects.all().values('id', 'name'),
+        'selected_pids': params.getlist('selected_products'),
+        'cmp_start_date': params.get('cmp_start_date'),
+        'cmp_end_date': params.get('cmp_end_date'),
+        'cmp_group_by': params.get('cmp_group_by', 'day'),
+        'cmp_metric': params.get('cmp_metric', 'both'),
 
         # Pie Chart 模块参数
-        'pie_start_date': pie_start_str,
-        'pie_end_date': pie_end_str,
-        'pie_labels': json.dumps(pie_labels),
-        'pie_data': json.dumps(pie_data),
-        'pie_colors': json.dumps(pie_colors),
-        'pie_date_range_info': pie_date_range_info,
+        'pie_start_date': params.get('pie_start_date'),
+        'pie_end_date': params.get('pie_end_date'),
+
+        # 缓存命中统计 (运维查看)
+        'analytics_cache_stats': analytics_cache_stats(),
     }
     return render(request, 'core/analytics.html', context)
 
+
+@login_required(login_url='core:login')
+def analytics_panel_data(request, panel):
+    """单个图表面板的 JSON 数据 (revenue / comparison / pie)，只重新计算被修改筛选条件的面板"""
+    if request.user.role != 'Admin':
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    if panel not in ANALYTICS_PANELS:
+        return JsonResponse({'error': 'Unknown panel'}, status=404)
+    return JsonResponse(_analytics_panel(panel, request.GET))
+
+
 # ==============================
 # 7. Block T: 訂單評論功能 (每个订单只能评论一次，同时为每个商品创建评论)
 # ==============================
@@ -744,16 +794,20 @@ def add_order_review(request, order_id):
             messages.error(request, "Please provide both rating and comment.")
             return redirect('core:order_detail', pk=order_id)
         
-        # 为订单中的每个商品创建评论
-        for item in order.items.all():
-            if item.product:
-                Review.objects.create(
-                    order=order,
-                    user=request.user,
-                    product=item.product,  # 关联到商品
-                    rating=int(rating),
-                    comment=comment
-                )
+        # 为订单中的每个商品创建评论，并在同一事务中更新商品的评分汇总
+        with transaction.atomic():
+            created = []
+            for item in order.items.all():
+                if item.product_id:
+                    review = Review.objects.create(
+                        order=order,
+                        user=request.user,
+                        product_id=item.product_id,  # 关联到商品
+                        rating=int(rating),
+                        comment=comment
+                    )
+                    created.append((review.product_id, review.rating))
+            record_rating_changes(rating_deltas(created))
         
         messages.success(request, "Your review has been submitted successfully!")
     
@@ -773,11 +827,20 @@ def edit_order_review(request, review_id):
         comment = request.POST.get('comment')
         
         if rating and comment:
-            # 更新该订单下所有商品的评论
-            Review.objects.filter(order=order, user=request.user).update(
-                rating=int(rating),
-                comment=comment
-            )
+            # 更新该订单下所有商品的评论，评分汇总按新旧评分的差值调整
+            with transaction.atomic():
+                reviews = Review.objects.select_for_update().filter(order=order, user=request.user)
+                old = list(reviews.values_list('product_id', 'rating'))
+                reviews.update(
+                    rating=int(rating),
+                    comment=comment
+                )
+                # 评论数不变，只调整评分总和
+                deltas = {}
+                for product_id, old_rating in old:
+                    if product_id is not None:
+                        deltas[product_id] = (0, deltas.get(product_id, (0, 0))[1] + int(rating) - old_rating)
+                record_rating_changes(deltas)
             messages.success(request, "Your review has been updated!")
         else:
             messages.error(request, "Please provide both rating and comment.")
@@ -795,8 +858,12 @@ def delete_order_review(request, review_id):
     review = get_object_or_404(Review, id=review_id, user=request.user)
     order_id = review.order.id
     
-    # 删除该订单下所有评论
-    Review.objects.filter(order=review.order, user=request.user).delete()
+    # 删除该订单下所有评论，并从商品的评分汇总中减去
+    with transaction.atomic():
+        reviews = Review.objects.select_for_update().filter(order=review.order, user=request.user)
+        removed = list(reviews.values_list('product_id', 'rating'))
+        reviews.delete()
+        record_rating_changes(rating_deltas(removed, sign=-1))
     
     messages.success(request, "Your review has been deleted.")
     return redirect('core:order_detail', pk=order_id)
@@ -155,3 +155,42 @@ LOGOUT_REDIRECT_URL = 'core:product_list'
 
 # 3. 如果未登录用户访问受保护页面，跳转到这个登录页
 LOGIN_URL = 'core:login'
+
+# 4. 购物车库存预占的有效时间 (分钟)，过期的预占由 release_expired_reservations 命令释放
+STOCK_RESERVATION_MINUTES = 15
+
+# 5. 报表图表结果缓存时间 (秒)；订单新增或状态变化时会提前失效
+ANALYTICS_CACHE_TIMEOUT = 300
+
+# 6. 商品图片缩略图是否在后台线程生成 (False 时在保存请求中同步生成，便于调试)
+IMAGE_VARIANTS_ASYNC = True
+
+# 7. 媒体文件交给前端 Web 服务器发送：None (Django 流式发送) / 'x-sendfile' (Apache) / 'x-accel-redirect' (nginx)
+MEDIA_SENDFILE_BACKEND = None
+# nginx 中指向 MEDIA_ROOT 的 internal location，例如:
+#   location /protected-media/ { internal; alias /path/to/media/; }
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# 8. 商品目录分面计数缓存时间 (秒)；商品、属性或评分变化时会提前失效
+FACET_CACHE_TIMEOUT = 300
+
+# 9. 未登录访问者的商品列表 / 详情页整页缓存，以及商品卡片、分类导航片段缓存的时间 (秒)；
+#    商品、图片、库存、评论或分类变化时会提前失效
+PAGE_CACHE_TIMEOUT = 60
+
+# 10. 缓存后端：所有 worker 进程 (以及 release_expired_reservations 等命令) 必须共用同一个缓存，
+#     否则一个进程里更换的版本号 (页面、分面计数、分类导航、购物车角标、报表) 其它进程看不到，
+#     旧内容会一直留到 TTL 过期 (timeout=None 的则一直不失效)。
+#     默认用数据库缓存表 (migrate 时由 core 0025 迁移执行 createcachetable 创建)；
+#     有 Redis 时建议改为:
+#       'BACKEND': 'django.core.cache.backends.redis.RedisCache',  # 需要 pip install redis
+#       'LOCATION': 'redis://127.0.0.1:6379/1',
+#     不要使用 LocMemCache (每个进程各自一份)，除非只运行单个进程 (例如 runserver 调试)。
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+        # 超过上限时删掉三分之一的条目；被删掉的版本号只会造成一次未命中
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}